@@ -1,5 +1,10 @@
+from . import compression
 from . import database
 from . import lfs
+from . import lru_cache
 from . import misc
 from . import network
+from . import serializer
+from . import sql_stats
+from . import support_store
 
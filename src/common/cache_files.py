@@ -1,10 +1,17 @@
 from datetime import datetime 
 import time 
+import asyncio
 import json
-from dotenv import load_dotenv # Library: python-dotenv -- allows handling of .env files
+try:
+    from dotenv import load_dotenv # Library: python-dotenv -- allows handling of .env files
+except ImportError:
+    def load_dotenv(): # Optional: only the legacy file system cache reads .env files
+        return False
 import sys
 from pathlib import Path
 from loguru import logger
+from common import lru_cache
+from common import misc
 
 
 CACHE_LOCATION = "cache"
@@ -21,6 +28,26 @@ CACHE_ON_START = False # If true, the application will populate or update its ca
 
 INITIALIZED = False # If true, the support file acquisition mechanism has been successfully initialized.
 
+# In-memory support file content for get_support_file(), keyed by support file name 
+# ("[version]/[file]") or by support_key(). Byte-budgeted and evicted least recently
+# used first. The budget may be set with the SUPPORT_CACHE_MB environment variable.
+# Only the legacy OSCAL class (oscal.py) calls get_support_file(). Imported content 
+# is validated by the import workers (see oscal_importer), which compile their own schemas.
+SUPPORT_FILES = lru_cache.LRU_cache(lru_cache.DEFAULT_CAPACITY, "support-files")
+
+# When set (see use_support_database), support files are looked up in the
+# OSCAL support database with one indexed query, instead of the legacy
+# local datastore and GitHub path.
+SUPPORT_DATABASE = None
+SERVICE_FILE_TYPES = {
+    "xml-validation" : "xml-schema",
+    "json-validation": "json-schema",
+    "yaml-validation": "json-schema",
+    "xml-to-json"    : "xml-to-json",
+    "json-to-xml"    : "json-to-xml",
+    "metaschema-root": "metaschema"
+}
+
 
 OUT_ERROR = 4
 OUT_WARNING = 2
@@ -31,7 +58,10 @@ class OSCAL_Support_Content:
     def __init__(self, oscal_version, oscal_model, oscal_service):
         # status = False
         self.oscal_model = oscal_model
-        self.oscal_version = valid_version(oscal_version) # if OSCAL version is valid, returns a normalized representation.
+        if SUPPORT_DATABASE is None:
+            self.oscal_version = valid_version(oscal_version) # if OSCAL version is valid, returns a normalized representation.
+        else:
+            self.oscal_version = oscal_version # Validated by the support database lookup
         self.oscal_service = oscal_service # "xml-validation", "json-validation", "xml-to-json", "json-to-xml"
         self.file_name = ""
         self.acquired = False
@@ -126,6 +156,9 @@ def get_support_file(oscal_version, oscal_model, oscal_service):
     global GitHub_raw_root, GitHub_repo
     global GITHUB_AVAILABLE, LOCAL_AVAILABLE
 
+    if SUPPORT_DATABASE is not None:
+        return get_support_file_from_database(oscal_version, oscal_model, oscal_service)
+
     if not INITIALIZED:
         support_startup()
 
@@ -158,11 +191,11 @@ def get_support_file(oscal_version, oscal_model, oscal_service):
             out.output("Fetching " + support_obj.file_name)
 
             # Is support file in memory?
-            if support_obj.file_name in SUPPORT_FILES:
-                support_obj = SUPPORT_FILES[support_obj.file_name]
+            cached_content = SUPPORT_FILES.get(support_obj.file_name)
+            if cached_content is not None:
+                support_obj.content = cached_content
                 support_obj.in_memory = True
                 support_obj.acquired = True
-                # content = SUPPORT_FILES[support_obj.file_name]
                 out.output("Found support file in memory")
             else: 
                 out.output("Support file not found in memory")
@@ -216,12 +249,101 @@ def get_support_file(oscal_version, oscal_model, oscal_service):
 
     if support_obj.in_memory or support_obj.in_datastore or support_obj.in_github:
         support_obj.acquired = True
+        if not support_obj.in_memory:
+            SUPPORT_FILES.put(support_obj.file_name, support_obj.content)
         return support_obj # True, support_obj.file_name, content
     else:
         support_obj.acquired = False
         out.output("Support file not found! (" + support_obj.file_name + ")", "ERROR")
         return None # False, "", ""
     
+# Uses an OSCAL support database (an OSCAL_support object) for get_support_file().
+# Pass None to return to the legacy local datastore and GitHub path.
+def use_support_database(support):
+    global SUPPORT_DATABASE
+    SUPPORT_DATABASE = support
+
+# The SUPPORT_FILES key of a support file looked up in the support database.
+# Content declares "1.1.2" and releases are tagged "v1.1.2". Both share a key.
+def support_key(oscal_version, oscal_model, file_type):
+    oscal_version = oscal_version.lower()
+    if not oscal_version.startswith("v"):
+        oscal_version = f"v{oscal_version}"
+    return f"{oscal_version}/{oscal_model}/{file_type}"
+
+# Drops support file content held in memory after the support database changes.
+# Drops one support file, or every cached support file if none is named.
+def forget_support_files(oscal_version=None, oscal_model=None, file_type=None):
+    if oscal_version is None:
+        SUPPORT_FILES.clear()
+    else:
+        SUPPORT_FILES.remove(support_key(oscal_version, oscal_model, file_type))
+
+# Prepares a support database lookup. Looks in memory first.
+# Returns the OSCAL_Support_Content object, its support_key() and file type. The object
+# is already acquired if it was in memory. Returns None if the service is not handled.
+def __support_lookup(oscal_version, oscal_model, oscal_service):
+    file_type = SERVICE_FILE_TYPES.get(oscal_service, "")
+    if oscal_service == "metaschema-root":
+        oscal_model = "complete"
+    if file_type == "":
+        logger.warning(f"{oscal_service} is an unrecognized or unhandled OSCAL service.")
+        return None, "", ""
+
+    support_obj = OSCAL_Support_Content(oscal_version, oscal_model, oscal_service)
+    key = support_key(oscal_version, oscal_model, file_type)
+    cached = SUPPORT_FILES.get(key)
+    if cached is not None:
+        support_obj.file_name, support_obj.content = cached
+        support_obj.in_memory = True
+        support_obj.acquired = True
+    return support_obj, key, file_type
+
+# Completes a support database lookup with the support database result,
+# and holds the content in memory for the next lookup.
+def __support_found(support_obj, key, support):
+    if support is None:
+        logger.error(f"Support file not found! ({key})")
+        return None
+    support_obj.file_name = support["filename"]
+    support_obj.url = support["original_location"]
+    support_obj.content = support["content"].decode("utf-8") # As from the legacy datastore
+    support_obj.in_datastore = True
+    support_obj.acquired = True
+    SUPPORT_FILES.put(key, (support_obj.file_name, support_obj.content), len(support_obj.content))
+    return support_obj
+
+# The get_support_file() lookup when a support database is in use.
+# Looks in memory first, then makes one indexed query of the support database.
+# The query blocks, so this is for worker threads and scripts only. On a thread
+# running an event loop (ie the GUI thread), use get_support_file_async() instead.
+# Returns an OSCAL_Support_Content object, or None if the support file is not learned.
+def get_support_file_from_database(oscal_version, oscal_model, oscal_service):
+    support_obj, key, file_type = __support_lookup(oscal_version, oscal_model, oscal_service)
+    if support_obj is None or support_obj.acquired:
+        return support_obj
+    try:
+        asyncio.get_running_loop()
+        logger.error(f"Support file {key} requested from an event loop thread. Use get_support_file_async().")
+        return None
+    except RuntimeError:
+        pass # No event loop on this thread, so the query may block
+    support = SUPPORT_DATABASE.lookup_support(oscal_version, support_obj.oscal_model, file_type)
+    return __support_found(support_obj, key, support)
+
+# The same as get_support_file() with a support database in use, for coroutines.
+# The query runs on the database reader threads, so the event loop is not blocked.
+# Returns an OSCAL_Support_Content object, or None if the support file is not learned.
+async def get_support_file_async(oscal_version, oscal_model, oscal_service):
+    if SUPPORT_DATABASE is None:
+        logger.error("get_support_file_async() requires a support database. See use_support_database().")
+        return None
+    support_obj, key, file_type = __support_lookup(oscal_version, oscal_model, oscal_service)
+    if support_obj is None or support_obj.acquired:
+        return support_obj
+    support = await SUPPORT_DATABASE.get_support(oscal_version, support_obj.oscal_model, file_type)
+    return __support_found(support_obj, key, support)
+
 # Accepts a version_query
 # If found, returns the normalized OSCAL version string representation.
 # Otherwise returns an empty string
@@ -584,6 +706,14 @@ def __caching_setup(force_update = False):
 
     GITHUB_API_TOKEN = misc.handle_environment_variables('GITHUB_API_TOKEN', verbose= False, error_only=False)
 
+    support_cache_mb = misc.handle_environment_variables('SUPPORT_CACHE_MB', verbose= False, error_only=False)
+    if support_cache_mb:
+        try:
+            SUPPORT_FILES.resize(int(support_cache_mb) * 1024 * 1024)
+            logger.info(f"Support file memory cache set to {support_cache_mb} MB.")
+        except ValueError:
+            logger.warning("SUPPORT_CACHE_MB must be a whole number of megabytes. Using the default.")
+
     DATASTORE = misc.handle_environment_variables("DATASTORE")
     if DATASTORE != "":
         temp = DATASTORE
@@ -0,0 +1,201 @@
+# Filecache Compression Codecs
+# Compresses and decompresses filecache content, whole or in chunks.
+# Each filecache entry records the codec it was stored with, so the codec
+# or level can change without affecting content that is already stored.
+# zstd is required (see requirements.txt), so content stored with the
+# defaults can be read on every install. lz4 is optional, and is not used
+# by default. If a codec is absent, zlib is used in its place.
+import time
+import zlib
+
+from loguru import logger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+CODEC_NONE = "none"
+CODEC_ZLIB = "zlib"
+CODEC_ZSTD = "zstd"
+CODEC_LZ4  = "lz4"
+
+DEFAULT_CODEC = (CODEC_ZSTD, 3) # Used for file types not in FILE_TYPE_CODECS
+
+# Codec and level by filecache file_type.
+# Support files are written once and read often. zstd decompresses at
+# the same speed whatever the level, so they use a high level.
+FILE_TYPE_CODECS = {
+    "metaschema"   : (CODEC_ZSTD, 19),
+    "xml-schema"   : (CODEC_ZSTD, 19),
+    "json-schema"  : (CODEC_ZSTD, 19),
+    "xml-to-json"  : (CODEC_ZSTD, 19),
+    "json-to-xml"  : (CODEC_ZSTD, 19),
+    "control-index": (CODEC_ZSTD, 1)   # Rebuilt often. Loaded on every project open.
+}
+
+# -----------------------------------------------------------------------------
+def available(codec) -> bool:
+    """Returns True if the codec can be used on this system."""
+    if codec == CODEC_ZSTD:
+        return zstandard is not None
+    if codec == CODEC_LZ4:
+        return lz4 is not None
+    return codec in (CODEC_NONE, CODEC_ZLIB)
+
+# -----------------------------------------------------------------------------
+def choose(file_type=""):
+    """
+    Returns the (codec, level) to store a file type with.
+    Falls back to zlib if the preferred codec is not installed.
+    """
+    codec, level = FILE_TYPE_CODECS.get(file_type, DEFAULT_CODEC)
+    if not available(codec):
+        codec, level = CODEC_ZLIB, (1 if codec == CODEC_LZ4 else min(max(level, 1), 9))
+    return codec, level
+
+# -----------------------------------------------------------------------------
+def stored_codec(codec, compressed) -> str:
+    """
+    Returns the codec of a filecache entry.
+    Entries stored before the codec field existed only have the
+    compressed flag, which always meant zlib.
+    """
+    if codec:
+        return codec
+    return CODEC_ZLIB if compressed == 1 else CODEC_NONE
+
+# -----------------------------------------------------------------------------
+def compress(data, codec, level=0) -> bytes:
+    """Compresses bytes with a codec."""
+    compressor = Compressor(codec, level)
+    return compressor.compress(data) + compressor.flush()
+
+# -----------------------------------------------------------------------------
+def decompress(data, codec) -> bytes:
+    """Decompresses bytes stored with a codec."""
+    decompressor = Decompressor(codec)
+    return decompressor.decompress(data) + decompressor.flush()
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class Compressor:
+    """
+    Incremental compression with any codec.
+    - compress(chunk): Returns the compressed bytes available so far
+    - flush(): Returns the remaining compressed bytes
+    """
+    def __init__(self, codec, level=0):
+        self.codec = codec
+        self.__started = False
+        if codec == CODEC_ZSTD:
+            self.__engine = zstandard.ZstdCompressor(level=level or 3).compressobj()
+        elif codec == CODEC_LZ4:
+            self.__engine = lz4.frame.LZ4FrameCompressor(compression_level=level)
+        elif codec == CODEC_ZLIB:
+            self.__engine = zlib.compressobj(level or zlib.Z_DEFAULT_COMPRESSION)
+        elif codec == CODEC_NONE:
+            self.__engine = None
+        else:
+            raise ValueError(f"Unsupported compression codec: {codec}")
+
+    def compress(self, chunk) -> bytes:
+        if self.__engine is None:
+            return bytes(chunk)
+        if self.codec == CODEC_LZ4 and not self.__started:
+            self.__started = True
+            return self.__engine.begin() + self.__engine.compress(chunk)
+        return self.__engine.compress(chunk)
+
+    def flush(self) -> bytes:
+        if self.__engine is None:
+            return b""
+        if self.codec == CODEC_LZ4 and not self.__started:
+            self.__started = True
+            return self.__engine.begin() + self.__engine.flush()
+        return self.__engine.flush()
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class Decompressor:
+    """
+    Incremental decompression with any codec.
+    - decompress(chunk): Returns the decompressed bytes available so far
+    - flush(): Returns the remaining decompressed bytes
+    """
+    def __init__(self, codec):
+        self.codec = codec
+        if codec in (CODEC_ZSTD, CODEC_LZ4) and not available(codec):
+            raise ValueError(f"Content was stored with {codec}, which is not installed.")
+        if codec == CODEC_ZSTD:
+            self.__engine = zstandard.ZstdDecompressor().decompressobj()
+        elif codec == CODEC_LZ4:
+            self.__engine = lz4.frame.LZ4FrameDecompressor()
+        elif codec == CODEC_ZLIB:
+            self.__engine = zlib.decompressobj()
+        elif codec == CODEC_NONE:
+            self.__engine = None
+        else:
+            raise ValueError(f"Unsupported compression codec: {codec}")
+
+    def decompress(self, chunk) -> bytes:
+        if self.__engine is None:
+            return bytes(chunk)
+        return self.__engine.decompress(chunk)
+
+    def flush(self) -> bytes:
+        if self.codec == CODEC_ZLIB:
+            return self.__engine.flush()
+        return b""
+
+# -----------------------------------------------------------------------------
+def benchmark(samples, repeat=5):
+    """
+    Compares the stored size and decompression time of each available
+    codec and level on sample content.
+    samples: A dict of {name: bytes}
+    repeat: Decompressions timed per sample. The fastest is reported.
+    Returns a list of dicts (codec, level, size, ratio, compress_ms, decompress_ms),
+    one per codec and level, totalled over all samples.
+    """
+    candidates = [(CODEC_NONE, 0), (CODEC_ZLIB, 1), (CODEC_ZLIB, 6), (CODEC_ZLIB, 9),
+                  (CODEC_ZSTD, 3), (CODEC_ZSTD, 9), (CODEC_ZSTD, 19), (CODEC_LZ4, 0)]
+    original = sum(len(content) for content in samples.values())
+    results = []
+    for codec, level in candidates:
+        if not available(codec):
+            logger.debug(f"{codec} is not installed. Skipped.")
+            continue
+        size = 0
+        compress_time = 0.0
+        decompress_time = 0.0
+        for content in samples.values():
+            start = time.perf_counter()
+            stored = compress(content, codec, level)
+            compress_time += time.perf_counter() - start
+            size += len(stored)
+            fastest = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                decompress(stored, codec)
+                elapsed = time.perf_counter() - start
+                fastest = elapsed if fastest is None else min(fastest, elapsed)
+            decompress_time += fastest
+        results.append({
+            "codec": codec,
+            "level": level,
+            "size": size,
+            "ratio": (size / original) if original else 0.0,
+            "compress_ms": compress_time * 1000,
+            "decompress_ms": decompress_time * 1000
+        })
+    return results
+
+# =============================================================================
+#  --- MAIN: Only runs if the module is executed stand-alone. ---
+# =============================================================================
+if __name__ == '__main__':
+    print("Filecache Compression Library. Not intended to be run as a stand-alone file.")
@@ -12,16 +12,33 @@ import sqlite3
 from loguru import logger
 from . import misc
 from . import type_sqlite3
+from . import sql_stats
 import asyncio
+import itertools
+import time
+import os
+import concurrent.futures
+from datetime import datetime, timedelta
 
 # List of supported databses:
 # - sqlite3: SQLite 3
 # - Others TBD: PostgreSQL, MS-SQL, MySQL
 SUPPORTED={"sqlite3": "SQLite 3"}
 
+READ_WORKERS = 4         # Threads that run awaited reads, each with its own connection
+QUERY_BATCH_SIZE = 500   # Rows fetched at a time by iterate()
+GC_BATCH_SIZE = 200      # Unreferenced filecache entries deleted per transaction by collect_garbage()
+GC_GRACE_SECONDS = 3600  # Entries acquired more recently are never collected. They may not be referenced yet.
+COMPACT_STEP_PAGES = 2048 # Pages returned to the file system per write by compact()
+
+# Statement timing for all databases. Off until SQL_STATS.enable() is called.
+SQL_STATS = sql_stats.SQL_stats()
+
 CONTENT_COMPRESSION = True # Set to True to compress the file cache
                             # Set to False for debugging or if inspection
                             # of the raw, downloaded content is required
+                            # The codec and level for each file type are
+                            # set in compression.FILE_TYPE_CODECS
 
 OSCAL_COMMON_TABLES = {}
 OSCAL_COMMON_TABLES["filecache"] = {
@@ -35,17 +52,20 @@ OSCAL_COMMON_TABLES["filecache"] = {
         {"name": "acquired"         , "type": "NUMERIC", "label" : "Acquired"   , "description": "The date and time the file was acquired from the source."},
         {"name": "datatype"         , "type": "TEXT"   , "label" : "Data Type"  , "description": "The original Python data type of the content before it was saved to the database."},
         {"name": "compressed"       , "type": "NUMERIC", "label" : "Compression", "description": "Indicates whether the content was compressed before it was saved to the database."},
+        {"name": "sha256"           , "type": "TEXT"   , "label" : "SHA-256"    , "description": "The SHA-256 digest of the content, for content-addressed entries."},
+        {"name": "codec"            , "type": "TEXT"   , "label" : "Codec"      , "description": "The compression codec of the content (none, zlib, zstd or lz4).",
+            "backfill": "CASE WHEN compressed = 1 THEN 'zlib' ELSE 'none' END"},
         {"name": "content"          , "type": "BLOB"   , "hide": True           , "description": "The content of the file."}
     ],
     "table_indexes": [
-        {"name": "oscal_version", "fields": ["oscal_version"]},
-        {"name": "file_type"    , "fields": ["file_type"]}
+        {"name": "file_type"    , "fields": ["file_type"]},
+        {"name": "sha256"       , "fields": ["sha256"]}
     ]
 }
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 class Database:
-    def __init__(self, type, target):
+    def __init__(self, type, target, mirror=False):
         """
         Creates a database object and opens the database.
         type: The type of database. Supported types:
@@ -53,10 +73,14 @@ class Database:
         target:
             - For sqlite3 this is the path and filename of the database
             - Otherwise, this is the connection string for the database
+        mirror: Serve reads from an in-memory copy of the database, 
+            loaded by refresh_mirror(). For read-mostly databases (sqlite3 only).
         """
         self.target = target # The path and filename of the database
         self.type = type     # The type of database (sqlite3, mysql, etc.)
-        self.conn = None     # The database connection object
+        self.mirror = mirror # True if reads are to be served from memory
+        self.connections = None # The connection manager (per-thread readers and a single writer)
+        self.__readers = None   # Executor for awaited reads. Created on first use.
         self.cursor = None   # The database cursor object
         self.status = False  # True if open and ready for use
         self.last_operation = "" # The last operation performed on the database
@@ -74,15 +98,82 @@ class Database:
         return ret_val
     # -------------------------------------------------------------------------
     def __del__(self):
-        if self.conn:
-            self.conn.close()            
+        self.close()
+
+    # -------------------------------------------------------------------------
+    def close(self):
+        """Finishes queued writes and closes the database."""
+        if self.__readers:
+            self.__readers.shutdown(wait=False)
+            self.__readers = None
+        if self.connections:
+            self.connections.close()
+            self.connections = None
+
+    # -------------------------------------------------------------------------
+    @property
+    def conn(self):
+        """
+        The calling thread's database connection, for reads.
+        Each thread (including worker threads) gets its own connection.
+        Writes go through write() instead.
+        """
+        if self.connections:
+            return self.connections.reader()
+        return None
+
+    # -------------------------------------------------------------------------
+    def write(self, function, *args):
+        """
+        Runs function(connection, *args) on the single writer connection
+        and returns its result. Writes are queued, so they never contend
+        with each other, and do not block readers.
+        """
+        return self.connections.write(function, *args)
+
+    # -------------------------------------------------------------------------
+    async def write_async(self, function, *args):
+        """
+        As write(), but awaits the writer thread instead of blocking, 
+        so the event loop keeps running while the write is in progress.
+        """
+        return await asyncio.wrap_future(self.connections.submit(function, *args))
+
+    # -------------------------------------------------------------------------
+    def __timed_write(self, conn, label, size, function, *args):
+        """Runs function(conn, *args) on the writer thread and records it in SQL_STATS."""
+        with SQL_STATS.timer(label) as timing:
+            timing.bytes_written = size
+            return function(conn, *args)
+
+    # -------------------------------------------------------------------------
+    def __timed_read(self, label, function, size=None):
+        """Runs function() on a reader thread and records it in SQL_STATS. size(result) gives the bytes read."""
+        with SQL_STATS.timer(label) as timing:
+            result = function()
+            if size and SQL_STATS.enabled:
+                timing.bytes_read = size(result)
+            return result
+
+    # -------------------------------------------------------------------------
+    async def read_async(self, function, *args):
+        """
+        Runs function(*args) on a reader thread and awaits the result.
+        The function reads through self.conn, which is the reader thread's 
+        own connection, so the event loop is not blocked.
+        """
+        if self.__readers is None:
+            self.__readers = concurrent.futures.ThreadPoolExecutor(max_workers=READ_WORKERS, thread_name_prefix="db-reader")
+        return await asyncio.get_running_loop().run_in_executor(self.__readers, function, *args)
 
     # -------------------------------------------------------------------------
     def open(self):
         """Executes the correct open function/tasks based on the database type."""
 
         if self.type == "sqlite3":
-            self.conn = type_sqlite3.open_sqlite3(self.target)
+            self.connections = type_sqlite3.SQLite_connections(self.target, mirror=self.mirror)
+            if not self.connections.ready:
+                self.connections = None
         elif self.type in self.supported:
             logger.error(f"Unhandled database type: {self.type}")
         else:
@@ -93,12 +184,14 @@ class Database:
         """
         Check for the presence of the expected tables in the database.
         """
-        # TODO: Check database structure against specified
-        #       structure and modify fields as needed.
+        # TODO: Check field types and attributes against the specified
+        #       structure. Only missing fields are added.
         status = True
         for key in tables:
-            if self.table_exists(key):
-                status = status and True
+            if await self.table_exists(key):
+                fields_added = await self.add_missing_fields(tables[key])
+                indexes_ready = await self.create_indexes(tables[key])
+                status = status and fields_added and indexes_ready
             else:
                 table_exists = await self.create_table(tables[key])
                 status = status and table_exists
@@ -107,19 +200,56 @@ class Database:
 
 
     # -------------------------------------------------------------------------
-    def table_exists(self, name):
+    async def add_missing_fields(self, table_definition):
+        """
+        Adds fields that are in the table definition, but not in the
+        existing table. Allows tables created by earlier versions of the
+        application to be used without being recreated.
+        Existing rows receive NULL in the added fields, unless the field
+        has a "backfill" SQL expression to derive a value from other fields.
+        Returns True if successful (or nothing was missing). False otherwise.
+        """
+        status = True
+        table_name = table_definition.get("table_name", "")
+        if self.type == "sqlite3" and table_name:
+            existing = await self.read_async(self.__table_fields, table_name)
+            statements = []
+            for field in table_definition.get("table_fields", []):
+                if field["name"] not in existing:
+                    logger.info(f"Adding field {field['name']} to table {table_name}")
+                    statements.append(f"ALTER TABLE {table_name} ADD COLUMN {field['name']} {field['type']};")
+                    if "backfill" in field:
+                        statements.append(f"UPDATE {table_name} SET {field['name']} = {field['backfill']};")
+            if statements:
+                status = await self.db_execute(statements)
+        return status
+
+    # -------------------------------------------------------------------------
+    def __table_fields(self, table_name):
+        """Returns the names of the fields in a table. Runs on a reader thread."""
+        cursor = self.conn.cursor()
+        cursor.execute(f"PRAGMA table_info({table_name})")
+        return [row[1] for row in cursor.fetchall()]
+
+    # -------------------------------------------------------------------------
+    async def table_exists(self, name):
         """
         Determines if a table exists in the database
         - name: A string containing the name of the table
         Returns: True if the table exits. False otherwise. 
         """
+        return await self.read_async(self.__table_exists, name)
+
+    # -------------------------------------------------------------------------
+    def __table_exists(self, name):
+        """As table_exists(). Runs on a reader thread."""
         try:
             status = False
 
-            statement = f"SELECT count(name) FROM sqlite_master WHERE type='table' AND name='{name}'"
+            statement = "SELECT count(name) FROM sqlite_master WHERE type='table' AND name = ?"
             # Get the count of tables with the name
             cursor = self.conn.cursor()
-            cursor.execute(statement)
+            cursor.execute(statement, (name,))
 
             # If the count is 1, then table exists
             status = (cursor.fetchone()[0] == 1) 
@@ -145,23 +275,28 @@ class Database:
             logger.error(f"Unrecognized error checking for table {name} ({type(error).__name__}): {str(error)}")
         return status
     # -------------------------------------------------------------------------
-    def record_count(self, table, where_clause):
+    async def record_count(self, table, where_clause, parameters=()):
         """
         Returns the number of records that include a value
         - table: A string containing the name of the table
-        - field: the name of a key field in the table
         - where_clause: The ANSI SQL where clause on which to base the count
+        - parameters: Values for any ? placeholders in the where clause
         Returns: (int) the number of records that match the query
                  (int) 0 if no records found
                  (int) -1 if an error occurs  
         """
+        return await self.read_async(self.__record_count, table, where_clause, parameters)
+
+    # -------------------------------------------------------------------------
+    def __record_count(self, table, where_clause, parameters):
+        """As record_count(). Runs on a reader thread."""
         count = -1
         try:
 
             statement = f"SELECT count(*) FROM {table} WHERE {where_clause}"
             # Get the count of tables with the name
             cursor = self.conn.cursor()
-            cursor.execute(statement)
+            cursor.execute(statement, parameters)
 
             # If the count is 1, then table exists
             count = cursor.fetchone()[0]
@@ -191,54 +326,179 @@ class Database:
     # From: https://en.ittrip.xyz/python/sqlite-error-handling
     async def db_execute(self, SQL_statements):
         """Executes a list of SQL statements in a transaction."""
+        return await self.write_async(self.__db_execute, SQL_statements)
+
+    def __db_execute(self, conn, SQL_statements):
         status = False
-        cursor = self.conn.cursor()
+        cursor = conn.cursor()
 
         try:
             # Start a transaction
-            self.conn.execute('BEGIN TRANSACTION;')
+            conn.execute('BEGIN TRANSACTION;')
 
             if isinstance(SQL_statements, str):
-                logger.debug(f"db_execute: {SQL_statements}")
-                cursor.execute(SQL_statements)
-            
+                SQL_statements = [SQL_statements]
 
             if isinstance(SQL_statements, list):
                 for statement in SQL_statements:
                     logger.debug(f"db_execute: {statement}")
-                    cursor.execute(statement)
+                    with SQL_STATS.timer(statement) as timing:
+                        cursor.execute(statement)
+                        timing.rows = cursor.rowcount
             
             # Commit the transaction
-            self.conn.commit()
+            with SQL_STATS.timer("COMMIT"):
+                conn.commit()
             status = True
         except sqlite3.Error as e:
             # Roll back any changes if an error occurs
             logger.debug(f"Error {e}")
             try:
-                self.conn.rollback()
+                conn.rollback()
                 logger.error("Transaction failed. Rollback was successful.")
             except Exception: 
                 logger.error("Transaction failed. Rollback was NOT successful. Please contact support.")
         # TODO Add fallback error handling
 
         return status
-    async def query(self, SQL_statement):
+    # -------------------------------------------------------------------------
+    async def db_execute_many(self, batches):
+        """
+        Executes statements with bound parameters in a single transaction.
+        batches: A list of (SQL_statement, rows) tuples, where rows is an 
+            iterable of parameter tuples. Each statement is executed once
+            per row. Rows may be produced by a generator, so large loads
+            are not held in memory.
+        Returns: The number of rows affected. -1 if the transaction failed.
+        """
+        return await self.write_async(self.__db_execute_many, batches)
+
+    def __db_execute_many(self, conn, batches):
+        count = -1
+        cursor = conn.cursor()
+
+        try:
+            conn.execute('BEGIN TRANSACTION;')
+            total = 0
+            for statement, rows in batches:
+                logger.debug(f"db_execute_many: {statement}")
+                with SQL_STATS.timer(statement) as timing:
+                    cursor.executemany(statement, rows)
+                    timing.rows = cursor.rowcount
+                total += max(cursor.rowcount, 0)
+            with SQL_STATS.timer("COMMIT"):
+                conn.commit()
+            count = total
+        except (Exception, BaseException) as error:
+            logger.error(f"Transaction failed ({type(error).__name__}): {str(error)}")
+            try:
+                conn.rollback()
+                logger.error("Rollback was successful.")
+            except Exception: 
+                logger.error("Rollback was NOT successful. Please contact support.")
+
+        return count
+
+    # -------------------------------------------------------------------------
+    async def query(self, SQL_statement, parameters=()):
         """
         Executes a query and returns the results.
         SQL_statement: The SQL statement to
             execute.
+        parameters: Values for any ? placeholders in the statement.
+        Returns: A list of dictionaries containing the results.
+        """
+        return await self.read_async(self.query_sync, SQL_statement, parameters)
+
+    # -------------------------------------------------------------------------
+    def query_sync(self, SQL_statement, parameters=()):
+        """
+        Executes a query and returns the results, without awaiting.
+        For callers that are not coroutines. Otherwise, use query().
         Returns: A list of dictionaries containing the results.
         """
         results = []
+        with SQL_STATS.timer(SQL_statement) as timing:
+            cursor = self.__open_cursor(SQL_statement, parameters)
+            if cursor is not None:
+                try:
+                    results = cursor.fetchall()
+                except sqlite3.Error as e:
+                    logger.error(f"Error executing query: {e}")
+                finally:
+                    cursor.close()
+            timing.rows = len(results)
+            if SQL_STATS.enabled:
+                timing.bytes_read = rows_size(results)
+        return results
+
+    # -------------------------------------------------------------------------
+    async def iterate(self, SQL_statement, parameters=(), batch_size=QUERY_BATCH_SIZE):
+        """
+        Executes a query and yields the results one row at a time, 
+        as dictionaries. Rows are fetched in batches, so a large result is
+        never held in memory as a whole.
+        The cursor is opened, read and closed on a thread of its own, with
+        that thread's own connection. Its read transaction lasts until the
+        last batch is fetched, or the caller stops iterating, and holds 
+        back WAL checkpoints until then. Use query() for results that are 
+        small, or when the caller is slow to consume each row.
+        SQL_statement: The SQL statement to execute. 
+        parameters: Values for any ? placeholders in the statement.
+            Bound parameters let the connection reuse the prepared statement.
+        batch_size: The number of rows fetched at a time.
+        Usage: async for row in db.iterate("SELECT ..."):
+        """
+        loop = asyncio.get_running_loop()
+        thread = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-iterate")
+        cursor = None
+        elapsed = 0.0 # Time spent by the caller between rows is not counted
+        count = 0
+        size = 0
+        try:
+            start = time.perf_counter()
+            cursor = await loop.run_in_executor(thread, self.__open_cursor, SQL_statement, parameters)
+            elapsed += time.perf_counter() - start
+            while cursor is not None:
+                start = time.perf_counter()
+                rows = await loop.run_in_executor(thread, cursor.fetchmany, batch_size)
+                elapsed += time.perf_counter() - start
+                if len(rows) < batch_size:
+                    # The last batch. End the read transaction before the caller works through it.
+                    thread.submit(self.__end_iteration, cursor)
+                    cursor = None
+                count += len(rows)
+                if SQL_STATS.enabled:
+                    size += rows_size(rows)
+                for row in rows:
+                    yield row
+        except sqlite3.Error as e:
+            logger.error(f"Error executing query: {e}")
+        finally:
+            # Not awaited, so it also runs if the caller abandons the iteration
+            thread.submit(self.__end_iteration, cursor)
+            thread.shutdown(wait=False)
+            SQL_STATS.record(SQL_statement, elapsed, rows=count, bytes_read=size)
+
+    # -------------------------------------------------------------------------
+    def __end_iteration(self, cursor):
+        """Closes an iterate() cursor and its thread's connection, on the thread that opened them."""
+        if cursor is not None:
+            cursor.close()
+        if self.connections:
+            self.connections.release()
+
+    # -------------------------------------------------------------------------
+    def __open_cursor(self, SQL_statement, parameters):
+        """Executes a query on the calling thread's connection. Returns the cursor, or None."""
         try:
             cursor = self.conn.cursor()
-            cursor.execute(SQL_statement)
-            columns = [column[0] for column in cursor.description]
-            for row in cursor.fetchall():
-                results.append(dict(zip(columns, row)))
+            cursor.row_factory = type_sqlite3.dict_row_factory
+            cursor.execute(SQL_statement, parameters)
+            return cursor
         except sqlite3.Error as e:
             logger.error(f"Error executing query: {e}")
-        return results
+        return None
 
     # -------------------------------------------------------------------------
     async def create_table(self, table_definition):
@@ -280,11 +540,31 @@ class Database:
                     SQLstr += f" {field["attributes"]}"
             SQLstr += ");"
             status = await self.db_execute([SQLstr])
+            if status:
+                status = await self.create_indexes(table_definition)
         else:
             logger.error("Table name not found in table definition.")
 
         return status
     # -------------------------------------------------------------------------
+    async def create_indexes(self, table_definition):
+        """
+        Creates the indexes in a table definition's "table_indexes", 
+        if they do not already exist. Index names are prefixed with the
+        table name (ie "filecache_file_type").
+        Returns True if successful (or there are no indexes). False otherwise.
+        """
+        status = True
+        table_name = table_definition.get("table_name", "")
+        statements = []
+        for index in table_definition.get("table_indexes", []):
+            attributes = index.get("attributes", "")
+            statements.append(f"CREATE {attributes + ' ' if attributes else ''}INDEX IF NOT EXISTS {table_name}_{index['name']} "
+                              f"ON {table_name} ({', '.join(index['fields'])});")
+        if statements:
+            status = await self.db_execute(statements)
+        return status
+    # -------------------------------------------------------------------------
 
     async def insert(self, table_name, table_fields, table_blob_fields={}):
         """
@@ -295,36 +575,55 @@ class Database:
                     "field_name" : "field_value" | field_value,
                     "field_name" : "field_value" | field_value
                     }
-        Field values must be SQL "string ready". 
-        Strings must have single quotes around them,
-           and must be appropriately escaped for the ' character.
+        Field values are bound as parameters. Strings do not need quotes
+           or escaping.
+        Returns True if successful. False otherwise.
         """
-        status = False
         logger.debug(f"Inserting into: {table_name}")
+        return await self.insert_many(table_name, [table_fields])
 
+    # -------------------------------------------------------------------------
+    async def insert_many(self, table_name, rows, fields=None, return_count=False):
+        """
+        Inserts many records into a table in a single transaction, using
+        executemany with bound parameters.
+        table_name: String 
+        rows: An iterable of dicts ({"field_name": field_value, ...}), each 
+              with the same fields. May be a generator.
+              If fields is provided, rows may instead be tuples in that order.
+        fields: A list of field names. Defaults to the keys of the first row.
+        return_count: If True, returns the number of rows inserted (-1 on failure).
+        Returns True if successful. False otherwise.
+        """
+        statement, parameters = bulk_statement("INSERT", table_name, rows, fields)
+        return await self.__bulk_execute(statement, parameters, return_count)
 
-        field_list = []
-        values_list = []
-        for field in table_fields:
-            match table_fields[field]:
-                case str():
-                    field_list.append(field)
-                    values_list.append(f"'{table_fields[field]}'")
-                case int(), float():
-                    field_list.append(field)
-                    values_list.append(table_fields[field])
-                case bool():
-                    field_list.append(field)
-                    values_list.append(misc.iif(table_fields[field], 1, 0))
-                case _:
-                    logger.debug(f"Unhandled variable type: {field} ({str(type(table_fields[field]))})")
-
-        SQLstr = f"INSERT INTO {table_name} ({", ".join(field_list)}) VALUES ({", ".join(values_list)});"
+    # -------------------------------------------------------------------------
+    async def upsert_many(self, table_name, rows, key_fields, fields=None, return_count=False):
+        """
+        Inserts many records into a table, or updates the records that 
+        already exist, in a single transaction with bound parameters.
+        key_fields: A list of the fields that identify a record. They must be
+              the table's primary key or have a unique index.
+        Other arguments are as for insert_many(). Fields absent from the 
+        rows are left unchanged in existing records.
+        Returns True if successful. False otherwise. (Or a count, as for insert_many().)
+        """
+        statement, parameters = bulk_statement("INSERT", table_name, rows, fields)
+        if statement:
+            updates = [f"{field} = excluded.{field}" for field in bulk_fields(statement) if field not in key_fields]
+            statement += f" ON CONFLICT ({', '.join(key_fields)}) DO " + (f"UPDATE SET {', '.join(updates)}" if updates else "NOTHING")
+        return await self.__bulk_execute(statement, parameters, return_count)
 
-        status = await self.db_execute([SQLstr])
+    # -------------------------------------------------------------------------
+    async def __bulk_execute(self, statement, parameters, return_count):
+        count = 0
+        if statement:
+            count = await self.db_execute_many([(statement, parameters)])
+        if return_count:
+            return count
+        return count >= 0
 
-        return status
-    
     # -------------------------------------------------------------------------
     def drop_table(self, table_name):
         """
@@ -359,10 +658,31 @@ class Database:
 
             if self.type == "sqlite3":
                 logger.debug("Storing file in SQLite3 database")
-                status = await type_sqlite3.store_blob_to_db(self.conn, uuid, content, attributes )
+                status = await self.write_async(self.__timed_write, "BLOB WRITE filecache", content_size(content), type_sqlite3.store_blob_to_db, uuid, content, attributes)
             
         return status
     # -------------------------------------------------------------------------
+    async def cache_file_from_path(self, path, uuid, attributes={}):
+        """
+        Stores the content of a file in the filecache table, in chunks,
+        without reading the whole file into memory.
+        path: The file to be cached
+        uuid: The UUID of the new filecache entry
+        attributes: A dictionary of values to be added with the row
+        Returns: True if successful. False otherwise.
+        """
+        status = False
+        logger.debug(f"Caching file {path}" )
+        attributes["compressed"] = CONTENT_COMPRESSION
+
+        if self.type == "sqlite3":
+            try:
+                status = await self.write_async(self.__timed_write, "BLOB WRITE filecache", os.path.getsize(path), type_sqlite3.store_file_to_db, uuid, path, attributes)
+            except (Exception, BaseException) as error:
+                logger.error(f"Unable to cache {path} ({type(error).__name__}): {str(error)}")
+
+        return status
+    # -------------------------------------------------------------------------
     async def retrieve_file(self, uuid):
         """
         Retrieves a file from the filecache table.
@@ -373,13 +693,223 @@ class Database:
         logger.debug(f"Retrieving file using uuid='{uuid}'" )
 
         if self.type == "sqlite3":
-            content_dict = type_sqlite3.retrieve_blob_from_db(self.conn, uuid)
+            content_dict = await self.read_async(self.__timed_read, "BLOB READ filecache", lambda: type_sqlite3.retrieve_blob_from_db(self.conn, uuid),
+                                                 lambda result: content_size(result.get("content")))
 
 
         return content_dict
     # -------------------------------------------------------------------------
+    async def retrieve_file_metadata(self, uuid):
+        """
+        Retrieves the fields of a filecache entry, without reading its content.
+        uuid: The UUID of the file.
+        Returns: A dict of the fields, plus stored_size (the size of the 
+                 stored content). None if not found.
+        """
+        metadata = None
+        if self.type == "sqlite3":
+            try:
+                metadata = await self.read_async(lambda: type_sqlite3.read_blob_metadata(self.conn, uuid))
+            except ValueError as error:
+                logger.debug(str(error))
+            except (Exception, BaseException) as error:
+                logger.error(f"Unable to retrieve {uuid} ({type(error).__name__}): {str(error)}")
+        return metadata
+
+    # -------------------------------------------------------------------------
+    async def retrieve_file_bytes(self, uuid):
+        """
+        Retrieves the stored bytes of a file from the filecache table,
+        without converting them back to the original Python data type.
+        uuid: The UUID of the file to be retrieved.
+        Returns: The bytes if successful. None otherwise.
+        """
+        content = None
+        if self.type == "sqlite3":
+            try:
+                content = await self.read_async(self.__timed_read, "BLOB READ filecache", lambda: type_sqlite3.read_blob_bytes(self.conn, uuid), len)
+            except (Exception, BaseException) as error:
+                logger.error(f"Unable to retrieve {uuid} ({type(error).__name__}): {str(error)}")
+        return content
+
+    # -------------------------------------------------------------------------
+    def vacuum(self):
+        """
+        Rebuilds the database file, returning space left by deleted rows
+        to the file system. Must not be called within a transaction.
+        Returns True if successful. False otherwise.
+        """
+        status = False
+        if self.type == "sqlite3":
+            try:
+                self.write(lambda conn: conn.execute("VACUUM;"))
+                status = True
+            except sqlite3.Error as error:
+                logger.error(f"Unable to vacuum {self.target} ({type(error).__name__}): {str(error)}")
+        return status
+
+    # -------------------------------------------------------------------------
+    async def refresh_mirror(self):
+        """
+        Loads the database into memory, or reloads it after writes, if it
+        was opened with mirror=True. Does nothing if the mirror is current.
+        Until the mirror is reloaded, reads go to the database file.
+        Returns True if reads are served from memory.
+        """
+        if not self.mirror or self.connections is None:
+            return False
+        if self.connections.mirror_stale:
+            started = time.perf_counter()
+            try:
+                await self.write_async(self.__timed_write, "BACKUP to memory", os.path.getsize(self.target), self.connections.reload_mirror)
+                logger.debug(f"Loaded {self.target} into memory in {time.perf_counter() - started:.2f}s")
+            except (sqlite3.Error, OSError, MemoryError) as error:
+                logger.error(f"Unable to load {self.target} into memory ({type(error).__name__}): {str(error)}")
+        return not self.connections.mirror_stale
+
+    # -------------------------------------------------------------------------
+    @property
+    def idle(self):
+        """True if no writes are waiting for the writer thread."""
+        return self.connections is not None and self.connections.pending() == 0
+
+    # -------------------------------------------------------------------------
+    async def collect_garbage(self, references, keep_file_types=(), batch_size=GC_BATCH_SIZE, grace_seconds=GC_GRACE_SECONDS):
+        """
+        Deletes filecache entries that nothing refers to, such as content 
+        from failed downloads or replaced conversions. Entries are deleted 
+        in batches, each in its own transaction, so other writes are 
+        not held up for long.
+        references: A list of (table, field) whose values are filecache UUIDs.
+                    Tables that do not exist are ignored.
+        keep_file_types: filecache file_types that are never collected
+        grace_seconds: Entries acquired within this many seconds are kept
+        Returns the number of entries deleted, or -1 if an error occurs.
+        """
+        conditions = [f"uuid NOT IN (SELECT {field} FROM {table} WHERE {field} IS NOT NULL)"
+                      for table, field in references if await self.table_exists(table)]
+        if not conditions or not await self.table_exists("filecache"):
+            logger.warning(f"No filecache references found in {self.target}. Nothing collected.")
+            return 0
+        parameters = [misc.oscal_date_time_with_timezone(datetime.now() - timedelta(seconds=grace_seconds))]
+        if keep_file_types:
+            conditions.append(f"IFNULL(file_type, '') NOT IN ({', '.join('?' * len(keep_file_types))})")
+            parameters += list(keep_file_types)
+        statement = (f"DELETE FROM filecache WHERE rowid IN (SELECT rowid FROM filecache "
+                     f"WHERE IFNULL(acquired, '') < ? AND {' AND '.join(conditions)} LIMIT ?)")
+
+        total = 0
+        while True:
+            deleted = await self.db_execute_many([(statement, [tuple(parameters) + (batch_size,)])])
+            if deleted < 0:
+                return -1
+            total += deleted
+            if deleted < batch_size:
+                break
+        if total:
+            logger.info(f"Deleted {total} unreferenced filecache entries from {self.target}")
+        return total
+
+    # -------------------------------------------------------------------------
+    async def compact(self, convert=False, step_pages=COMPACT_STEP_PAGES):
+        """
+        Returns unused pages to the file system with incremental vacuum, 
+        a few at a time, so other writes can run in between.
+        Databases created before incremental vacuum was enabled are only
+        compacted if convert is True. They are rebuilt once with VACUUM.
+        Returns the number of pages freed, or -1 if an error occurs.
+        """
+        total = 0
+        if self.type == "sqlite3":
+            try:
+                # Read through the writer. Other connections keep the mode they opened with.
+                if await self.write_async(type_sqlite3.auto_vacuum_mode) != 2:
+                    if not convert:
+                        logger.debug(f"{self.target} does not use incremental vacuum. Not compacted.")
+                        return 0
+                    before = await self.write_async(type_sqlite3.free_pages)
+                    logger.info(f"Converting {self.target} to incremental vacuum")
+                    if not await self.write_async(self.__timed_write, "VACUUM", 0, type_sqlite3.enable_incremental_vacuum):
+                        return -1
+                    total += before
+                while True:
+                    freed = await self.write_async(self.__timed_write, "PRAGMA incremental_vacuum", 0, type_sqlite3.incremental_vacuum, step_pages)
+                    total += freed
+                    if freed < step_pages:
+                        break
+                # With WAL, the file only shrinks once the freed pages are checkpointed
+                await self.write_async(lambda conn: conn.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchall())
+                if total:
+                    logger.info(f"Returned {total} pages to the file system from {self.target}")
+            except sqlite3.Error as error:
+                logger.error(f"Unable to compact {self.target} ({type(error).__name__}): {str(error)}")
+                total = -1
+        return total
+
+    # -------------------------------------------------------------------------
+    async def export_file(self, uuid, path):
+        """
+        Writes the content of a filecache entry directly to a file, in chunks,
+        without converting it back to its original Python data type.
+        The content is never held in memory as a whole.
+        uuid: The UUID of the file to be exported.
+        path: The path and file name to write.
+        Returns: True if successful. False otherwise.
+        """
+        status = False
+        logger.debug(f"Exporting file using uuid='{uuid}' to {path}" )
+
+        if self.type == "sqlite3":
+            try:
+                status = await self.read_async(self.__timed_read, "BLOB EXPORT filecache", lambda: type_sqlite3.export_blob_to_file(self.conn, uuid, path),
+                                               lambda result: os.path.getsize(path))
+            except (Exception, BaseException) as error:
+                logger.error(f"Unable to export {uuid} ({type(error).__name__}): {str(error)}")
+
+        return status
+    # -------------------------------------------------------------------------
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def bulk_statement(verb, table_name, rows, fields=None):
+    """
+    Prepares an INSERT statement with ? placeholders for executemany.
+    Returns (statement, parameters), where parameters yields one tuple per row.
+    Returns ("", []) if there are no rows.
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return "", []
+    if fields is None:
+        fields = list(first.keys())
+
+    def parameters():
+        for row in itertools.chain([first], rows):
+            if isinstance(row, dict):
+                yield tuple(row.get(field) for field in fields)
+            else:
+                yield tuple(row)
+
+    statement = f"{verb} INTO {table_name} ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})"
+    return statement, parameters()
+
+# -----------------------------------------------------------------------------
+def content_size(content) -> int:
+    """Returns the length of bytes or str content. 0 for other types."""
+    return len(content) if isinstance(content, (bytes, bytearray, str)) else 0
+
+# -----------------------------------------------------------------------------
+def rows_size(rows) -> int:
+    """Returns the payload size of query result rows: the length of bytes and str values, 8 for other non-NULL values."""
+    return sum(len(value) if isinstance(value, (bytes, bytearray, str)) else 8 * (value is not None)
+               for row in rows for value in row.values())
+
+# -----------------------------------------------------------------------------
+def bulk_fields(statement):
+    """Returns the field names of a bulk_statement() statement."""
+    return [field.strip() for field in statement[statement.index("(") + 1:statement.index(")")].split(",")]
+
+# -----------------------------------------------------------------------------
 def oscal_datatype(datatype):
     """
     Aligns the datatype to the OSCAL datatype.
@@ -0,0 +1,148 @@
+# Byte-Budgeted LRU Cache
+# In-memory cache for support file content and other large, re-usable
+# objects. Entries are evicted least-recently-used first once the total
+# size of the cached entries exceeds the byte budget.
+import sys
+import threading
+from collections import OrderedDict
+from loguru import logger
+
+DEFAULT_CAPACITY = 64 * 1024 * 1024 # 64 MB
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class LRU_cache:
+    """
+    A byte-budgeted least-recently-used cache.
+
+    Parameters:
+    - capacity (int)[optional]: The byte budget. Defaults to DEFAULT_CAPACITY.
+    - name (str)[optional]: A label used in log messages and stats.
+
+    Methods:
+    - get(key, default=None): Returns a cached value and marks it as recently used
+    - put(key, value, size=None): Adds or replaces a value, evicting as needed
+    - remove(key): Removes a value
+    - clear(): Removes all values
+    - resize(capacity): Changes the byte budget, evicting as needed
+    - stats(): Returns a dict of size, capacity, hit, miss and eviction counts
+
+    Safe to share between the event loop and worker threads.
+    """
+    def __init__(self, capacity=DEFAULT_CAPACITY, name="cache"):
+        self.name = name
+        self.capacity = capacity
+        self.size = 0 # Total bytes of all cached entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries = OrderedDict() # key: (value, size), least recently used first
+        self.__lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    def __contains__(self, key):
+        with self.__lock:
+            return key in self.__entries
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__entries)
+
+    def __str__(self):
+        return f"{self.name}: {len(self)} entries, {self.size:,} of {self.capacity:,} bytes"
+
+    # -------------------------------------------------------------------------
+    def get(self, key, default=None):
+        """Returns the cached value for the key, or the default if not cached."""
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    # -------------------------------------------------------------------------
+    def put(self, key, value, size=None):
+        """
+        Adds or replaces a cached value.
+        - size (int)[optional]: The size of the value in bytes.
+          If absent, it is calculated with entry_size().
+        Returns True if the value was cached.
+        Returns False if the value alone exceeds the byte budget.
+        """
+        if size is None:
+            size = entry_size(value)
+        if size > self.capacity:
+            logger.debug(f"{self.name}: {key} ({size:,} bytes) exceeds the cache capacity. Not cached.")
+            return False
+
+        with self.__lock:
+            if key in self.__entries:
+                self.size -= self.__entries.pop(key)[1]
+            self.__entries[key] = (value, size)
+            self.size += size
+            self.__evict()
+        return True
+
+    # -------------------------------------------------------------------------
+    def remove(self, key):
+        """Removes a value. Returns True if it was cached."""
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[1]
+            return entry is not None
+
+    # -------------------------------------------------------------------------
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.size = 0
+
+    # -------------------------------------------------------------------------
+    def resize(self, capacity):
+        """Changes the byte budget, evicting entries if the cache is now over budget."""
+        with self.__lock:
+            self.capacity = capacity
+            self.__evict()
+
+    # -------------------------------------------------------------------------
+    def stats(self):
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "entries": len(self.__entries),
+                "size": self.size,
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0
+            }
+
+    # -------------------------------------------------------------------------
+    def __evict(self):
+        """Evicts least recently used entries until within budget. Caller holds the lock."""
+        while self.size > self.capacity and self.__entries:
+            key, (_, size) = self.__entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            logger.debug(f"{self.name}: evicted {key} ({size:,} bytes)")
+
+# -----------------------------------------------------------------------------
+def entry_size(value) -> int:
+    """
+    Returns the size in bytes used to account for a cached value.
+    Byte-like values use their length. Other values use sys.getsizeof().
+    """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    return sys.getsizeof(value)
+
+# =============================================================================
+#  --- MAIN: Only runs if the module is executed stand-alone. ---
+# =============================================================================
+if __name__ == '__main__':
+    print("LRU Cache Library. Not intended to be run as a stand-alone file.")
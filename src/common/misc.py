@@ -246,7 +246,7 @@ def datetime_string(date_time = datetime.now(), format = "%Y-%m-%d--%H-%M-%S")->
     return ret_value
 
 # -----------------------------------------------------------------------------
-def oscal_date_time_with_timezone(date_time = datetime.now(), format = "%Y-%m-%dT%H:%M:%SZ")-> str:
+def oscal_date_time_with_timezone(date_time = None, format = "%Y-%m-%dT%H:%M:%SZ")-> str:
     """
     Converts a date and time to UTC and ouptuts an OSCAL date-time-with-timezone string. 
     Optional Parameters:
@@ -261,7 +261,7 @@ def oscal_date_time_with_timezone(date_time = datetime.now(), format = "%Y-%m-%d
     ret_value = ""
 
     try:
-        date_time = date_time.astimezone(timezone.utc)
+        date_time = (date_time or datetime.now()).astimezone(timezone.utc)
         ret_value = date_time.strftime(format)
     except (Exception, BaseException) as error:
         logger.error(f"{type(error).__name__} error handling date/time formatting: {str(error)}")
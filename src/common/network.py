@@ -4,6 +4,22 @@ from . import misc
 import socket
 import aiohttp
 import asyncio
+import random
+import hashlib
+
+# Asynchronous HTTP settings. Adjusted by configure().
+DOWNLOAD_CONCURRENCY = 6    # Maximum simultaneous downloads within a gather_bounded() window
+CONNECT_TIMEOUT      = 10   # Seconds to establish a connection
+READ_TIMEOUT         = 30   # Seconds to wait for the next chunk of a response
+TOTAL_TIMEOUT        = 300  # Seconds for a complete request, including the body
+RETRY_ATTEMPTS       = 4    # Attempts per request, including the first
+RETRY_BASE_DELAY     = 0.5  # Seconds. Doubles with each attempt, with random jitter
+RETRY_MAX_DELAY      = 10   # Seconds. Upper limit of a single retry delay
+RETRY_STATUS         = {408, 429, 500, 502, 503, 504} # HTTP status codes worth retrying
+DOWNLOAD_CHUNK_SIZE  = 64 * 1024 # Bytes read at a time when streaming a download to a file
+
+_session = None      # Shared aiohttp session, with pooled keep-alive connections
+_session_loop = None # The event loop the shared session belongs to
 
 
 def check_internet_connection():
@@ -14,33 +30,177 @@ def check_internet_connection():
     except OSError:
         return False
 
+# -----------------------------------------------------------------------------
+def configure(concurrency=None, timeout=None, retries=None):
+    """
+    Adjusts asynchronous HTTP settings. Arguments that are None are unchanged.
+    - concurrency (int): Maximum simultaneous downloads
+    - timeout (int): Seconds for a complete request
+    - retries (int): Attempts per request, including the first
+    """
+    global DOWNLOAD_CONCURRENCY, TOTAL_TIMEOUT, RETRY_ATTEMPTS
+    if concurrency is not None:
+        DOWNLOAD_CONCURRENCY = max(1, int(concurrency))
+    if timeout is not None:
+        TOTAL_TIMEOUT = max(1, int(timeout))
+    if retries is not None:
+        RETRY_ATTEMPTS = max(1, int(retries))
+    logger.debug(f"Network: concurrency={DOWNLOAD_CONCURRENCY}, timeout={TOTAL_TIMEOUT}s, attempts={RETRY_ATTEMPTS}")
+
+# -----------------------------------------------------------------------------
+async def get_session():
+    """
+    Returns the shared aiohttp session, creating it on first use.
+    A session belongs to one event loop. If called from a different loop
+    (ie the GUI loop after the startup loop) a new session is created.
+    """
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        connector = aiohttp.TCPConnector(limit=max(DOWNLOAD_CONCURRENCY, 10), keepalive_timeout=30, ttl_dns_cache=300)
+        _session = aiohttp.ClientSession(connector=connector)
+        _session_loop = loop
+    return _session
+
+# -----------------------------------------------------------------------------
+async def close_session():
+    """Closes the shared aiohttp session, if open on the running loop."""
+    global _session, _session_loop
+    if _session is not None and not _session.closed and _session_loop is asyncio.get_running_loop():
+        await _session.close()
+    _session = None
+    _session_loop = None
+
+# -----------------------------------------------------------------------------
+def retry_delay(attempt, retry_after=None):
+    """
+    Returns the seconds to wait before the next attempt.
+    Exponential backoff with full jitter, so simultaneous failures 
+    do not retry in lock step. A server's Retry-After value takes precedence.
+    """
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), RETRY_MAX_DELAY)
+        except ValueError:
+            pass # HTTP date form. Use backoff instead.
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+# -----------------------------------------------------------------------------
+async def async_fetch(url, headers=None, response_type="bytes", path=None):
+    """
+    GET a URL using the shared session, with timeouts and retries.
+    - headers (dict)[optional]: Request headers, such as If-None-Match
+    - response_type: "bytes", "json" or "file"
+    - path (str)[optional]: For "file", where to stream the response body.
+      The body is never held in memory. The file is rewritten on each attempt.
+    Returns a tuple of (status, content, response headers).
+    - status is the HTTP status, or 0 if no response was received
+    - content is None unless status is 200. For "file" it is the SHA-256
+      hex digest of the body written to the file.
+    A 304 (Not Modified) response is returned as is, so callers can send 
+    conditional requests. Connection errors, timeouts and RETRY_STATUS
+    responses are retried. Other failures are not.
+    Raises OSError if a "file" response can not be written to path.
+    """
+    timeout = aiohttp.ClientTimeout(total=TOTAL_TIMEOUT, connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+    session = await get_session()
+    status = 0
+    for attempt in range(RETRY_ATTEMPTS):
+        retry_after = None
+        try:
+            async with session.get(url, headers=headers, timeout=timeout) as response:
+                status = response.status
+                if status == 200:
+                    if response_type == "json":
+                        return status, await response.json(), response.headers
+                    if response_type == "file":
+                        return status, await stream_to_file(response, path), response.headers
+                    return status, await response.read(), response.headers
+                if status not in RETRY_STATUS:
+                    if status != 304:
+                        logger.error(f"GET {url} failed with status {status}")
+                    return status, None, response.headers
+                retry_after = response.headers.get("Retry-After")
+                logger.warning(f"GET {url} returned {status} (attempt {attempt + 1} of {RETRY_ATTEMPTS})")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            logger.warning(f"GET {url} failed (attempt {attempt + 1} of {RETRY_ATTEMPTS}) ({type(error).__name__}): {str(error)}")
+        except OSError as error: # Writing a "file" response. Not retried.
+            logger.error(f"Unable to write GET {url} to {path} ({type(error).__name__}): {str(error)}")
+            raise
+        except Exception as error:
+            logger.error(f"Unrecognized error for GET {url} ({type(error).__name__}): {str(error)}")
+            return status, None, {}
+        if attempt + 1 < RETRY_ATTEMPTS:
+            await asyncio.sleep(retry_delay(attempt, retry_after))
+    logger.error(f"GET {url} failed after {RETRY_ATTEMPTS} attempts.")
+    return status, None, {}
+
+# -----------------------------------------------------------------------------
+async def stream_to_file(response, path):
+    """
+    Writes a response body to a file in DOWNLOAD_CHUNK_SIZE chunks,
+    hashing as it goes. The file is opened, written and closed in the
+    default executor, so a slow disk does not block the event loop.
+    Returns the SHA-256 hex digest of the body.
+    Raises OSError if the file can not be written.
+    """
+    loop = asyncio.get_running_loop()
+    digest = hashlib.sha256()
+    file = await loop.run_in_executor(None, open, path, "wb")
+    try:
+        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            await loop.run_in_executor(None, file.write, chunk)
+    finally:
+        await loop.run_in_executor(None, file.close)
+    return digest.hexdigest()
+
+# -----------------------------------------------------------------------------
+async def async_request(url, headers=None, response_type="bytes"):
+    """
+    GET a URL using the shared session, with timeouts and retries.
+    - response_type: "bytes" or "json"
+    Returns the response content, or None if unsuccessful.
+    """
+    _, content, _ = await async_fetch(url, headers=headers, response_type=response_type)
+    return content
+
+# -----------------------------------------------------------------------------
+async def async_download_to_file(url, path, headers=None):
+    """
+    Streams a download to a file, without holding it in memory.
+    Returns the SHA-256 hex digest of the content, or an empty string if unsuccessful.
+    Raises OSError if the file can not be written.
+    """
+    _, digest, _ = await async_fetch(url, headers=headers, response_type="file", path=path)
+    return digest or ""
+
+# -----------------------------------------------------------------------------
+async def gather_bounded(coroutines, width=None):
+    """
+    Runs coroutines concurrently, with at most [width] running at once.
+    A sliding window: each coroutine starts as soon as a running one 
+    finishes, rather than waiting for a whole batch.
+    - width (int)[optional]: Defaults to DOWNLOAD_CONCURRENCY
+    Returns the results in the order of the coroutines.
+    """
+    semaphore = asyncio.Semaphore(width or DOWNLOAD_CONCURRENCY)
+
+    async def windowed(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(windowed(coroutine) for coroutine in coroutines))
+
+# -----------------------------------------------------------------------------
 async def async_api_get(url, headers=None):
     """Asynchronous version of api_get"""
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                if response.status == 200:
-                    return await response.json()
-                else:
-                    logger.error(f"API request failed with status {response.status}")
-                    return None
-    except Exception as e:
-        logger.error(f"Error during API request: {str(e)}")
-        return None
-    
+    return await async_request(url, headers=headers, response_type="json")
+
+# -----------------------------------------------------------------------------
 async def async_download_file(url, filename):
     """Asynchronous version of download_file"""
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    return await response.read()
-                else:
-                    logger.error(f"Download failed with status {response.status}")
-                    return None
-    except Exception as e:
-        logger.error(f"Error downloading file: {str(e)}")
-        return None
+    return await async_request(url)
 
 def api_get(endpoint, http_headers={"Content-type": "application/json"}, timeout_seconds=10):
     """
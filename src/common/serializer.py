@@ -0,0 +1,275 @@
+# Structured Content Serializer
+# Converts lists, dicts and other structured content to bytes for the
+# filecache, and back, with an exact round-trip. Unlike pickle, loading
+# never runs code, so project files can be shared safely.
+#
+# Each payload starts with a header: MAGIC, the format version and the
+# encoding. Content is always written as JSON, which every install can
+# read. orjson is used when installed, as it loads fastest. The types JSON
+# can not represent are tagged (see to_json_safe()). Subclasses of the
+# built-in types are restored as their base type (see type_name()).
+# Payloads written with msgpack by earlier versions are read if msgpack
+# is installed. Payloads written with pickle are still read, but only if
+# they contain nothing beyond plain built-in values.
+import base64
+import io
+import json
+import math
+import pickle
+import time
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MAGIC          = b"CCS"  # CyberCraft serialized content
+FORMAT_VERSION = 1       # Bump when the layout of a payload changes
+ENCODING_MSGPACK     = 1
+ENCODING_JSON        = 2 # JSON with tagged values (see to_json_safe())
+ENCODING_JSON_PLAIN  = 3 # JSON with nothing tagged, so loading needs no conversion
+
+JSON_INT_LIMIT = 2**63   # JSON parsers (including orjson) may read larger integers as floats
+
+JSON_TAG = "__cc_type__" # Marks values JSON cannot represent directly
+
+# msgpack extension type codes
+EXT_TUPLE     = 1
+EXT_SET       = 2
+EXT_FROZENSET = 3
+EXT_BYTEARRAY = 4
+
+# -----------------------------------------------------------------------------
+def dumps(content) -> bytes:
+    """
+    Serializes structured content to bytes, as JSON.
+    Raises TypeError if the content includes a type that can not be serialized.
+    """
+    if json_plain(content):
+        return header(ENCODING_JSON_PLAIN) + json_dumps(content)
+    return header(ENCODING_JSON) + json_dumps(to_json_safe(content))
+
+# -----------------------------------------------------------------------------
+def type_name(content) -> str:
+    """
+    Returns the name of the type loads() restores content as. Subclasses
+    of the built-in types are restored as their base (ie an OrderedDict
+    as a dict), so this is what to record as the stored datatype.
+    """
+    for base in (bool, int, float, str, bytearray, bytes, dict, list, tuple, frozenset, set):
+        if isinstance(content, base):
+            return base.__name__
+    return type(content).__name__
+
+# -----------------------------------------------------------------------------
+def loads(payload):
+    """
+    Restores content serialized by dumps(), or by pickle in earlier versions.
+    Raises ValueError if the payload is not recognized.
+    """
+    payload = bytes(payload)
+    if payload[:len(MAGIC)] == MAGIC:
+        version, encoding = payload[len(MAGIC)], payload[len(MAGIC) + 1]
+        if version > FORMAT_VERSION:
+            raise ValueError(f"Serialized content format {version} is newer than this version supports ({FORMAT_VERSION}).")
+        body = payload[len(MAGIC) + 2:]
+        if encoding == ENCODING_MSGPACK:
+            if msgpack is None:
+                raise ValueError("Content was serialized with msgpack, which is not installed.")
+            return msgpack.unpackb(body, raw=False, strict_map_key=False, ext_hook=_unpack_ext)
+        if encoding in (ENCODING_JSON, ENCODING_JSON_PLAIN):
+            content = orjson.loads(body) if orjson is not None else json.loads(body)
+            return content if encoding == ENCODING_JSON_PLAIN else from_json_safe(content)
+        raise ValueError(f"Unrecognized serialized content encoding: {encoding}")
+    if payload[:1] == b"\x80":
+        return Builtins_unpickler(io.BytesIO(payload)).load()
+    raise ValueError("Unrecognized serialized content.")
+
+# -----------------------------------------------------------------------------
+def header(encoding) -> bytes:
+    return MAGIC + bytes([FORMAT_VERSION, encoding])
+
+# -----------------------------------------------------------------------------
+def json_dumps(content) -> bytes:
+    """Encodes JSON-safe content, with orjson if installed."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(content)
+        except TypeError:
+            pass # ie integers beyond 64 bits
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+# -----------------------------------------------------------------------------
+def msgpack_dumps(content) -> bytes:
+    return msgpack.packb(content, use_bin_type=True, strict_types=True, default=_pack_ext)
+
+# -----------------------------------------------------------------------------
+def _pack_ext(value):
+    """msgpack default hook for the types msgpack does not represent exactly."""
+    if isinstance(value, tuple):
+        return msgpack.ExtType(EXT_TUPLE, msgpack_dumps(list(value)))
+    if isinstance(value, frozenset):
+        return msgpack.ExtType(EXT_FROZENSET, msgpack_dumps(list(value)))
+    if isinstance(value, set):
+        return msgpack.ExtType(EXT_SET, msgpack_dumps(list(value)))
+    if isinstance(value, bytearray):
+        return msgpack.ExtType(EXT_BYTEARRAY, bytes(value))
+    # strict_types also sends subclasses here (ie OrderedDict, str enums)
+    for base in (dict, list, str, int, float, bytes):
+        if isinstance(value, base):
+            return base(value)
+    raise TypeError(f"Unable to serialize {type(value).__name__}")
+
+# -----------------------------------------------------------------------------
+def _unpack_ext(code, data):
+    if code == EXT_BYTEARRAY:
+        return bytearray(data)
+    items = msgpack.unpackb(data, raw=False, strict_map_key=False, ext_hook=_unpack_ext)
+    if code == EXT_TUPLE:
+        return tuple(items)
+    if code == EXT_SET:
+        return set(items)
+    if code == EXT_FROZENSET:
+        return frozenset(items)
+    return msgpack.ExtType(code, data)
+
+# -----------------------------------------------------------------------------
+def json_plain(value) -> bool:
+    """
+    Returns True if JSON represents the content exactly, as is: only
+    dicts with string keys, lists, strings, 64-bit integers, finite 
+    floats, booleans and None. Stops at the first value that is not.
+    """
+    pending = [value]
+    while pending:
+        value = pending.pop()
+        value_type = type(value)
+        if value_type is str or value is None or value_type is bool:
+            continue
+        if value_type is int:
+            if -JSON_INT_LIMIT <= value < JSON_INT_LIMIT:
+                continue
+            return False
+        if value_type is float:
+            if math.isfinite(value):
+                continue
+            return False
+        if value_type is list:
+            pending.extend(value)
+        elif value_type is dict:
+            if JSON_TAG in value:
+                return False
+            for key in value:
+                if type(key) is not str:
+                    return False
+            pending.extend(value.values())
+        else:
+            return False
+    return True
+
+# -----------------------------------------------------------------------------
+def to_json_safe(value):
+    """
+    Converts content to values JSON represents exactly. Tuples, sets,
+    bytes, non-finite floats and dicts with keys that are not strings
+    become tagged dicts: {JSON_TAG: type name, ...}.
+    """
+    if value is None or isinstance(value, (str, bool)):
+        return value
+    if isinstance(value, int):
+        return value if -JSON_INT_LIMIT <= value < JSON_INT_LIMIT else {JSON_TAG: "int", "value": str(value)}
+    if isinstance(value, float):
+        return value if math.isfinite(value) else {JSON_TAG: "float", "value": repr(value)}
+    if isinstance(value, dict):
+        if JSON_TAG not in value and all(isinstance(key, str) for key in value):
+            return {key: to_json_safe(item) for key, item in value.items()}
+        return {JSON_TAG: "dict", "items": [[to_json_safe(key), to_json_safe(item)] for key, item in value.items()]}
+    if isinstance(value, list):
+        return [to_json_safe(item) for item in value]
+    if isinstance(value, (tuple, set, frozenset)):
+        tag = "set" if isinstance(value, set) else "frozenset" if isinstance(value, frozenset) else "tuple"
+        return {JSON_TAG: tag, "items": [to_json_safe(item) for item in value]}
+    if isinstance(value, (bytes, bytearray)):
+        return {JSON_TAG: "bytearray" if isinstance(value, bytearray) else "bytes",
+                "base64": base64.b64encode(value).decode("ascii")}
+    raise TypeError(f"Unable to serialize {type(value).__name__}")
+
+# -----------------------------------------------------------------------------
+def from_json_safe(value):
+    """Reverses to_json_safe()."""
+    if isinstance(value, list):
+        return [from_json_safe(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    tag = value.get(JSON_TAG)
+    if tag is None:
+        return {key: from_json_safe(item) for key, item in value.items()}
+    match tag:
+        case "dict":
+            return {from_json_safe(key): from_json_safe(item) for key, item in value["items"]}
+        case "tuple":
+            return tuple(from_json_safe(item) for item in value["items"])
+        case "set":
+            return set(from_json_safe(item) for item in value["items"])
+        case "frozenset":
+            return frozenset(from_json_safe(item) for item in value["items"])
+        case "bytes":
+            return base64.b64decode(value["base64"])
+        case "bytearray":
+            return bytearray(base64.b64decode(value["base64"]))
+        case "float":
+            return float(value["value"])
+        case "int":
+            return int(value["value"])
+    raise ValueError(f"Unrecognized serialized type: {tag}")
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class Builtins_unpickler(pickle.Unpickler):
+    """
+    Reads pickle payloads written by earlier versions.
+    Only plain built-in containers and values are allowed. Anything that
+    would import a class or call a function is refused.
+    """
+    ALLOWED = {("builtins", "set"), ("builtins", "frozenset"), ("builtins", "bytearray")}
+
+    def find_class(self, module, name):
+        if (module, name) in self.ALLOWED:
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError(f"Refused to load {module}.{name} from serialized content.")
+
+# -----------------------------------------------------------------------------
+def benchmark(content, repeat=20):
+    """
+    Compares dumps()/loads() with pickle on sample content.
+    Returns a dict of {method: {"size", "dumps_ms", "loads_ms"}}, with the
+    fastest of repeat runs. Methods whose library is not installed are skipped.
+    """
+    methods = {"pickle": (lambda: pickle.dumps(content), pickle.loads)}
+    if msgpack is not None:
+        methods["msgpack"] = (lambda: header(ENCODING_MSGPACK) + msgpack_dumps(content), loads)
+    methods["json"] = (lambda: (header(ENCODING_JSON_PLAIN) + json_dumps(content)) if json_plain(content) 
+                               else (header(ENCODING_JSON) + json_dumps(to_json_safe(content))), loads)
+    results = {}
+    for name, (encode, decode) in methods.items():
+        fastest_dumps = fastest_loads = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            payload = encode()
+            middle = time.perf_counter()
+            decode(payload)
+            end = time.perf_counter()
+            fastest_dumps = (middle - start) if fastest_dumps is None else min(fastest_dumps, middle - start)
+            fastest_loads = (end - middle) if fastest_loads is None else min(fastest_loads, end - middle)
+        results[name] = {"size": len(payload), "dumps_ms": fastest_dumps * 1000, "loads_ms": fastest_loads * 1000}
+    return results
+
+# =============================================================================
+#  --- MAIN: Only runs if the module is executed stand-alone. ---
+# =============================================================================
+if __name__ == '__main__':
+    print("Structured Content Serializer Library. Not intended to be run as a stand-alone file.")
@@ -0,0 +1,165 @@
+# SQL Statement Statistics
+# Optional instrumentation for the Database class. When enabled, each
+# statement is timed and recorded against its shape: the statement with
+# literal values replaced by ?, so the same query with different values
+# is counted together. Statements slower than a threshold are written to
+# the slow-query log (log records bound with sql=True).
+import re
+import time
+import threading
+from loguru import logger
+
+SLOW_QUERY_MS = 100.0 # Statements at or above this duration (ms) are logged as slow
+HISTOGRAM_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500) # Upper bounds. The last bucket is unbounded.
+SHAPE_LENGTH = 160    # Characters of a statement shape shown in reports
+
+STRING_LITERAL  = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL  = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+VALUE_LIST      = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+WHITESPACE      = re.compile(r"\s+")
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class SQL_stats:
+    """
+    Per-statement-shape timing statistics.
+
+    Parameters:
+    - slow_query_ms (float)[optional]: The slow-query threshold. Defaults to SLOW_QUERY_MS.
+
+    Methods:
+    - enable(slow_query_ms=None) / disable(): Starts or stops recording
+    - timer(statement): Returns a context manager that times and records a statement
+    - record(statement, elapsed, rows, bytes_read, bytes_written): Records one execution
+    - stats(): Returns a dict of statistics, keyed by statement shape
+    - report(limit): Returns the statistics as text, slowest total time first
+    - reset(): Clears all statistics
+
+    Safe to share between the event loop, the writer thread and reader threads.
+    Recording is off until enable() is called.
+    """
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS):
+        self.enabled = False
+        self.slow_query_ms = slow_query_ms
+        self.__shapes = {} # shape: dict of totals and a histogram
+        self.__lock = threading.Lock()
+
+    # -------------------------------------------------------------------------
+    def enable(self, slow_query_ms=None):
+        if slow_query_ms is not None:
+            self.slow_query_ms = slow_query_ms
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    # -------------------------------------------------------------------------
+    def timer(self, statement):
+        """
+        Returns a context manager that records the statement when it exits.
+        Set rows, bytes_read or bytes_written on it before it exits.
+        Usage: with SQL_STATS.timer(sql) as timing:
+                   cursor.execute(sql)
+                   timing.rows = cursor.rowcount
+        """
+        return SQL_timer(self, statement)
+
+    # -------------------------------------------------------------------------
+    def record(self, statement, elapsed, rows=0, bytes_read=0, bytes_written=0):
+        """
+        Records one execution of a statement.
+        - elapsed (float): Seconds taken
+        """
+        if not self.enabled:
+            return
+        shape = statement_shape(statement)
+        elapsed_ms = elapsed * 1000
+        with self.__lock:
+            entry = self.__shapes.get(shape)
+            if entry is None:
+                entry = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0, "bytes_read": 0, "bytes_written": 0,
+                         "histogram": [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)}
+                self.__shapes[shape] = entry
+            entry["count"] += 1
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+            entry["rows"] += max(rows or 0, 0)
+            entry["bytes_read"] += bytes_read or 0
+            entry["bytes_written"] += bytes_written or 0
+            entry["histogram"][histogram_bucket(elapsed_ms)] += 1
+
+        if elapsed_ms >= self.slow_query_ms:
+            logger.bind(sql=True).warning(f"Slow SQL ({elapsed_ms:,.1f} ms, {rows or 0:,} rows): {WHITESPACE.sub(' ', statement).strip()}")
+
+    # -------------------------------------------------------------------------
+    def stats(self):
+        """Returns a copy of the statistics, keyed by statement shape."""
+        with self.__lock:
+            return {shape: dict(entry, histogram=list(entry["histogram"])) for shape, entry in self.__shapes.items()}
+
+    # -------------------------------------------------------------------------
+    def reset(self):
+        with self.__lock:
+            self.__shapes.clear()
+
+    # -------------------------------------------------------------------------
+    def report(self, limit=25):
+        """Returns the statistics of the slowest statement shapes (by total time) as text."""
+        shapes = sorted(self.stats().items(), key=lambda item: item[1]["total_ms"], reverse=True)
+        if not shapes:
+            return "No SQL statements recorded."
+        labels = [f"<{bound}" for bound in HISTOGRAM_BUCKETS_MS] + [f">={HISTOGRAM_BUCKETS_MS[-1]}"]
+        lines = [f"{'Count':>7} {'Total ms':>10} {'Mean ms':>9} {'Max ms':>9} {'Rows':>9} {'Read':>12} {'Written':>12}  Statement"]
+        for shape, entry in shapes[:limit]:
+            lines.append(f"{entry['count']:>7,} {entry['total_ms']:>10,.1f} {entry['total_ms'] / entry['count']:>9,.2f} {entry['max_ms']:>9,.1f} "
+                         f"{entry['rows']:>9,} {entry['bytes_read']:>12,} {entry['bytes_written']:>12,}  {shape[:SHAPE_LENGTH]}")
+            histogram = "  ".join(f"{label} ms: {count}" for label, count in zip(labels, entry["histogram"]) if count)
+            lines.append(f"{'':>7} {histogram}")
+        if len(shapes) > limit:
+            lines.append(f"... {len(shapes) - limit} more statement shapes.")
+        return "\n".join(lines)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class SQL_timer:
+    """Times one statement for SQL_stats.timer()."""
+    __slots__ = ("stats", "statement", "rows", "bytes_read", "bytes_written", "start")
+
+    def __init__(self, stats, statement):
+        self.stats = stats
+        self.statement = statement
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.record(self.statement, time.perf_counter() - self.start, self.rows, self.bytes_read, self.bytes_written)
+        return False
+
+# -----------------------------------------------------------------------------
+def statement_shape(statement) -> str:
+    """
+    Returns the statement with literal values replaced by ?, lists of
+    values collapsed to (...) and whitespace normalized.
+    """
+    shape = STRING_LITERAL.sub("?", statement)
+    shape = NUMBER_LITERAL.sub("?", shape)
+    shape = VALUE_LIST.sub("(...)", shape)
+    return WHITESPACE.sub(" ", shape).strip()
+
+# -----------------------------------------------------------------------------
+def histogram_bucket(elapsed_ms) -> int:
+    """Returns the index of the histogram bucket for a duration."""
+    for index, bound in enumerate(HISTOGRAM_BUCKETS_MS):
+        if elapsed_ms < bound:
+            return index
+    return len(HISTOGRAM_BUCKETS_MS)
+
+# =============================================================================
+#  --- MAIN: Only runs if the module is executed stand-alone. ---
+# =============================================================================
+if __name__ == '__main__':
+    print("SQL Statement Statistics Library. Not intended to be run as a stand-alone file.")
@@ -0,0 +1,210 @@
+# Support File Store
+# An extracted, content-addressed copy of filecache content on the local
+# file system. Each file is stored once, named by the SHA-256 digest of its
+# content, and is never modified after it is written. Validators and
+# converters can open the files directly (xmlschema, Saxon) or map them
+# into memory read-only, without pulling BLOBs through Python.
+import atexit
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+
+from loguru import logger
+
+from . import lfs
+
+STORE_FOLDER = "store"      # Created alongside the support database
+STORE_INDEX  = "index.json" # Maps filecache UUIDs to content digests
+INDEX_SAVE_BATCH = 32       # Index changes held in memory before the index is saved
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class Support_store:
+    """
+    Content-addressed file store.
+
+    Parameters:
+    - location (str): The folder for the store. Created if it does not exist.
+
+    Methods:
+    - put(content): Stores bytes and returns their digest
+    - put_file(path): Moves a file into the store and returns its digest
+    - path(digest): Returns the path of stored content, or None
+    - view(digest): Returns a read-only mmap of stored content, or None
+    - digest_for(filecache_uuid): Returns the digest extracted for a filecache entry
+    - extract(db, filecache_uuid): Extracts a filecache entry into the store
+    - remember(filecache_uuid, digest): Records the digest of a filecache entry
+    - save_index(): Saves index changes not yet written to the index file
+    """
+    def __init__(self, location):
+        self.location = location
+        self.ready = lfs.chkdir(location, make_if_not_present=True)
+        self.__index_file = os.path.join(location, STORE_INDEX)
+        self.__index = lfs.getjsonfile(self.__index_file) if self.ready else {}
+        self.__unsaved = 0 # Index changes not yet written to the index file
+        if self.ready:
+            atexit.register(self.save_index)
+        else:
+            logger.error(f"Unable to create support file store at {location}")
+
+    # -------------------------------------------------------------------------
+    def __digest_path(self, digest):
+        return os.path.join(self.location, digest[:2], digest)
+
+    # -------------------------------------------------------------------------
+    def path(self, digest):
+        """Returns the path of the stored content, or None if it is not in the store."""
+        if digest:
+            target = self.__digest_path(digest)
+            if os.path.isfile(target):
+                return target
+        return None
+
+    # -------------------------------------------------------------------------
+    def view(self, digest):
+        """
+        Returns a read-only memory map of the stored content, or None.
+        The caller should close the map when done. Empty files return b"".
+        """
+        target = self.path(digest)
+        if target is None:
+            return None
+        with open(target, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # -------------------------------------------------------------------------
+    def put(self, content):
+        """Stores bytes (or a str, as UTF-8) and returns the SHA-256 digest."""
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        digest = hashlib.sha256(content).hexdigest()
+        if self.path(digest) is None:
+            self.__write(digest, content)
+        return digest
+
+    # -------------------------------------------------------------------------
+    def put_file(self, source, digest=None):
+        """
+        Moves a file into the store and returns its digest.
+        - source (str): A file on the same file system as the store
+        - digest (str)[optional]: The SHA-256 digest, if already known
+        """
+        if digest is None:
+            digest = file_digest(source)
+        target = self.__digest_path(digest)
+        if os.path.isfile(target):
+            os.remove(source)
+        else:
+            lfs.chkdir(os.path.dirname(target), make_if_not_present=True)
+            os.chmod(source, 0o444)
+            os.replace(source, target)
+        return digest
+
+    # -------------------------------------------------------------------------
+    def __write(self, digest, content):
+        """Writes to a temporary file, then renames, so readers never see a partial file."""
+        target = self.__digest_path(digest)
+        lfs.chkdir(os.path.dirname(target), make_if_not_present=True)
+        handle, temp_name = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as file:
+                file.write(content)
+            os.chmod(temp_name, 0o444)
+            os.replace(temp_name, target)
+        except (Exception, BaseException) as error:
+            logger.error(f"Unable to write {digest} to support file store ({type(error).__name__}): {str(error)}")
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+            raise
+
+    # -------------------------------------------------------------------------
+    def temp_file(self):
+        """Returns the path of a new, empty temporary file within the store."""
+        handle, temp_name = tempfile.mkstemp(dir=self.location, suffix=".tmp")
+        os.close(handle)
+        return temp_name
+
+    # -------------------------------------------------------------------------
+    def digest_for(self, filecache_uuid):
+        """Returns the digest previously extracted for a filecache entry, or an empty string."""
+        digest = self.__index.get(filecache_uuid, "")
+        if digest and self.path(digest) is None:
+            digest = "" # Index entry is stale (store was cleaned)
+        return digest
+
+    # -------------------------------------------------------------------------
+    def remember(self, filecache_uuid, digest):
+        """
+        Records which digest holds the content of a filecache entry.
+        Changes are saved in batches of INDEX_SAVE_BATCH. Call save_index()
+        after a bulk operation. Any remainder is saved at exit.
+        """
+        if self.__index.get(filecache_uuid) != digest:
+            self.__index[filecache_uuid] = digest
+            self.__unsaved += 1
+            if self.__unsaved >= INDEX_SAVE_BATCH:
+                self.save_index()
+
+    # -------------------------------------------------------------------------
+    def save_index(self):
+        """
+        Saves index changes not yet written to the index file.
+        Writes to a temporary file, then renames, so the index is never left
+        partially written. Does nothing if there are no changes.
+        Returns True if the index file is current. False otherwise.
+        """
+        status = True
+        if self.__unsaved and self.ready:
+            handle, temp_name = tempfile.mkstemp(dir=self.location, suffix=".tmp")
+            try:
+                with os.fdopen(handle, "w") as file:
+                    json.dump(self.__index, file, indent=1)
+                os.replace(temp_name, self.__index_file)
+                self.__unsaved = 0
+            except (Exception, BaseException) as error:
+                logger.error(f"Unable to save support file store index ({type(error).__name__}): {str(error)}")
+                if os.path.exists(temp_name):
+                    os.remove(temp_name)
+                status = False
+        return status
+
+    # -------------------------------------------------------------------------
+    async def extract(self, db, filecache_uuid):
+        """
+        Ensures a filecache entry is in the store.
+        The content is exported straight from the database to a temporary
+        file in the store and then renamed to its digest.
+        Returns the path of the stored content, or None if unsuccessful.
+        """
+        digest = self.digest_for(filecache_uuid)
+        if not digest:
+            temp_name = self.temp_file()
+            try:
+                if await db.export_file(filecache_uuid, temp_name):
+                    digest = self.put_file(temp_name)
+                    self.remember(filecache_uuid, digest)
+                else:
+                    os.remove(temp_name)
+            except (Exception, BaseException) as error:
+                logger.error(f"Unable to extract {filecache_uuid} to support file store ({type(error).__name__}): {str(error)}")
+                if os.path.exists(temp_name):
+                    os.remove(temp_name)
+        return self.path(digest)
+
+# -----------------------------------------------------------------------------
+def file_digest(path, chunk_size=1024 * 1024) -> str:
+    """Returns the SHA-256 hex digest of a file, reading it in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# =============================================================================
+#  --- MAIN: Only runs if the module is executed stand-alone. ---
+# =============================================================================
+if __name__ == '__main__':
+    print("Support File Store Library. Not intended to be run as a stand-alone file.")
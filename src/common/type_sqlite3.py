@@ -3,14 +3,42 @@
 # These functions assume that the SQLite3 database is already created and
 # =============================================================================
 from loguru import logger
-import pickle
 from typing import Any, Optional, Dict
 import asyncio
-import zlib
 import sqlite3
+import os
+import tempfile
+import time
+import threading
+import queue
+import concurrent.futures
 from common import misc
+from common import compression
+from common import serializer
 
 FILE_CACHE_TABLE = 'filecache'
+BLOB_CHUNK_SIZE = 64 * 1024 # Bytes moved at a time by incremental BLOB I/O
+MEMORY_DATABASE = ":memory:"
+STATEMENT_CACHE_SIZE = 256  # Prepared statements kept per connection (sqlite3 default: 128)
+
+# Applied to every connection opened by open_sqlite3().
+# WAL lets readers and the writer work at the same time. NORMAL 
+# synchronous is safe with WAL: commits no longer wait for an fsync.
+SQLITE_PRAGMAS = {
+    "auto_vacuum" : "INCREMENTAL", # Must precede journal_mode to apply to a new database. See incremental_vacuum().
+    "journal_mode": "WAL",
+    "synchronous" : "NORMAL",
+    "cache_size"  : -65536,      # KiB when negative (64 MB per connection)
+    "mmap_size"   : 268435456,   # Map up to 256 MB of the database file
+    "temp_store"  : "MEMORY",
+    "busy_timeout": 5000         # Milliseconds to wait for a lock before failing
+}
+# Reader connections to an in-memory mirror (see SQLite_connections). 
+# The mirror is only ever written by reloading it from the database file.
+MIRROR_PRAGMAS = {
+    "query_only"  : 1,
+    "temp_store"  : "MEMORY"
+}
 
 async def save_to_db(conn, table_name: str, content: Any, identifier: Optional[str] = None, 
                additional_fields: Optional[Dict] = None) -> str:
@@ -45,8 +73,8 @@ async def save_to_db(conn, table_name: str, content: Any, identifier: Optional[s
             identifier = str(uuid.uuid4())
         
         # Serialize the content
-        serialized_content = pickle.dumps(content)
-        content_type = type(content).__name__
+        serialized_content = serializer.dumps(content)
+        content_type = serializer.type_name(content)
         
         # Prepare the base data
         field_names = ['uuid', 'content', 'datatype']
@@ -103,8 +131,8 @@ async def save_to_db(conn, table_name: str, content: Any, identifier: Optional[s
             identifier = str(uuid.uuid4())
         
         # Serialize the content
-        serialized_content = pickle.dumps(content)
-        content_type = type(content).__name__
+        serialized_content = serializer.dumps(content)
+        content_type = serializer.type_name(content)
         
         # Prepare the base data
         field_names = ['uuid', 'content', 'datatype']
@@ -165,7 +193,7 @@ def get_from_db(conn, table_name: str, identifier: str) -> Any:
         serialized_content, datatype = result
         
         # Deserialize the content
-        content = pickle.loads(serialized_content)
+        content = serializer.loads(serialized_content)
         
         # Verify the deserialized content matches the stored type
         if type(content).__name__ != datatype:
@@ -312,7 +340,46 @@ def get_record_metadata(conn, table_name: str, identifier: str) -> Dict:
         raise e
 
 
-async def store_blob_to_db(conn, identifier: str, blob, attributes: dict) -> bool:
+def pack_blob(blob, compress: bool, file_type: str = ""):
+    """
+    Prepares bytes for storage in the filecache content column.
+    
+    Args:
+        blob: The bytes to store, or None
+        compress: Compress the bytes if True
+        file_type: The filecache file_type, which selects the codec and level
+    
+    Returns:
+        tuple: (the bytes to store, the codec)
+    """
+    if compress and blob is not None:
+        codec, level = compression.choose(file_type)
+        logger.debug(f"Compressing blob data ({codec} level {level})")
+        return compression.compress(blob, codec, level), codec
+    return blob, compression.CODEC_NONE
+
+def unpack_blob(content, codec) -> bytes:
+    """
+    Returns the stored bytes of filecache content, decompressed if necessary.
+    codec: The entry's codec (see compression.stored_codec())
+    NULL content is returned as empty bytes.
+    """
+    if content is None:
+        return b""
+    return compression.decompress(content, codec)
+
+def content_addressed(identifier: str, attributes: dict) -> str:
+    """
+    Returns the conflict clause for a filecache insert. An entry keyed by
+    its own SHA-256 digest is already stored if the key exists, so a
+    concurrent or repeated store of the same content keeps the existing row.
+    Other entries are inserted as before.
+    """
+    if identifier and attributes.get('sha256') == identifier:
+        return " ON CONFLICT(uuid) DO NOTHING"
+    return ""
+
+def store_blob_to_db(conn, identifier: str, blob, attributes: dict) -> bool:
     """
     Store a binary large object (BLOB) in the database.
     
@@ -341,11 +408,11 @@ async def store_blob_to_db(conn, identifier: str, blob, attributes: dict) -> boo
         ok_to_store = True
         datatype = 'str'
     elif isinstance(blob, list):
-        blob = pickle.dumps(blob)
+        blob = serializer.dumps(blob)
         ok_to_store = True
         datatype = 'list'
     elif isinstance(blob, dict):
-        blob = pickle.dumps(blob)
+        blob = serializer.dumps(blob)
         ok_to_store = True
         datatype = 'dict'
     elif blob is None:
@@ -355,19 +422,15 @@ async def store_blob_to_db(conn, identifier: str, blob, attributes: dict) -> boo
     else:
         raise ValueError(f"Unsupported data type: {type(blob)}")
     
-    compress = attributes.get('compress', False)
+    compress = attributes.get('compressed', False)
     acquired = attributes.get('acquired', misc.oscal_date_time_with_timezone())
     filename = attributes.get('filename', "")
     original_location = attributes.get('original_location', "")
     file_type = attributes.get('file_type', "")
     mime_type = attributes.get('mime_type', "")
     try:
-        if compress and blob is not None:
-            logger.debug("Compressing blob data")
-            blob = zlib.compress(blob)
-            compressed = 1  # True as integer
-        else:
-            compressed = 0  # False as integer
+        blob, codec = pack_blob(blob, compress, file_type)
+        compressed = int(codec != compression.CODEC_NONE) # Read by versions without the codec field
 
         # Check if table exists
         cursor.execute(f"PRAGMA table_info({FILE_CACHE_TABLE})")
@@ -378,12 +441,32 @@ async def store_blob_to_db(conn, identifier: str, blob, attributes: dict) -> boo
 
         # Update the record with the BLOB
         logger.debug(f"Storing BLOB data in table '{FILE_CACHE_TABLE}' with identifier '{identifier}'")
-        query = f"""INSERT INTO {FILE_CACHE_TABLE} 
-            (uuid, content, datatype, compressed, acquired, filename, original_location, file_type, mime_type)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"""
-        cursor.execute(query, (identifier, blob, datatype, compressed, acquired, filename, original_location, file_type, mime_type))
+        fields = ["uuid", "content", "datatype", "compressed", "acquired", "filename", "original_location", "file_type", "mime_type"]
+        values = [identifier, blob, datatype, compressed, acquired, filename, original_location, file_type, mime_type]
+        if "sha256" in table_columns: # Absent from file caches created before content hashing
+            fields.append("sha256")
+            values.append(attributes.get('sha256', None))
+        if "codec" in table_columns: # Absent from file caches created before codec tagging
+            fields.append("codec")
+            values.append(codec)
+        conflict = content_addressed(identifier, attributes)
+        if blob:
+            # Reserve the space, then write the content in chunks (see write_blob)
+            query = f"""INSERT INTO {FILE_CACHE_TABLE} 
+                ({", ".join(fields[:1] + fields[2:])}, content)
+                VALUES ({", ".join("?" * (len(fields) - 1))}, zeroblob(?)){conflict}"""
+            cursor.execute(query, values[:1] + values[2:] + [len(blob)])
+            if cursor.rowcount > 0:
+                write_blob(conn, cursor.lastrowid, blob)
+        else:
+            query = f"""INSERT INTO {FILE_CACHE_TABLE} 
+                ({", ".join(fields)})
+                VALUES ({", ".join("?" * len(fields))}){conflict}"""
+            cursor.execute(query, values)
+        if cursor.rowcount == 0:
+            logger.debug(f"Filecache entry '{identifier}' is already stored")
         logger.debug(f"Query: {query}")
-        logger.debug(f"Parameters: blob_size={len(blob) if blob else 'None'}, datatype={datatype}, compressed={compressed}, uuid={identifier}")
+        logger.debug(f"Parameters: blob_size={len(blob) if blob else 'None'}, datatype={datatype}, codec={codec}, uuid={identifier}")
         
         conn.commit()
         return True
@@ -392,79 +475,223 @@ async def store_blob_to_db(conn, identifier: str, blob, attributes: dict) -> boo
         conn.rollback()
         raise e
 
+def store_file_to_db(conn, identifier: str, path: str, attributes: dict) -> bool:
+    """
+    Store the content of a file as a filecache BLOB, in chunks.
+    The content is compressed incrementally (if attributes["compressed"],
+    with the codec for its file_type) and written with SQLite incremental BLOB I/O, so it is never held
+    in memory as a whole. Stored with the 'bytes' datatype.
+    
+    Args:
+        conn: SQLite connection object
+        identifier: UUID of the record to store the BLOB
+        path: The file to store
+        attributes: filecache field values, as for store_blob_to_db
+    
+    Returns:
+        bool: True if the BLOB was stored successfully, or if the
+              content-addressed entry was already stored
+    """
+    cursor = conn.cursor()
+    source = path
+    codec = compression.CODEC_NONE
+    try:
+        if attributes.get('compressed', False):
+            codec, level = compression.choose(attributes.get('file_type', ""))
+            handle, source = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".z")
+            compressor = compression.Compressor(codec, level)
+            with os.fdopen(handle, "wb") as target, open(path, "rb") as file:
+                for chunk in iter(lambda: file.read(BLOB_CHUNK_SIZE), b""):
+                    target.write(compressor.compress(chunk))
+                target.write(compressor.flush())
+
+        fields = ["uuid", "datatype", "compressed", "codec", "acquired", "filename", "original_location", "file_type", "mime_type", "sha256"]
+        values = [identifier, "bytes", int(codec != compression.CODEC_NONE), codec,
+                  attributes.get('acquired', misc.oscal_date_time_with_timezone()),
+                  attributes.get('filename', ""), attributes.get('original_location', ""),
+                  attributes.get('file_type', ""), attributes.get('mime_type', ""), attributes.get('sha256', None)]
+        logger.debug(f"Streaming {path} to table '{FILE_CACHE_TABLE}' with identifier '{identifier}'")
+        cursor.execute(f"""INSERT INTO {FILE_CACHE_TABLE} 
+            ({", ".join(fields)}, content)
+            VALUES ({", ".join("?" * len(fields))}, zeroblob(?)){content_addressed(identifier, attributes)}""", values + [os.path.getsize(source)])
+        if cursor.rowcount == 0:
+            logger.debug(f"Filecache entry '{identifier}' is already stored")
+        else:
+            with conn.blobopen(FILE_CACHE_TABLE, "content", cursor.lastrowid) as blob:
+                with open(source, "rb") as file:
+                    for chunk in iter(lambda: file.read(BLOB_CHUNK_SIZE), b""):
+                        blob.write(chunk)
+        conn.commit()
+        return True
+
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        if source != path and os.path.exists(source):
+            os.remove(source)
+
+def write_blob(conn, rowid: int, blob) -> None:
+    """
+    Writes bytes into a filecache content BLOB, in chunks, using 
+    SQLite incremental BLOB I/O. The BLOB must already be the right size
+    (ie inserted as zeroblob(len(blob))). The caller commits.
+    """
+    view = memoryview(blob)
+    with conn.blobopen(FILE_CACHE_TABLE, "content", rowid) as handle:
+        for offset in range(0, len(view), BLOB_CHUNK_SIZE):
+            handle.write(view[offset:offset + BLOB_CHUNK_SIZE])
+
+def read_blob_metadata(conn, identifier: str) -> Dict:
+    """
+    Retrieve the metadata of a filecache entry, without reading its content.
+    
+    Args:
+        conn: SQLite connection object
+        identifier: UUID of the filecache record
+    
+    Returns:
+        Dict of the filecache fields other than content, plus:
+        - rowid: for incremental BLOB I/O
+        - stored_size: the size of the stored (possibly compressed) content.
+          None if the content is NULL.
+        
+    Raises:
+        ValueError: If the record is not found
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = dict_row_factory
+    cursor.execute(f"PRAGMA table_info({FILE_CACHE_TABLE})")
+    fields = [row["name"] for row in cursor.fetchall() if row["name"] != "content"]
+    cursor.execute(f'''SELECT rowid, {", ".join(fields)}, length(content) AS stored_size
+                     FROM {FILE_CACHE_TABLE}
+                     WHERE uuid = ?''', (identifier,))
+    result = cursor.fetchone()
+    if result is None:
+        raise ValueError(f"No record found with UUID: {identifier}")
+    return result
+
+def iter_blob_chunks(conn, metadata: Dict):
+    """
+    Yields the stored bytes of a filecache entry in chunks, decompressed
+    if necessary, using SQLite incremental BLOB I/O. The content is never
+    held in memory as a whole.
+    
+    Args:
+        conn: SQLite connection object
+        metadata: The entry's read_blob_metadata() result
+    """
+    if not metadata.get("stored_size"):
+        return
+    decompressor = compression.Decompressor(compression.stored_codec(metadata.get("codec"), metadata.get("compressed")))
+    with conn.blobopen(FILE_CACHE_TABLE, "content", metadata["rowid"], readonly=True) as handle:
+        for chunk in iter(lambda: handle.read(BLOB_CHUNK_SIZE), b""):
+            chunk = decompressor.decompress(chunk)
+            if chunk:
+                yield chunk
+    chunk = decompressor.flush()
+    if chunk:
+        yield chunk
+
 def retrieve_blob_from_db(conn, identifier: str) -> Any:
     """
     Retrieve a binary large object (BLOB) from the database.
     
     Args:
         conn: SQLite connection object
-        table_name: Name of the table containing the record
         identifier: UUID of the record to retrieve the BLOB from
-        decompress: Whether to decompress the BLOB after retrieval
     
     Returns:
-        The BLOB data, or None if not found
+        Dict of the filecache fields, with the content converted back 
+        to its original Python data type.
+        
+    Raises:
+        ValueError: If the record is not found or the data type is not recognized
     """
-    cursor = conn.cursor()
+    result = read_blob_metadata(conn, identifier)
+    return_dict = {
+        "uuid": result["uuid"],
+        "content": b"".join(iter_blob_chunks(conn, result)),
+        "datatype": result["datatype"],
+        "acquired": result["acquired"],
+        "filename": result["filename"],
+        "original_location": result["original_location"],
+        "file_type": result["file_type"],
+        "mime_type": result["mime_type"]
+        }
+
+    if return_dict["datatype"] == 'bytes':
+        pass
+    elif return_dict["datatype"] == 'str':
+        return_dict["content"] = return_dict["content"].decode('utf-8')
+    elif return_dict["datatype"] in ('list', 'dict'):
+        return_dict["content"] = serializer.loads(return_dict["content"])
+    elif return_dict["datatype"] == 'NoneType':
+        return_dict["content"] = None
+    elif return_dict["datatype"] == 'bytearray':
+        return_dict["content"] = bytearray(return_dict["content"])
+    else:
+        raise ValueError(f"Unexpected data type: {return_dict["datatype"]}")
+
+    return return_dict
     
-    try:
-        cursor.execute(f'''SELECT * 
-                         FROM {FILE_CACHE_TABLE}
-                         WHERE uuid = ?''', (identifier,))
-        
-        result = cursor.fetchone()
+def read_blob_bytes(conn, identifier: str) -> bytes:
+    """
+    Returns the stored bytes of a filecache entry (decompressed if necessary),
+    without conversion back to the original Python data type.
+    
+    Args:
+        conn: SQLite connection object
+        identifier: UUID of the filecache record
+    
+    Returns:
+        bytes: The stored content. Empty if the content is NULL.
         
-        if result is not None:
-            # Unpack the result
-            return_dict = {
-            "uuid": result["uuid"],
-            "content": result["content"],
-            "datatype": result["datatype"],
-            "acquired": result["acquired"],
-            "filename": result["filename"],
-            "original_location": result["original_location"],
-            "file_type": result["file_type"],
-            "mime_type": result["mime_type"]
-            }
-            
-            if result["compressed"] == 1:
-                return_dict["content"] = zlib.decompress(return_dict["content"])
-
-            if return_dict["datatype"] == 'bytes':
-                return_dict["content"] = bytes(return_dict["content"])
-            elif return_dict["datatype"] == 'str':
-                return_dict["content"] = str(return_dict["content"])
-            elif return_dict["datatype"] == 'list':
-                return_dict["content"] = list(return_dict["content"])
-            elif return_dict["datatype"] == 'dict':
-                return_dict["content"] = dict(return_dict["content"])
-            elif return_dict["datatype"] == 'NoneType':
-                return_dict["content"] = None
-            elif return_dict["datatype"] == 'bytearray':
-                return_dict["content"] = bytearray(return_dict["content"])
-            else:
-                raise ValueError(f"Unexpected data type: {return_dict["datatype"]}")
-        else :
-            raise ValueError(f"No record found with UUID: {identifier}")
-            return_dict = {}
+    Raises:
+        ValueError: If the record is not found
+    """
+    return b"".join(iter_blob_chunks(conn, read_blob_metadata(conn, identifier)))
 
-        return return_dict
-            
-    except Exception as e:
-        raise e
+def export_blob_to_file(conn, identifier: str, path: str) -> bool:
+    """
+    Writes the content of a filecache entry directly to a file, in chunks.
+    The stored bytes are written as-is (decompressed if necessary), 
+    without conversion back to the original Python data type.
     
+    Args:
+        conn: SQLite connection object
+        identifier: UUID of the filecache record
+        path: The file to write
+    
+    Returns:
+        bool: True if the file was written
+        
+    Raises:
+        ValueError: If the record is not found
+    """
+    metadata = read_blob_metadata(conn, identifier)
+    with open(path, "wb") as file:
+        for chunk in iter_blob_chunks(conn, metadata):
+            file.write(chunk)
+    return True
+
 # -----------------------------------------------------------------------------
-def open_sqlite3(target):
+def open_sqlite3(target, check_same_thread=True, uri=False, pragmas=SQLITE_PRAGMAS):
     """
-    Opens a SQLite3 database.
+    Opens a SQLite3 database and applies SQLITE_PRAGMAS.
     SQLite3 will automatically create the database if it does not exist.
+    check_same_thread: Set to False for a connection that is created in one
+        thread and used (one thread at a time) by another.
+    uri: Set to True if target is a "file:" URI
+    pragmas: The PRAGMA settings to apply instead of SQLITE_PRAGMAS
     Includes copilot-suggested error handling.
     """
     status = False
     conn = None
     logger.debug(f"Opening {target}")
     try:
-        conn = sqlite3.connect(target)
+        conn = sqlite3.connect(target, check_same_thread=check_same_thread, cached_statements=STATEMENT_CACHE_SIZE, uri=uri)
+        apply_pragmas(conn, pragmas)
         status = True
         logger.debug(f"database opened: {target}")
     except sqlite3.IntegrityError:
@@ -490,6 +717,255 @@ def open_sqlite3(target):
         conn = None
     return conn
 
+# -----------------------------------------------------------------------------
+def dict_row_factory(cursor, row):
+    """Row factory that returns each row as a dict keyed by column name."""
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+# -----------------------------------------------------------------------------
+def apply_pragmas(conn, pragmas=SQLITE_PRAGMAS):
+    """
+    Applies PRAGMA settings to a connection.
+    journal_mode, and auto_vacuum for a new database, are persistent in
+    the database file. The others only last as long as the connection.
+    In-memory databases ignore WAL.
+    """
+    for pragma, value in pragmas.items():
+        result = conn.execute(f"PRAGMA {pragma} = {value};").fetchone()
+        if pragma == "journal_mode" and result and str(result[0]).upper() != str(value).upper():
+            logger.debug(f"journal_mode is {result[0]} (requested {value})")
+
+# -----------------------------------------------------------------------------
+def auto_vacuum_mode(conn) -> int:
+    """Returns the auto_vacuum mode of the database: 0 (NONE), 1 (FULL) or 2 (INCREMENTAL)."""
+    return conn.execute("PRAGMA auto_vacuum;").fetchone()[0]
+
+# -----------------------------------------------------------------------------
+def free_pages(conn) -> int:
+    """Returns the number of unused pages in the database file."""
+    return conn.execute("PRAGMA freelist_count;").fetchone()[0]
+
+# -----------------------------------------------------------------------------
+def incremental_vacuum(conn, pages=0) -> int:
+    """
+    Returns up to pages unused pages (all if 0) to the file system.
+    Only has an effect if auto_vacuum is INCREMENTAL. Unlike VACUUM, 
+    the time taken depends only on the pages freed, so it can run in 
+    small steps between other writes.
+    Returns the number of pages freed.
+    """
+    before = free_pages(conn)
+    # execute() frees one page per step. executescript() runs the pragma to completion.
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+    return before - free_pages(conn)
+
+# -----------------------------------------------------------------------------
+def enable_incremental_vacuum(conn) -> bool:
+    """
+    Converts a database created without auto_vacuum = INCREMENTAL.
+    This rebuilds the whole file with VACUUM, so it is only done on request.
+    Returns True if the database uses incremental vacuum.
+    """
+    if auto_vacuum_mode(conn) != 2:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+        conn.execute("VACUUM;")
+    return auto_vacuum_mode(conn) == 2
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class SQLite_connections:
+    """
+    The connections to one SQLite3 database.
+    - Each thread reads through its own connection (reader()), so worker
+      threads can read while the event loop writes.
+    - All writes run on a single writer connection, owned by a dedicated
+      thread that takes work from a queue (submit() / write()). Writes 
+      never contend with each other for the database lock.
+    With WAL, readers see the last committed write and do not block the writer.
+
+    An in-memory database can not be shared by several connections, so
+    it uses one connection for reads and writes, serialized by a lock.
+
+    A database that is read far more than it is written can be mirrored:
+    a copy is loaded into memory with the backup API, and reads are 
+    served from the copy. Writes still go to the file. From the first 
+    write until reload_mirror() runs, reads go to the file as well, so 
+    they always see the last committed write. A reload builds a new copy
+    and then switches to it, so reads in progress are not interrupted.
+
+    Parameters:
+    - target (str): The path and filename of the database, or ":memory:"
+    - mirror (bool)[optional]: Serve reads from an in-memory copy
+
+    Methods:
+    - reader(): Returns the calling thread's connection
+    - release(): Closes the calling thread's connection, for threads that 
+      are about to end (ie those of Database.iterate())
+    - submit(function, *args): Queues function(writer_connection, *args).
+      Returns a concurrent.futures.Future.
+    - write(function, *args): As submit(), but waits for and returns the result
+    - pending(): Returns the number of writes waiting for the writer thread
+    - reload_mirror(conn): Copies the database into a new in-memory mirror.
+      Submit it to run on the writer thread (ie submit(reload_mirror)).
+    - close(): Stops the writer thread and closes all connections
+    """
+    def __init__(self, target, mirror=False):
+        self.target = target
+        self.ready = False
+        self.mirror_stale = mirror    # True if the mirror is missing or older than the file
+        self.__mirrored = mirror and target != MEMORY_DATABASE
+        self.__mirror = None          # The mirror's URI and the connection that keeps it in memory
+        self.__mirror_readers = {}    # Each thread's connection to the current mirror, by thread id
+        self.__local = threading.local()
+        self.__readers = []           # Every reader connection, so close() can close them
+        self.__lock = threading.RLock()
+        self.__queue = queue.Queue()
+        self.__writer = None          # The writer thread
+        self.__writer_conn = None     # The writer thread's connection
+        self.__shared = None          # The only connection of an in-memory database
+
+        if target == MEMORY_DATABASE:
+            self.__shared = open_sqlite3(target, check_same_thread=False)
+            self.ready = self.__shared is not None
+        else:
+            conn = open_sqlite3(target, check_same_thread=False)
+            if conn is not None:
+                self.__writer = threading.Thread(target=self.__write_loop, args=(conn,),
+                                                 name=f"sqlite-writer:{os.path.basename(target)}", daemon=True)
+                self.__writer.start()
+                self.ready = True
+
+    # -------------------------------------------------------------------------
+    def reader(self):
+        """Returns the calling thread's connection, opening it on first use."""
+        if self.__shared is not None:
+            return self.__shared
+        if self.__mirror is not None and not self.mirror_stale:
+            return self.__mirror_reader()
+        conn = getattr(self.__local, "conn", None)
+        if conn is None and self.ready:
+            conn = open_sqlite3(self.target, check_same_thread=False)
+            self.__local.conn = conn
+            with self.__lock:
+                self.__readers.append(conn)
+        return conn
+
+    # -------------------------------------------------------------------------
+    def release(self):
+        """Closes the calling thread's connection. reader() opens a new one if it is used again."""
+        conn = getattr(self.__local, "conn", None)
+        if conn is not None:
+            self.__local.conn = None
+            with self.__lock:
+                if conn in self.__readers:
+                    self.__readers.remove(conn)
+            conn.close()
+        conn = self.__mirror_readers.pop(threading.get_ident(), None)
+        if conn is not None:
+            conn.close()
+
+    # -------------------------------------------------------------------------
+    def __mirror_reader(self):
+        """Returns the calling thread's connection to the current mirror, opening it on first use."""
+        readers = self.__mirror_readers
+        conn = readers.get(threading.get_ident())
+        if conn is None:
+            conn = open_sqlite3(self.__mirror[0], check_same_thread=False, uri=True, pragmas=MIRROR_PRAGMAS)
+            readers[threading.get_ident()] = conn
+        return conn
+
+    # -------------------------------------------------------------------------
+    def reload_mirror(self, conn):
+        """
+        Copies the database into a new in-memory mirror and switches reads to it.
+        conn: The writer connection. Runs between writes, so the copy is consistent.
+        Returns True if successful.
+        """
+        if not self.__mirrored:
+            return False
+        uri = f"file:mirror-{id(self)}-{time.monotonic_ns()}?mode=memory&cache=shared"
+        anchor = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.backup(anchor)
+        # Connections to the previous mirror close once no cursor uses them. 
+        # The previous copy is freed with the last of them.
+        previous = self.__mirror
+        self.__mirror_readers = {}
+        self.__mirror = (uri, anchor)
+        self.mirror_stale = False
+        if previous is not None:
+            previous[1].close()
+        return True
+
+    # -------------------------------------------------------------------------
+    def submit(self, function, *args):
+        """
+        Queues function(connection, *args) for the writer thread.
+        Returns a concurrent.futures.Future with the function's result
+        or exception.
+        """
+        future = concurrent.futures.Future()
+        if self.__shared is not None or threading.current_thread() is self.__writer:
+            # In-memory database, or a write made from within a write
+            self.__run(future, self.__shared or self.__writer_conn, function, args)
+        elif not self.ready:
+            future.set_exception(sqlite3.ProgrammingError(f"{self.target} is not open."))
+        else:
+            self.__queue.put((future, function, args))
+        return future
+
+    # -------------------------------------------------------------------------
+    def write(self, function, *args):
+        """Runs function(connection, *args) on the writer connection and returns its result."""
+        return self.submit(function, *args).result()
+
+    # -------------------------------------------------------------------------
+    def pending(self) -> int:
+        """Returns the number of writes waiting for the writer thread."""
+        return self.__queue.qsize()
+
+    # -------------------------------------------------------------------------
+    def __run(self, future, conn, function, args):
+        if not future.set_running_or_notify_cancel():
+            return
+        if self.__mirrored:
+            self.mirror_stale = True # Until reload_mirror() runs, reads go to the file
+        with self.__lock:
+            try:
+                future.set_result(function(conn, *args))
+            except (Exception, BaseException) as error:
+                future.set_exception(error)
+
+    # -------------------------------------------------------------------------
+    def __write_loop(self, conn):
+        self.__writer_conn = conn
+        while True:
+            work = self.__queue.get()
+            if work is None:
+                break
+            self.__run(work[0], conn, work[1], work[2])
+        conn.close()
+
+    # -------------------------------------------------------------------------
+    def close(self):
+        """Finishes queued writes, stops the writer thread and closes all connections."""
+        if self.__writer is not None and self.__writer.is_alive():
+            self.__queue.put(None)
+            if threading.current_thread() is not self.__writer:
+                self.__writer.join()
+        with self.__lock:
+            for conn in self.__readers:
+                conn.close()
+            self.__readers.clear()
+            for conn in self.__mirror_readers.values():
+                conn.close()
+            self.__mirror_readers = {}
+            if self.__mirror is not None:
+                self.__mirror[1].close()
+                self.__mirror = None
+            if self.__shared is not None:
+                self.__shared.close()
+                self.__shared = None
+        self.ready = False
+
 # =============================================================================
 #  --- MAIN: Only runs if the module is executed stand-alone. ---
 # =============================================================================
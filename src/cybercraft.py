@@ -3,29 +3,19 @@ import io
 import os
 import zipfile
 import asyncio
-from PySide6.QtWebEngineCore import QWebEngineUrlScheme
-from PySide6.QtCore import QFile, QIODevice
-import qasync
-
-
-# Register the scheme at module import time
-scheme = QWebEngineUrlScheme(b'resource')
-scheme.setFlags(QWebEngineUrlScheme.SecureScheme | 
-               QWebEngineUrlScheme.LocalScheme |
-               QWebEngineUrlScheme.LocalAccessAllowed)
-QWebEngineUrlScheme.registerScheme(scheme)
-
-
 import os
 import json
+import atexit
+import multiprocessing
 from loguru import logger
 from common import lfs
+from common import database
 from common import misc
 from common import network
+from common import cache_files
 import platform
 import argparse
-import cybercraft_gui
-from oscal_support import OSCAL_support
+from oscal_support import OSCAL_support, PREWARM_DEFAULT_MODELS
 from oscal_project_class import OSCAL_project
 
 logger.remove()
@@ -58,6 +48,18 @@ GUI_DEFAULT_WINDOW_WIDTH = 1280
 GUI_DEFAULT_WINDOW_HEIGHT = 1024
 GUI_DEFAULT_FULL_SCREEN = False
 GUI_DEFAULT_THEME = "light"
+# -- NETWORK DEFAULTS --
+NETWORK_DEFAULT_CONCURRENCY = network.DOWNLOAD_CONCURRENCY # Simultaneous downloads when learning OSCAL versions
+NETWORK_DEFAULT_TIMEOUT     = network.TOTAL_TIMEOUT        # Seconds allowed for each download
+NETWORK_DEFAULT_RETRIES     = network.RETRY_ATTEMPTS       # Attempts per download, including the first
+# -- SUPPORT DEFAULTS --
+SUPPORT_DEFAULT_PREWARM = True # Extract schemas and compile them in the import workers in the background after startup
+SUPPORT_DEFAULT_MEMORY_MIRROR = False # Serve support lookups from an in-memory copy of the support module (uses its size in RAM)
+# -- DATABASE DEFAULTS --
+DATABASE_DEFAULT_STATISTICS   = False                              # Time SQL statements and report them on exit
+DATABASE_DEFAULT_SLOW_QUERY_MS = database.sql_stats.SLOW_QUERY_MS  # Statements at or above this (ms) go to the SQL log
+DATABASE_DEFAULT_MAINTENANCE  = True                               # Collect unreferenced filecache entries in the background
+DATABASE_DEFAULT_MAINTENANCE_MINUTES = 30                          # Minutes between background maintenance passes
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 def is_production():
@@ -114,10 +116,26 @@ class app_control:
         self.config["gui"]["main"]["height"] = GUI_DEFAULT_WINDOW_HEIGHT
         self.config["gui"]["main"]["fullscreen"] = GUI_DEFAULT_FULL_SCREEN
         self.config["gui"]["theme"] = GUI_DEFAULT_THEME # "auto", "light", "dark" // TODO: "high-contrast"
+        self.config["support"] = {}
+        self.config["support"]["prewarm"] = SUPPORT_DEFAULT_PREWARM
+        self.config["support"]["prewarm_versions"] = [] # Empty: the most recent learned version
+        self.config["support"]["prewarm_models"] = PREWARM_DEFAULT_MODELS
+        self.config["support"]["memory_mirror"] = SUPPORT_DEFAULT_MEMORY_MIRROR
+        self.config["network"] = {}
+        self.config["network"]["download_concurrency"] = NETWORK_DEFAULT_CONCURRENCY
+        self.config["network"]["timeout_seconds"] = NETWORK_DEFAULT_TIMEOUT
+        self.config["network"]["retries"] = NETWORK_DEFAULT_RETRIES
+        self.config["database"] = {}
+        self.config["database"]["statistics"] = DATABASE_DEFAULT_STATISTICS
+        self.config["database"]["slow_query_ms"] = DATABASE_DEFAULT_SLOW_QUERY_MS
+        self.config["database"]["maintenance"] = DATABASE_DEFAULT_MAINTENANCE
+        self.config["database"]["maintenance_minutes"] = DATABASE_DEFAULT_MAINTENANCE_MINUTES
         self.__backup_config_before_saving = False
         self.__save_config_on_exit = False
         self.support = None
         self.project = None
+        self.__maintenance_targets = [] # Objects with a db and collect_garbage(), maintained in the background
+        self.__maintenance_task = None
         
     # -------------------------------------------------------------------------
     @classmethod
@@ -182,7 +200,11 @@ class app_control:
         # Once we know file and folder locations exist, we can load the configuration file
         if status:
             self.__load_config()
+            self.__setup_database_statistics()
             self.__setup_loggers()
+            network.configure(concurrency=self.config["network"]["download_concurrency"],
+                              timeout=self.config["network"]["timeout_seconds"],
+                              retries=self.config["network"]["retries"])
 
         # If the info argument (-i or --info) is passed, display the application information and exit
         if self.args.info:
@@ -194,7 +216,9 @@ class app_control:
         # Even if this is the firt time running, and regardless of CLI or GUI mode.
         self.__save_config_on_exit = True
 
-        self.support = await OSCAL_support.create(self.config["location"]["supportfile"]["data"])
+        self.support = await OSCAL_support.create(self.config["location"]["supportfile"]["data"], 
+                                                  mirror=self.config["support"].get("memory_mirror", False) and not self.cli_only)
+        cache_files.use_support_database(self.support)
         logger.debug(f"Support file: {self.config["location"]["supportfile"]["data"]}")
 
 
@@ -210,7 +234,7 @@ class app_control:
 
         # if the learn-all argument (-la or --learn-all) is passed, re-learn all OSCAL version(s)
         if self.args.learn_oscal_all:
-            logger.info("Relearning all OSCAL version(s)")
+            logger.info("Checking all OSCAL version(s) for changed support files")
             if await self.support.update("all"):
                 logger.info("All OSCAL versions learned.")
                 logger.info(f"Updated support module at {self.config["location"]["supportfile"]["data"]}")
@@ -218,6 +242,47 @@ class app_control:
                 logger.error("Unable to learn all OSCAL versions.")
             sys.exit(0)
 
+        # if the rehash argument (-rh or --rehash) is passed, convert support files to content-addressed storage
+        if self.args.rehash_support:
+            logger.info("Rehashing OSCAL support files")
+            result = await self.support.rehash()
+            logger.info(f"Rehashed support module at {self.config["location"]["supportfile"]["data"]}")
+            logger.info(f"{result['converted']} converted, {result['merged']} duplicates merged.")
+            sys.exit(0)
+
+        # if the collect-garbage argument (-gc or --collect-garbage) is passed, remove unreferenced support files and compact the database
+        if self.args.collect_garbage:
+            logger.info("Collecting unreferenced OSCAL support files")
+            result = await self.support.collect_garbage(convert=True)
+            logger.info(f"Compacted support module at {self.config["location"]["supportfile"]["data"]}")
+            logger.info(f"{result['deleted']} entries deleted. Size {result['size_before']:,} -> {result['size_after']:,} bytes.")
+            sys.exit(0)
+
+        # if the benchmark-compression argument (-bc or --benchmark-compression) is passed, compare filecache codecs on the support files
+        if self.args.benchmark_compression:
+            logger.info("Benchmarking filecache compression on OSCAL support files")
+            await self.support.benchmark_compression()
+            sys.exit(0)
+
+        # if the bundle-export argument (-be or --bundle-export) is passed, export learned OSCAL versions for offline use
+        if self.args.bundle_export:
+            logger.info(f"Exporting OSCAL support bundle to {self.args.bundle_export}")
+            if await self.support.export_bundle(self.args.bundle_export) >= 0:
+                logger.info("OSCAL support bundle exported.")
+            else:
+                logger.error("Unable to export OSCAL support bundle.")
+            sys.exit(0)
+
+        # if the bundle-import argument (-bi or --bundle-import) is passed, learn OSCAL versions from a bundle
+        if self.args.bundle_import:
+            logger.info(f"Importing OSCAL support bundle from {self.args.bundle_import}")
+            if lfs.chkfile(self.args.bundle_import) and await self.support.import_bundle(self.args.bundle_import) >= 0:
+                logger.info("OSCAL support bundle imported.")
+                logger.info(f"Updated support module at {self.config["location"]["supportfile"]["data"]}")
+            else:
+                logger.error(f"Unable to import OSCAL support bundle {self.args.bundle_import}.")
+            sys.exit(0)
+
         # if the metaschema argument is passed, learn the specified OSCAL extension 
         # if self.args.metaschema:
         #     status = False
@@ -261,6 +326,62 @@ class app_control:
 
         return status
     
+    # -------------------------------------------------------------------------
+    def start_prewarm(self, models_in_use=None):
+        """
+        Schedules support file prewarming as a background task on the 
+        running event loop, if enabled in the configuration.
+        - models_in_use (list)[optional]: (version, model) tuples from an 
+          open project, prepared ahead of the configured defaults.
+        Returns the task, or None if prewarming is disabled.
+        """
+        task = None
+        if self.support is not None and self.support.ready and self.config["support"].get("prewarm", False):
+            targets = list(models_in_use or [])
+            versions = self.config["support"].get("prewarm_versions", []) or list(self.support.versions)[:1]
+            for version in versions:
+                for model in self.config["support"].get("prewarm_models", []):
+                    if (version, model) not in targets:
+                        targets.append((version, model))
+            if targets:
+                logger.debug(f"Prewarming support files for {targets}")
+                task = asyncio.ensure_future(self.support.prewarm(targets))
+        return task
+
+    # -------------------------------------------------------------------------
+    def start_maintenance(self, target=None):
+        """
+        Schedules filecache garbage collection and compaction as a
+        background task on the running event loop, if enabled in the
+        configuration. Each pass waits until the database has no queued writes.
+        - target (object)[optional]: An object with a db and collect_garbage()
+          (ie an open OSCAL_project) to maintain along with the support database.
+        Returns the task, or None if maintenance is disabled.
+        """
+        if not self.config["database"].get("maintenance", False):
+            return None
+        for candidate in (self.support, target):
+            if candidate is not None and candidate not in self.__maintenance_targets:
+                self.__maintenance_targets.append(candidate)
+        if self.__maintenance_task is None or self.__maintenance_task.done():
+            self.__maintenance_task = asyncio.ensure_future(self.__maintenance())
+        return self.__maintenance_task
+
+    # -------------------------------------------------------------------------
+    async def __maintenance(self):
+        interval = max(self.config["database"].get("maintenance_minutes", DATABASE_DEFAULT_MAINTENANCE_MINUTES), 1) * 60
+        while self.__maintenance_targets:
+            await asyncio.sleep(interval)
+            # Closed databases are dropped
+            self.__maintenance_targets = [target for target in self.__maintenance_targets if target.db is not None and target.db.connections]
+            for target in list(self.__maintenance_targets):
+                while not target.db.idle:
+                    await asyncio.sleep(1)
+                try:
+                    await target.collect_garbage()
+                except Exception as error:
+                    logger.error(f"Background database maintenance failed ({type(error).__name__}): {str(error)}")
+
     # -------------------------------------------------------------------------
     def __startup_arguments(self):
         # Get Runtime Arguments and Parameters
@@ -273,8 +394,14 @@ class app_control:
         parser.add_argument("-v",  '--version',         dest="version",            help='Report the application version and exit.',                action="version", version=f"{APP_NAME} {APP_VERSION} ({APP_VERSION_DATE})")
         parser.add_argument("-i",  '--info',            dest="info",               help='Report the application configuration and exit.',          action="store_true")
         parser.add_argument("-ln", '--learn-new',       dest="learn_oscal_latest", help='Learn recently released OSCAL version(s) and exit.',      action="store_true")
-        parser.add_argument("-la", '--learn-all',       dest="learn_oscal_all",    help='Re-learn all OSCAL versions and exit.',                   action="store_true")
+        parser.add_argument("-la", '--learn-all',       dest="learn_oscal_all",    help='Check all OSCAL versions for changed files and exit.',    action="store_true")
+        parser.add_argument("-rh", '--rehash',          dest="rehash_support",     help='Store learned support files by content hash and exit.',   action="store_true")
+        parser.add_argument("-gc", '--collect-garbage', dest="collect_garbage",    help='Delete unreferenced support files, compact the support module and exit.', action="store_true")
+        parser.add_argument("-bc", '--benchmark-compression', dest="benchmark_compression", help='Compare filecache compression codecs on support files and exit.', action="store_true")
+        parser.add_argument("-be", '--bundle-export',   dest="bundle_export",      help='Export learned OSCAL versions to a bundle file and exit.', type=str)
+        parser.add_argument("-bi", '--bundle-import',   dest="bundle_import",      help='Learn OSCAL versions from a bundle file and exit.',       type=str)
         # parser.add_argument("-lx", '--learn-extension', dest="metaschema",         help='Learn an OSCAL extension in metaschema format and exit.', type=str)
+        parser.add_argument(       '--db-stats',        dest="db_stats",           help='Report database statement timings when the application exits.', action="store_true")
         parser.add_argument("-d",  '--debug',           dest="debug",              help='Run the application with debugging turned on.',           action="store_true")
         parser.add_argument("-p",  '--portable',        dest="portable",           help='Run the application in portable mode.',                   action="store_true")
         if not self.__production:
@@ -291,7 +418,7 @@ class app_control:
             logger.debug("PORTABLE MODE: " + misc.iif(self.portable_mode, "YES", "NO"))
 
         # If an argument is passed that does not require the GUI, set the cli_only flag
-        if self.args.info or self.args.learn_oscal_latest or self.args.learn_oscal_all: # or self.args.metaschema:
+        if self.args.info or self.args.learn_oscal_latest or self.args.learn_oscal_all or self.args.rehash_support or self.args.collect_garbage or self.args.benchmark_compression or self.args.bundle_export or self.args.bundle_import: # or self.args.metaschema:
             self.cli_only = True
         else:
             self.cli_only = False
@@ -319,6 +446,7 @@ class app_control:
             if not lfs.chkfile(self.config["location"]["supportfile"]["data"]):
                 logger.warning(f"{self.config["location"]["supportfile"]["data"]} not found.")
                 resource_path = f":/support/support.zip"
+                from PySide6.QtCore import QFile, QIODevice
                 file = QFile(resource_path)
                 if file.open(QIODevice.ReadOnly): 
                     logger.debug(f"Checking for support filein onboard datastore.")
@@ -410,11 +538,29 @@ class app_control:
                 colorize=True
             )
 
-        # Log to file - always
-        logger.add(os.path.join(log_location, LOG_APP_FILE_FORMAT), format=log_format, level=log_level, rotation="5 MB", retention=4, enqueue=True)
+        # Log to file - always. SQL statistics go to their own log (below).
+        logger.add(os.path.join(log_location, LOG_APP_FILE_FORMAT), format=log_format, level=log_level, rotation="5 MB", retention=4, enqueue=True,
+                   filter=lambda record: "sql" not in record["extra"])
+
+        if database.SQL_STATS.enabled:
+            # Slow statements and the statistics report - only when database statistics are on
+            logger.add(os.path.join(log_location, LOG_SQL_FILE_FORMAT), format=LOG_APP_FORMAT, level="DEBUG", rotation="5 MB", retention=4, enqueue=True,
+                       filter=lambda record: "sql" in record["extra"])
 
         # logger.info(f"Log (Level: {log_level}) Locaiton: {log_location}")
 
+    # -------------------------------------------------------------------------
+    def __setup_database_statistics(self):
+        """Turns on SQL statement timing if requested by --db-stats or the config file. The report is logged on exit."""
+        if self.args.db_stats or self.config["database"].get("statistics", False):
+            database.SQL_STATS.enable(self.config["database"].get("slow_query_ms", DATABASE_DEFAULT_SLOW_QUERY_MS))
+            atexit.register(self.__report_database_statistics)
+
+    # -------------------------------------------------------------------------
+    def __report_database_statistics(self):
+        report = database.SQL_STATS.report()
+        logger.bind(sql=True).info(f"SQL statement statistics (slowest total time first):\n{report}")
+
     # =========================================================================
     def __load_config(self):
         """Loads the configuration file if found and uses it to over-ride defaults."""
@@ -456,6 +602,15 @@ class app_control:
             for window_key in json_config["gui"]:
                 self.config["gui"][window_key] = json_config["gui"][window_key]
                 # logger.debug(f"Window Key: {window_key} = {self.config["gui"][window_key]}")
+        if "support" in json_config:
+            for support_key in json_config["support"]:
+                self.config["support"][support_key] = json_config["support"][support_key]
+        if "network" in json_config:
+            for network_key in json_config["network"]:
+                self.config["network"][network_key] = json_config["network"][network_key]
+        if "database" in json_config:
+            for database_key in json_config["database"]:
+                self.config["database"][database_key] = json_config["database"][database_key]
     # -------------------------------------------------------------------------
     def __config_json(self):
         json_out = {}
@@ -466,6 +621,9 @@ class app_control:
         json_out["location"] = self.config["location"]
         json_out["user"] = self.config["user"] 
         json_out["gui"] = self.config["gui"] 
+        json_out["support"] = self.config["support"]
+        json_out["network"] = self.config["network"]
+        json_out["database"] = self.config["database"]
 
         return json_out
     # -------------------------------------------------------------------------
@@ -481,7 +639,21 @@ class app_control:
         else:
             logger.warning(f"Unable to save configuration [{temp}]")
     
+def register_resource_scheme():
+    """
+    Registers the resource scheme with QtWebEngine. Must be called before the
+    application is created. Not done at import time: the import worker 
+    processes (see oscal_importer) import this module and need no GUI.
+    """
+    from PySide6.QtWebEngineCore import QWebEngineUrlScheme
+    scheme = QWebEngineUrlScheme(b'resource')
+    scheme.setFlags(QWebEngineUrlScheme.SecureScheme | 
+                   QWebEngineUrlScheme.LocalScheme |
+                   QWebEngineUrlScheme.LocalAccessAllowed)
+    QWebEngineUrlScheme.registerScheme(scheme)
+
 async def main():
+    import cybercraft_gui
     app_instance = await app_control.create()
     try:
         if app_instance.status:
@@ -496,6 +668,8 @@ async def main():
     return exit_code
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # Import worker processes (see oscal_importer) in packaged builds
+    register_resource_scheme()
     try:
         exit_code = asyncio.run(main())
         logger.info(f"Application exited with code: {exit_code}")
@@ -695,6 +695,10 @@ async def desktop_startup(app_instance):
     QApplication.setFont(font)
 
     main_win = create_main_window(app_instance)
+
+    # Once the GUI loop exists, prepare support files in the background
+    app_instance.start_prewarm()
+    app_instance.start_maintenance()
     
     if not app_instance.initial_file:
         logger.debug("No file or URL passed. Opening default.")
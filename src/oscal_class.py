@@ -7,10 +7,82 @@ from xml.dom import minidom
 from common import *
 from oscal_support import *
 import uuid
+from datetime import datetime
 
 # As defined by NIST:
 OSCAL_DEFAULT_NAMESPACE = "http://csrc.nist.gov/ns/oscal/1.0"
 
+# Change journal:
+# Edits are journaled by the top-level section they touch (the local name of
+# the root's child, such as "metadata" or "back-matter"). Edits that can not be
+# attributed to one section are journaled against the whole document.
+# Entries are kept until every SYNC_TARGETS output has caught up with them.
+WHOLE_DOCUMENT = "*"
+SYNC_TARGETS = ["xml", "json", "yaml", "validation"] # Derived outputs that must catch up with edits
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# OSCAL VIEW CLASS
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class OSCAL_view:
+    """
+    Lightweight, read-only view of an OSCAL element, as yielded by the 
+    OSCAL class iterators (iter_controls, iter_parts, iter_params, etc.)
+    Only a reference to the underlying ElementTree element is held, so 
+    nothing is copied as the document is walked.
+
+    Properties:
+    - element: The underlying ElementTree element
+    - name: The element's local name (ie "control", "param")
+    - id, uuid, class_, control_id: The attribute values, or an empty string
+    - title: The text of the title child, or an empty string
+    """
+    __slots__ = ("element",)
+
+    def __init__(self, element):
+        self.element = element
+
+    def __repr__(self):
+        return f"<OSCAL_view {self.name} id='{self.id}' uuid='{self.uuid}'>"
+
+    @property
+    def name(self):
+        return self.element.tag.rsplit("}", 1)[-1]
+
+    @property
+    def id(self):
+        return self.element.get("id", "")
+
+    @property
+    def uuid(self):
+        return self.element.get("uuid", "")
+
+    @property
+    def class_(self):
+        return self.element.get("class", "")
+
+    @property
+    def control_id(self):
+        return self.element.get("control-id", "")
+
+    @property
+    def title(self):
+        node = self.element.find(oscal_tag("title"))
+        return "".join(node.itertext()) if node is not None else ""
+
+    def get(self, attribute, default=""):
+        """Returns the value of any attribute, or the default if absent."""
+        return self.element.get(attribute, default)
+
+# -----------------------------------------------------------------------------
+def oscal_tag(name):
+    """Returns the ElementTree tag for an element name in the OSCAL namespace."""
+    return f"{{{OSCAL_DEFAULT_NAMESPACE}}}{name}"
+
+# -----------------------------------------------------------------------------
+def _element_of(node):
+    """Accepts an OSCAL_view or an ElementTree element and returns the element."""
+    return node.element if isinstance(node, OSCAL_view) else node
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # OSCAL CLASS
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -39,12 +111,19 @@ class OSCAL:
     - serializer: Serializes the content for output
     - lookup: Checks for the existence of an element based on an xpath expression
     - append_child: Appends a child node to the content
-    - content_modified: Sets the content as modified
-    - __setup_saxon: Sets up the Saxon processor
+    - iter_elements: Yields a view of each element with a given name, in document order
+    - iter_controls: Yields a view of each control, including nested controls
+    - iter_parts: Yields a view of each part of a control
+    - iter_params: Yields a view of each parameter of a control, or of the document
+    - iter_implemented_requirements: Yields a view of each implemented requirement
+    - content_modified: Records an edit to a top-level section in the change journal
+    - section_of: Identifies the top-level section an xpath expression points into
+    - needs_sync: Indicates whether a derived output is stale for one or more sections
+    - pending_sections: Returns the sections edited since a derived output was last synced
+    - mark_synced: Clears pending edits for a derived output
+    - __setup_saxon: Parses the content into XDM and sets up the shared Saxon XPath processor
     - __saxon_serializer: Serializes the content using the Saxon processor
-    - __saxon_handle_ns: Handles namespaces using the Saxon processor
-    - __saxon_xpath_global: Performs an xpath query on the content using the Saxon processor
-    - __saxon_xpath_global_single: Performs an xpath query on the content using the Saxon processor
+    - __saxon_handle_ns: Declares the OSCAL namespace with the Saxon XPath processor
     - __saxon_xpath: Performs an xpath query on the content using the Saxon processor
     - __saxon_xpath_single: Performs an xpath query on the content using the Saxon processor
     """
@@ -66,11 +145,21 @@ class OSCAL:
         self.original_well_formed = None  # A boolean indicating whether the content is well-formed in its original format
 
         self.tree = None
+        self.valid_xml = False
+        self.valid_oscal = None
         self.nsmap = {"": OSCAL_DEFAULT_NAMESPACE}
-        self.__saxon = None
+        self.__saxon = None        # Saxon query engine, created on first use (see xpath(engine="saxon"))
+        self.__saxon_xp = None
+        self.__saxon_edit_count = 0 # edit_count when the XDM was last parsed
+        self.__saxon_results = {}  # Document-level Saxon results, kept until the next edit
+        self.xdm = None
         self.unsaved_modified_content = False 
         self.json_synced = None # Boolean indicating whether the latest XML content has been converted to JSON
         self.yaml_synced = None # Boolean indicating whether the latest XML content has been converted to YAML
+        self.change_journal = [] # Ordered list of edits not yet synced to every target: {"timestamp", "section", "action"}
+        self.edit_count = 0      # Edits since the content was loaded. Unlike the journal, never trimmed.
+        self.__pending = {target: set() for target in SYNC_TARGETS} # Sections edited since each target was synced
+        self.__serialized = None # Last serializer output, reused until the XML is edited again
 
         # check for XML validity
         try:
@@ -97,10 +186,101 @@ class OSCAL:
                 logger.error("ROOT ELEMENT IS NOT AN OSCAL MODEL: " + root_element)
 
     # -------------------------------------------------------------------------
-    def content_modified(self):
+    def content_modified(self, section=WHOLE_DOCUMENT, action="modified"):
+        """
+        Records an edit in the change journal and flags the derived outputs
+        (serialized XML, JSON, YAML and validation results) as out of date
+        for the touched section only.
+        append_child() calls it. Edits made any other way, such as to an 
+        element returned by xpath() or an iterator, are not seen unless 
+        the caller calls content_modified() itself.
+
+        Parameters:
+        - section (str)[optional]: The top-level section that was edited, 
+          such as "metadata" or "back-matter". Use section_of() to derive it 
+          from an xpath expression. Defaults to the whole document.
+        - action (str)[optional]: A short description of the edit.
+        """
         self.unsaved_modified_content = True
+        self.edit_count += 1
+        self.change_journal.append({
+            "timestamp": misc.oscal_date_time_with_timezone(datetime.now()),
+            "section": section,
+            "action": action
+        })
+        for target in SYNC_TARGETS:
+            self.__pending[target].add(section)
         self.json_synced = False
         self.yaml_synced = False
+
+    # -------------------------------------------------------------------------
+    def section_of(self, xpath):
+        """
+        Identifies the top-level section an xpath expression points into.
+        Accepts expressions relative to the root ("./metadata/title"), 
+        or absolute from the root ("/catalog/back-matter/resource").
+
+        Returns the local name of the section, or WHOLE_DOCUMENT if the 
+        expression targets the root itself or can not be attributed to a 
+        single section (ie it starts with "//" or uses a wildcard).
+        """
+        section = WHOLE_DOCUMENT
+        if xpath and "//" not in xpath:
+            steps = [step for step in xpath.split("/") if step not in ("", ".")]
+            if xpath.startswith("/") and steps:
+                steps = steps[1:] # The first step of an absolute path is the root element
+            if steps:
+                step = steps[0].split("[")[0]            # drop any predicate
+                step = step.rsplit("}", 1)[-1]           # drop a {namespace} qualifier
+                step = step.rsplit(":", 1)[-1]           # drop a namespace prefix
+                if step not in ("", "*", "..") and "(" not in step:
+                    section = step
+        return section
+
+    # -------------------------------------------------------------------------
+    def pending_sections(self, target):
+        """
+        Returns the set of sections edited since the target was last synced.
+        - target (str): one of SYNC_TARGETS ("xml", "json", "yaml", "validation")
+        """
+        return set(self.__pending.get(target, set()))
+
+    # -------------------------------------------------------------------------
+    def needs_sync(self, target, sections=None):
+        """
+        Indicates whether a derived output is stale.
+        - target (str): one of SYNC_TARGETS
+        - sections (list)[optional]: Only consider edits to these sections. 
+          An edit to the whole document always counts.
+        Returns True if the target must be regenerated. False otherwise.
+        """
+        pending = self.__pending.get(target, set())
+        if sections is None or WHOLE_DOCUMENT in pending:
+            return len(pending) > 0
+        return not pending.isdisjoint(sections)
+
+    # -------------------------------------------------------------------------
+    def mark_synced(self, target, sections=None):
+        """
+        Clears pending edits once a derived output has been regenerated.
+        Once every target is synced, the change journal is emptied.
+        - target (str): one of SYNC_TARGETS
+        - sections (list)[optional]: Only clear these sections. 
+          Clears all pending edits for the target if absent.
+        """
+        if target in self.__pending:
+            if sections is None:
+                self.__pending[target].clear()
+            else:
+                self.__pending[target].difference_update(sections)
+
+            if not self.__pending[target]:
+                if target == "json":
+                    self.json_synced = True
+                if target == "yaml":
+                    self.yaml_synced = True
+            if not any(self.__pending.values()):
+                self.change_journal.clear()
     
     # -------------------------------------------------------------------------
     def OSCAL_validate(self):
@@ -109,8 +289,9 @@ class OSCAL:
         Will soon validate OSCAL XML content using the appropriate NIST OLSCAL XML Schema file for the specified OSCAL model and version.
         Eventually will use metaschema definitions to validate.
         """
-        self.valid_oscal = True
-        pass
+        if self.valid_oscal is None or self.needs_sync("validation"):
+            self.valid_oscal = True
+            self.mark_synced("validation")
 
     # -------------------------------------------------------------------------
     def OSCAL_convert(self, directive):
@@ -122,26 +303,41 @@ class OSCAL:
         pass
 
     # -------------------------------------------------------------------------
-    def __setup_saxon(self): # Future - place holder for code for now
-        self.__saxon = PySaxonProcessor(license=False)
+    def __setup_saxon(self):
+        """
+        Prepares the Saxon query engine. 
+        The document is parsed into XDM once, and a single XPath processor is
+        created with the OSCAL namespace declared and expression caching on.
+        Called lazily by the first Saxon query, and again if the content has
+        been edited since the XDM was parsed (see edit_count).
+        """
+        status = False
+        if self.__saxon is None:
+            self.__saxon = PySaxonProcessor(license=False)
+            self.__saxon_xp = self.__saxon.new_xpath_processor() # One processor for the life of the object
+            self.__saxon_xp.set_caching(True) # Saxon keeps compiled expressions for re-use
+            self.__saxon_handle_ns()
+
+        # Edits are made to the ElementTree, so re-parse from its serialized form
+        source = self.content if not self.edit_count else self.serializer()
         try: 
-            self.xdm = self.__saxon.parse_xml(xml_text=content)
-            # self.__saxon.declare_namespace("", "http://csrc.nist.gov/ns/oscal/1.0")
-            self.valid = True
-            self.oscal_format = "xml"
-        except:
-            logger.error("Content does not appear to be valid XML. Unable to rpoceed")
-
-        if self.valid:
-            self.xp = self.__saxon.new_xpath_processor() # Instantiates XPath processing
-            self.handle_ns()
-            self.xp.set_context(xdm_item=self.xdm) # Sets xpath processing context as the whole file
-            temp_ret = self.xpath_global("/*/name()")
-            if temp_ret is not None:
-                self.root_node = temp_ret[0].get_atomic_value().string_value
-                logger.debug("ROOT: " + self.root_node)
-            self.oscal_version = self.xpath_global_single("/*/*:metadata/*:oscal-version/text()")
-            logger.debug("OSCAL VERSION: " + self.oscal_version)
+            self.xdm = self.__saxon.parse_xml(xml_text=source)
+            self.__saxon_edit_count = self.edit_count
+            self.__saxon_results = {}
+            status = True
+        except (Exception, BaseException) as error:
+            self.xdm = None
+            logger.error(f"Saxon unable to parse content ({type(error).__name__}): {str(error)}")
+
+        return status
+
+    # -------------------------------------------------------------------------
+    def __saxon_ready(self):
+        """Returns True if the XDM is available and reflects all journaled edits."""
+        status = True
+        if self.__saxon is None or self.xdm is None or self.__saxon_edit_count != self.edit_count:
+            status = self.__setup_saxon()
+        return status
 
     # -------------------------------------------------------------------------
     def __saxon_serializer(self):
@@ -149,82 +345,62 @@ class OSCAL:
 
     # -------------------------------------------------------------------------
     def __saxon_handle_ns(self):
-        node_ = self.xdm
-        child = node_.children[0]
-        assert child is not None
-        namespaces = child.axis_nodes(8)
-
-        for ns in namespaces:
-            uri_str = ns.string_value
-            ns_prefix = ns.name
-
-            if ns_prefix is not None:
-                logger.debug("xmlns:" + ns_prefix + "='" + uri_str + "'")
-            else:
-                logger.debug("xmlns uri=" + uri_str + "'")
-                # set default ns here
-                self.xp.declare_namespace("", uri_str)
+        """Declares the OSCAL namespace once, as the default and as the "oscal" prefix."""
+        for prefix, uri in self.nsmap.items():
+            logger.debug(f"xmlns{misc.iif(prefix, ':' + prefix, '')}='{uri}'")
+            self.__saxon_xp.declare_namespace(prefix, uri)
+        self.__saxon_xp.declare_namespace("oscal", OSCAL_DEFAULT_NAMESPACE)
 
     # -------------------------------------------------------------------------
-    def __saxon_xpath_global(self, expression):
+    def __saxon_xpath(self, context, expression):
+        """
+        Evaluates an expression with the shared Saxon XPath processor.
+        If context is None the whole document is the context, and the result
+        is kept until the content is edited.
+        Returns a PyXdmValue, or None if nothing is found.
+        """
         ret_value = None
-        logger.debug("Global Evaluating: " + expression)
-        ret = self.xp.evaluate(expression)
-        if  isinstance(ret,PyXdmValue):
-            logger.debug("--Return Size: " + str(ret.size))
-            ret_value = ret
-        else:
-            logger.debug("--No result")
+        if not self.__saxon_ready():
+            return ret_value
 
-        return ret_value
-
-    # -------------------------------------------------------------------------
-    def __saxon_xpath_global_single(self, expression):
-        ret_value = ""
-        logger.debug("Global Evaluating Single: " + expression)
-        ret = self.xp.evaluate_single(expression)
-        if  isinstance(ret, PyXdmValue): # isinstance(ret,PyXdmNode):
-            ret_value = ret.string_value
-        else:
-            logger.debug("--No result")
-            logger.debug("TYPE: " + str(type(ret)))
+        if context is None and expression in self.__saxon_results:
+            logger.debug("Saxon Cached: " + expression)
+            return self.__saxon_results[expression]
 
-        return ret_value
-
-    # -------------------------------------------------------------------------
-    def __saxon_xpath(self, context, expression):
-        ret_value = None
-        logger.debug("Evaluating: " + expression)
-        xp = self.__saxon.new_xpath_processor() # Instantiates XPath processing
-        xp.set_context(xdm_item=context)
-        ret = xp.evaluate(expression)
+        logger.debug("Saxon Evaluating: " + expression)
+        self.__saxon_xp.set_context(xdm_item=misc.iif(context is None, self.xdm, context))
+        ret = self.__saxon_xp.evaluate(expression)
         if  isinstance(ret,PyXdmValue):
             logger.debug("--Return Size: " + str(ret.size))
             ret_value = ret
         else:
             logger.debug("--No result")
 
+        if context is None:
+            self.__saxon_results[expression] = ret_value
         return ret_value
 
     # -------------------------------------------------------------------------
     def __saxon_xpath_single(self, context, expression):
+        """
+        Evaluates an expression with the shared Saxon XPath processor and
+        returns the string value of the first item, or an empty string.
+        """
         ret_value = ""
-        logger.debug("Evaluating Single: " + expression)
-        xp = self.__saxon.new_xpath_processor() # Instantiates XPath processing
-        xp.set_context(xdm_item=context)
-        ret = xp.evaluate_single(expression)
-        if  isinstance(ret, PyXdmValue): # isinstance(ret,PyXdmNode):
-            ret_value = ret.string_value
+        ret = self.__saxon_xpath(context, expression)
+        if ret is not None and ret.size > 0:
+            ret_value = ret.item_at(0).string_value
         else:
             logger.debug("--No result")
-            logger.debug("TYPE: " + str(type(ret)))
 
         return ret_value
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
     
-    def xpath_atomic(self, xExpr, context=None):
+    def xpath_atomic(self, xExpr, context=None, engine="elementpath"):
         ret_value=""
+        if engine == "saxon":
+            return self.__saxon_xpath_single(context, xExpr)
         if context is None:
             logger.debug("XPath [1]: " + xExpr)
             ret_value = elementpath.select(self.tree, xExpr, namespaces=self.nsmap)[0]
@@ -234,7 +410,7 @@ class OSCAL:
 
         return str(ret_value)
 
-    def xpath(self, xExpr, context=None):
+    def xpath(self, xExpr, context=None, engine="elementpath"):
         """
         Performs an xpath query either on the entire XML document 
         or on a context within the document.
@@ -245,6 +421,10 @@ class OSCAL:
         If the context object is present, the xpath expression is run against
         that context. If absent, the xpath expression is run against the 
         entire document.
+        - engine (str)[optional]: "elementpath" (default) or "saxon".
+        Saxon is faster for heavy XPath 3.1 queries. It parses the document
+        once and re-uses compiled expressions. It returns a PyXdmValue, and 
+        any context must be a PyXdmNode from a previous Saxon query.
 
         Returns: 
         - None if there is an error or if nothing is found.
@@ -252,6 +432,8 @@ class OSCAL:
         """
         
         ret_value=None
+        if engine == "saxon":
+            return self.__saxon_xpath(context, xExpr)
         if context is None:
             logger.debug("XPath [1]: " + xExpr)
             ret_value = elementpath.select(self.tree, xExpr, namespaces=self.nsmap)
@@ -262,14 +444,20 @@ class OSCAL:
         return ret_value
 
     def serializer(self):
+        if self.__serialized is not None and not self.needs_sync("xml"):
+            logger.debug("No edits since last serialization. Reusing output.")
+            return self.__serialized
+
         logger.debug("Serializing for Output")
         ElementTree.indent(self.tree)
         out_string = ElementTree.tostring(self.tree, 'utf-8')
         logger.debug("LEN: " + str(len(out_string)))
-        out_string = normalize_content(out_string)
+        out_string = misc.normalize_content(out_string)
         out_string = out_string.replace("ns0:", "")
         out_string = out_string.replace(":ns0", "")
-        
+
+        self.__serialized = out_string
+        self.mark_synced("xml")
         return out_string
     
     def lookup(self, xExpr: str, attributes: list=[], children: list=[]):
@@ -332,6 +520,7 @@ class OSCAL:
                     child.set(attrib[0], attrib[1])
 
                 parent_node.append(child)
+                self.content_modified(self.section_of(xpath), f"append {node_name}")
                 status = True
             else:
                 logger.warning("APPEND: Unable to find " + xpath )
@@ -343,6 +532,66 @@ class OSCAL:
         else:
             return None
 
+    # -------------------------------------------------------------------------
+    # Streaming iterators
+    # These walk the ElementTree lazily and yield OSCAL_view objects, so a 
+    # caller can stop early and never holds more than the current element.
+    # -------------------------------------------------------------------------
+    def iter_elements(self, name, context=None):
+        """
+        Yields a view of each element with the given local name, in document order.
+        - name (str): The OSCAL element name, such as "control" or "param"
+        - context (OSCAL_view or element)[optional]: Only search within this element.
+        """
+        root = self.tree if context is None else _element_of(context)
+        if root is not None:
+            for element in root.iter(oscal_tag(name)):
+                yield OSCAL_view(element)
+
+    # -------------------------------------------------------------------------
+    def iter_controls(self, context=None):
+        """Yields a view of each control (including nested controls) in document order."""
+        yield from self.iter_elements("control", context)
+
+    # -------------------------------------------------------------------------
+    def iter_parts(self, control, recursive=True):
+        """
+        Yields a view of each part belonging to a control.
+        Parts of nested controls are not included.
+        - control (OSCAL_view or element): The control
+        - recursive (bool)[optional]: If True (default), parts within parts are included.
+        """
+        part_tag = oscal_tag("part")
+        pending = [iter(_element_of(control))]
+        while pending:
+            for child in pending[-1]:
+                if child.tag == part_tag:
+                    yield OSCAL_view(child)
+                    if recursive:
+                        pending.append(iter(child))
+                        break
+            else:
+                pending.pop()
+
+    # -------------------------------------------------------------------------
+    def iter_params(self, control=None):
+        """
+        Yields a view of each parameter.
+        - control (OSCAL_view or element)[optional]: Only the parameters 
+          defined directly by this control (or group). If absent, every 
+          parameter in the document is yielded.
+        """
+        if control is None:
+            yield from self.iter_elements("param")
+        else:
+            for element in _element_of(control).iterfind(oscal_tag("param")):
+                yield OSCAL_view(element)
+
+    # -------------------------------------------------------------------------
+    def iter_implemented_requirements(self, context=None):
+        """Yields a view of each implemented-requirement in document order."""
+        yield from self.iter_elements("implemented-requirement", context)
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
@@ -0,0 +1,230 @@
+from loguru import logger
+from common import *
+from oscal_class import *
+import json
+import sys
+import uuid
+from datetime import datetime
+
+CONTROL_INDEX_FILE_TYPE = "control-index" # filecache file_type for cached control indexes
+CONTROL_INDEX_FORMAT    = 1               # Bump when the serialized layout changes
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# CONTROL RECORD CLASS
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class OSCAL_control_record:
+    """
+    Compact record of a single control, extracted from a catalog.
+
+    Properties:
+    - id: The control id
+    - title: The control title
+    - class_: The control class attribute (ie "SP800-53" or "SP800-53-enhancement")
+    - parent: The id of the enclosing control or group, or an empty string
+    - param_ids: A tuple of the ids of the parameters defined by the control
+    - statement_start, statement_end: Offsets of the control's statement text
+      within OSCAL_control_index.statements
+    """
+    __slots__ = ("id", "title", "class_", "parent", "param_ids", "statement_start", "statement_end")
+
+    def __init__(self, id, title="", class_="", parent="", param_ids=(), statement_start=0, statement_end=0):
+        self.id              = sys.intern(id)
+        self.title           = title
+        self.class_          = sys.intern(class_)
+        self.parent          = sys.intern(parent)
+        self.param_ids       = tuple(sys.intern(param_id) for param_id in param_ids)
+        self.statement_start = statement_start
+        self.statement_end   = statement_end
+
+    def __repr__(self):
+        return f"<OSCAL_control_record id='{self.id}' parent='{self.parent}'>"
+
+    def as_list(self):
+        return [self.id, self.title, self.class_, self.parent, list(self.param_ids), self.statement_start, self.statement_end]
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# CONTROL INDEX CLASS
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class OSCAL_control_index:
+    """
+    A compact, searchable index of the controls in a catalog or resolved
+    profile. Built in one pass over the document, so the GUI and reports
+    can work from it instead of the whole ElementTree.
+
+    Properties:
+    - records: A list of OSCAL_control_record objects in document order
+    - by_id: A dict of records keyed by control id
+    - statements: The statement text of all controls, concatenated.
+      Each record holds the offsets of its own statement text.
+    - source_uuid: The CC-assigned UUID of the OSCAL object the index was built from
+
+    Methods:
+    - build(oscal_obj): Builds an index from an OSCAL object (class method)
+    - statement(control_id): Returns the statement text of a control
+    - children(control_id): Returns the records directly within a control or group
+    - search(text): Yields records whose id, title or statement contains the text
+    - save(db): Caches the index in a project database filecache
+    - load(db, uuid): Loads a cached index from a project database (class method)
+    """
+    def __init__(self, source_uuid=""):
+        self.records = []
+        self.by_id = {}
+        self.statements = ""
+        self.source_uuid = str(source_uuid)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def build(cls, oscal_obj):
+        """
+        Builds the index in a single pass over the document.
+        oscal_obj: An OSCAL object containing a catalog or resolved profile.
+        Returns the index. The index is empty if there are no controls.
+        """
+        self = cls(oscal_obj.uuid)
+        root = oscal_obj.tree
+        if root is None:
+            logger.error("Unable to index controls. No content is loaded.")
+            return self
+        if root.tag != oscal_tag("catalog"):
+            logger.warning(f"Indexing controls in {root.tag.rsplit('}', 1)[-1]}. Only a catalog or resolved profile is expected to have controls.")
+
+        control_tag   = oscal_tag("control")
+        group_tag     = oscal_tag("group")
+        param_tag     = oscal_tag("param")
+        title_tag     = oscal_tag("title")
+        part_tag      = oscal_tag("part")
+        statement_text = []
+        offset = 0
+
+        # Depth-first, document order. Only catalogs, groups and controls are descended.
+        pending = [(root, "")]
+        while pending:
+            element, parent = pending.pop()
+            element_id = element.get("id", "")
+            containers = []
+            if element.tag == control_tag:
+                title = element.find(title_tag)
+                param_ids = []
+                text = ""
+                for child in element:
+                    if child.tag == param_tag:
+                        param_ids.append(child.get("id", ""))
+                    elif child.tag == part_tag and child.get("name", "") == "statement":
+                        text = " ".join(" ".join(child.itertext()).split())
+                record = OSCAL_control_record(element_id,
+                            title="".join(title.itertext()) if title is not None else "",
+                            class_=element.get("class", ""),
+                            parent=parent,
+                            param_ids=param_ids,
+                            statement_start=offset,
+                            statement_end=offset + len(text))
+                statement_text.append(text)
+                offset += len(text)
+                self.records.append(record)
+                self.by_id[record.id] = record
+
+            for child in element:
+                if child.tag == control_tag or child.tag == group_tag:
+                    containers.append((child, element_id))
+            pending.extend(reversed(containers))
+
+        self.statements = "".join(statement_text)
+        logger.debug(f"Indexed {len(self.records)} controls.")
+        return self
+
+    # -------------------------------------------------------------------------
+    def statement(self, control_id):
+        """Returns the statement text of a control, or an empty string."""
+        record = self.by_id.get(control_id)
+        if record is None:
+            return ""
+        return self.statements[record.statement_start:record.statement_end]
+
+    # -------------------------------------------------------------------------
+    def children(self, control_id):
+        """Returns the records directly within a control or group, in document order."""
+        return [record for record in self.records if record.parent == control_id]
+
+    # -------------------------------------------------------------------------
+    def search(self, text):
+        """Yields records whose id, title or statement contains the text (case insensitive)."""
+        text = text.lower()
+        for record in self.records:
+            if (text in record.id.lower() or text in record.title.lower()
+                or text in self.statements[record.statement_start:record.statement_end].lower()):
+                yield record
+
+    # -------------------------------------------------------------------------
+    def to_json(self):
+        return json.dumps({
+            "format": CONTROL_INDEX_FORMAT,
+            "source": self.source_uuid,
+            "statements": self.statements,
+            "records": [record.as_list() for record in self.records]
+        })
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def from_json(cls, content):
+        """Rebuilds an index from to_json() output. Returns None if the format is not recognized."""
+        data = json.loads(misc.normalize_content(content))
+        if data.get("format") != CONTROL_INDEX_FORMAT:
+            logger.warning(f"Unrecognized control index format: {data.get('format')}")
+            return None
+
+        self = cls(data.get("source", ""))
+        self.statements = data.get("statements", "")
+        for entry in data.get("records", []):
+            record = OSCAL_control_record(*entry)
+            self.records.append(record)
+            self.by_id[record.id] = record
+        return self
+
+    # -------------------------------------------------------------------------
+    async def save(self, db, identifier=None):
+        """
+        Caches the index in a database filecache.
+        db: A Database object (ie OSCAL_project.db)
+        identifier: The filecache UUID to use. A new one is assigned if absent.
+        Returns the filecache UUID if successful. None otherwise.
+        """
+        identifier = identifier or str(uuid.uuid4())
+        attributes = {
+            "filename": f"{self.source_uuid}_controls.json",
+            "original_location": self.source_uuid,
+            "file_type": CONTROL_INDEX_FILE_TYPE,
+            "mime_type": "application/json",
+            "acquired": misc.oscal_date_time_with_timezone(datetime.now())
+        }
+        if await db.cache_file(self.to_json(), identifier, attributes):
+            return identifier
+        logger.error(f"Unable to cache control index for {self.source_uuid}")
+        return None
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    async def load(cls, db, identifier):
+        """
+        Loads a cached index from a database filecache.
+        Returns the index, or None if it is not found or not recognized.
+        """
+        try:
+            cached = await db.retrieve_file(identifier)
+        except ValueError as error:
+            logger.debug(f"Control index not found: {str(error)}")
+            return None
+        if not cached:
+            return None
+        return cls.from_json(cached["content"])
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+
+if __name__ == '__main__':
+    print("OSCAL Control Index Library. Not intended to be run as a stand-alone file.")
@@ -0,0 +1,386 @@
+# OSCAL Import Pipeline
+# Stages used by OSCAL_project.oscal_import() to bring OSCAL files into a
+# project: acquire (read a file or download a URL), sniff (identify the
+# format, model and version from the start of the content), then parse and
+# validate. Parsing and schema validation are CPU-bound and hold the GIL,
+# so they run in a pool of worker processes. Workers only return a small
+# summary; the content itself is stored by the caller.
+# Also helpers for OSCAL_project.resolve_imports(), which follows the
+# import directives of imported files: import_targets() and find_cycles().
+from loguru import logger
+from xml.etree import ElementTree
+from urllib.parse import urlsplit, urlunsplit, unquote
+from datetime import datetime, timezone
+import asyncio
+import base64
+import binascii
+import email.utils
+import concurrent.futures
+import concurrent.futures.process
+import multiprocessing
+import pickle
+import json
+import os
+import re
+from common import network
+
+try:
+    import yaml # Optional: YAML content is only parsed if available
+except ImportError:
+    yaml = None
+
+try:
+    import xmlschema # Optional: XML content is only schema-validated if available
+except ImportError:
+    xmlschema = None
+
+try:
+    import jsonschema_rs # Optional: JSON and YAML content is only schema-validated if available
+except ImportError:
+    jsonschema_rs = None
+
+IMPORT_WORKERS = max(1, (os.cpu_count() or 2) - 1) # Worker processes for parsing and validation. One core is left for the GUI.
+IMPORT_CONCURRENCY = IMPORT_WORKERS * 2            # Files in flight at once (being acquired, parsed or stored)
+SNIFF_BYTES = 64 * 1024     # Bytes examined to identify the format, model and version
+MAX_VALIDATION_ERRORS = 25  # Schema validation errors reported per file
+PARSE_ERRORS = (ElementTree.ParseError, ValueError) + ((yaml.YAMLError,) if yaml else ()) # Content that is not well-formed (json errors are ValueErrors)
+WORKER_SCHEMAS = 8          # Compiled schemas kept by each worker process
+
+OSCAL_NAMESPACE = "http://csrc.nist.gov/ns/oscal/1.0"
+OSCAL_MODELS = ["catalog", "profile", "component-definition", "system-security-plan",
+                "assessment-plan", "assessment-results", "plan-of-action-and-milestones"]
+MIME_TYPES = {"xml": "application/xml", "json": "application/json", "yaml": "application/yaml"}
+SCHEMA_TYPES = {"xml": "xml-schema", "json": "json-schema", "yaml": "json-schema"} # Support file used to validate each format
+
+# Import directives, by XML element name, and the JSON/YAML key for each
+IMPORT_KEYS = {
+    "import"                     : "imports",
+    "import-profile"             : "import-profile",
+    "import-component-definition": "import-component-definitions",
+    "import-ssp"                 : "import-ssp",
+    "import-ap"                  : "import-ap"
+}
+
+XML_ROOT       = re.compile(rb"<(?![?!])(?:[\w.-]+:)?([\w.-]+)")
+XML_VERSION    = re.compile(rb"<(?:[\w.-]+:)?oscal-version\s*>\s*([^<\s]+)")
+JSON_ROOT      = re.compile(rb"\{\s*\"([\w-]+)\"")
+JSON_VERSION   = re.compile(rb"\"oscal-version\"\s*:\s*\"([^\"]+)\"")
+YAML_ROOT      = re.compile(rb"^([\w-]+)\s*:", re.MULTILINE)
+YAML_VERSION   = re.compile(rb"^\s*oscal-version\s*:\s*[\"']?([^\s\"']+)", re.MULTILINE)
+
+_pool = None     # The worker process pool, created on first use
+_schemas = {}    # Within a worker process: compiled schemas, by path
+
+# -----------------------------------------------------------------------------
+def canonical_location(source, base=""):
+    """
+    Returns a single spelling of a file location, so the same file is
+    recognized however it is referred to.
+    - URLs: the scheme and host are lower case, default ports and the
+      fragment are dropped. file: URLs become paths.
+    - Paths: absolute and normalized. Relative paths are resolved
+      against base (a path or URL) if given.
+    """
+    source = source.strip()
+    parts = urlsplit(source)
+    if parts.scheme == "file":
+        source = unquote(parts.path)
+    elif parts.scheme in ("http", "https"):
+        host = (parts.hostname or "").lower()
+        if parts.port and parts.port != {"http": 80, "https": 443}[parts.scheme]:
+            host = f"{host}:{parts.port}"
+        return urlunsplit((parts.scheme, host, parts.path or "/", parts.query, ""))
+    if base and not os.path.isabs(source):
+        base_parts = urlsplit(base)
+        if base_parts.scheme in ("http", "https"):
+            base_path = base_parts.path.rsplit("/", 1)[0]
+            return canonical_location(urlunsplit((base_parts.scheme, base_parts.netloc, os.path.normpath(f"{base_path}/{source}").replace(os.sep, "/"), "", "")))
+        source = os.path.join(os.path.dirname(base), source)
+    return os.path.normcase(os.path.abspath(source))
+
+# -----------------------------------------------------------------------------
+def is_url(location) -> bool:
+    return urlsplit(location).scheme in ("http", "https")
+
+# -----------------------------------------------------------------------------
+def read_bytes(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+# -----------------------------------------------------------------------------
+async def acquire(location):
+    """
+    Reads a file, or downloads a URL, without blocking the event loop.
+    location: A canonical_location()
+    Returns the content (bytes), or None if it can not be read.
+    """
+    content = None
+    try:
+        if is_url(location):
+            status, content, _ = await network.async_fetch(location)
+        else:
+            content = await asyncio.get_running_loop().run_in_executor(None, read_bytes, location)
+    except OSError as error:
+        logger.error(f"Unable to read {location} ({type(error).__name__}): {str(error)}")
+    return content
+
+# -----------------------------------------------------------------------------
+async def revalidate(location, acquired):
+    """
+    Downloads a URL only if it changed since a copy was acquired.
+    - acquired (str): When the copy was acquired (an OSCAL date-time, UTC)
+    Returns (HTTP status, content). The status is 304 if the copy is current.
+    """
+    headers = {}
+    try:
+        since = datetime.strptime(acquired or "", "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+        headers["If-Modified-Since"] = email.utils.format_datetime(since, usegmt=True)
+    except ValueError:
+        pass # Not known. Download unconditionally.
+    http_status, content, _ = await network.async_fetch(location, headers=headers)
+    return http_status, content
+
+# -----------------------------------------------------------------------------
+def sniff(content):
+    """
+    Identifies OSCAL content from its first SNIFF_BYTES, without parsing it.
+    Returns a dict of format ("xml", "json", "yaml" or ""), model and version.
+    The model and version are empty if they are not found.
+    """
+    head = content[:SNIFF_BYTES].lstrip(b"\xef\xbb\xbf \t\r\n")
+    result = {"format": "", "model": "", "version": ""}
+    if head.startswith(b"<"):
+        result["format"] = "xml"
+        root, version = XML_ROOT.search(re.sub(rb"<!--.*?-->", b"", head, flags=re.DOTALL)), XML_VERSION.search(head)
+    elif head.startswith(b"{"):
+        result["format"] = "json"
+        root, version = JSON_ROOT.match(head), JSON_VERSION.search(head)
+    elif head[:1].isalpha() or head.startswith((b"---", b"#")):
+        result["format"] = "yaml"
+        root, version = YAML_ROOT.search(head), YAML_VERSION.search(head)
+    else:
+        return result
+    model = root.group(1).decode("utf-8", "replace") if root else ""
+    result["model"] = model if model in OSCAL_MODELS else ""
+    result["version"] = version.group(1).decode("utf-8", "replace") if version else ""
+    return result
+
+# -----------------------------------------------------------------------------
+def support_version(version) -> str:
+    """Returns the release tag of a declared OSCAL version (ie "1.1.2" -> "v1.1.2")."""
+    return version if version.lower().startswith("v") else f"v{version}"
+
+# -----------------------------------------------------------------------------
+def parse_and_validate(content, file_format, schema_path=None):
+    """
+    Parses OSCAL content and validates it against a schema.
+    Runs in a worker process (see in_worker()), so it only takes and
+    returns plain values.
+    - content (bytes): The content
+    - file_format: "xml", "json" or "yaml" (see sniff())
+    - schema_path (str)[optional]: The XML or JSON schema. Not validated if 
+      absent, or if the validator (xmlschema or jsonschema_rs) is not installed.
+    Returns a dict:
+    - well_formed (bool): The content parsed
+    - model, version (str): As declared in the content
+    - imports (list): {"type", "href"} for each import directive. An href
+      to a back-matter resource ("#uuid") also has "rlinks" (list of hrefs)
+      and "base64" (the embedded content, if any) from the resource.
+    - valid (bool): Schema valid. None if not validated.
+    - errors (list): Parse or validation messages
+    """
+    result = {"well_formed": False, "model": "", "version": "", "imports": [], "valid": None, "errors": []}
+    try:
+        if file_format == "xml":
+            document = ElementTree.fromstring(content)
+            result["model"] = document.tag.rsplit("}", 1)[-1]
+            result["version"] = (document.findtext(f"{{{OSCAL_NAMESPACE}}}metadata/{{{OSCAL_NAMESPACE}}}oscal-version") or "").strip()
+            for element in document:
+                import_type = element.tag.rsplit("}", 1)[-1]
+                if import_type in IMPORT_KEYS and element.get("href"):
+                    result["imports"].append({"type": import_type, "href": element.get("href")})
+            resources = {}
+            for resource in document.iterfind(f"{{{OSCAL_NAMESPACE}}}back-matter/{{{OSCAL_NAMESPACE}}}resource"):
+                resources[resource.get("uuid", "")] = {
+                    "rlinks": [rlink.get("href") for rlink in resource.iterfind(f"{{{OSCAL_NAMESPACE}}}rlink") if rlink.get("href")],
+                    "base64": (resource.findtext(f"{{{OSCAL_NAMESPACE}}}base64") or "").strip()
+                }
+        else:
+            if file_format == "json":
+                document = json.loads(content)
+            elif yaml is not None:
+                document = yaml.safe_load(content)
+            else:
+                result["errors"].append("YAML content can not be read. PyYAML is not installed.")
+                return result
+            if not isinstance(document, dict) or len(document) != 1:
+                result["errors"].append("Content does not have a single root (OSCAL model) object.")
+                return result
+            result["model"], body = next(iter(document.items()))
+            body = body if isinstance(body, dict) else {}
+            result["version"] = str((body.get("metadata") or {}).get("oscal-version", ""))
+            for import_type, key in IMPORT_KEYS.items():
+                directives = body.get(key) or []
+                for directive in (directives if isinstance(directives, list) else [directives]):
+                    if isinstance(directive, dict) and directive.get("href"):
+                        result["imports"].append({"type": import_type, "href": directive["href"]})
+            resources = {}
+            for resource in (body.get("back-matter") or {}).get("resources") or []:
+                if isinstance(resource, dict):
+                    resources[resource.get("uuid", "")] = {
+                        "rlinks": [rlink["href"] for rlink in resource.get("rlinks") or [] if isinstance(rlink, dict) and rlink.get("href")],
+                        "base64": str((resource.get("base64") or {}).get("value", "")).strip()
+                    }
+        for directive in result["imports"]:
+            if directive["href"].startswith("#"):
+                directive.update(resources.get(directive["href"][1:], {"rlinks": [], "base64": ""}))
+        result["well_formed"] = True
+    except PARSE_ERRORS as error:
+        result["errors"].append(f"Not well-formed {file_format.upper()}: {str(error)}")
+        return result
+
+    if schema_path:
+        try:
+            schema = _schema(schema_path, file_format)
+            if schema is None:
+                result["errors"].append(f"Schema validation needs {'xmlschema' if file_format == 'xml' else 'jsonschema_rs'}, which is not installed.")
+            else:
+                errors = []
+                for error in schema.iter_errors(document):
+                    errors.append(getattr(error, "reason", None) or getattr(error, "message", None) or str(error))
+                    if len(errors) >= MAX_VALIDATION_ERRORS:
+                        break
+                result["valid"] = not errors
+                result["errors"] += errors
+        except Exception as error:
+            result["errors"].append(f"Unable to validate ({type(error).__name__}): {str(error)}")
+    return result
+
+# -----------------------------------------------------------------------------
+def _schema(path, file_format):
+    """Returns the compiled schema at path, compiling it on first use in this process."""
+    schema = _schemas.get(path)
+    if schema is None:
+        if file_format == "xml":
+            if xmlschema is None:
+                return None
+            schema = xmlschema.XMLSchema(path)
+        else:
+            if jsonschema_rs is None:
+                return None
+            with open(path, "rb") as file:
+                definition = json.load(file)
+            compile_schema = getattr(jsonschema_rs, "validator_for", None) or jsonschema_rs.JSONSchema
+            schema = compile_schema(definition)
+        if len(_schemas) >= WORKER_SCHEMAS:
+            _schemas.pop(next(iter(_schemas)))
+        _schemas[path] = schema
+    return schema
+
+# -----------------------------------------------------------------------------
+def import_targets(directive, base):
+    """
+    Returns where an import directive (from parse_and_validate()) points,
+    as a list of (location, content) candidates, to be tried in order.
+    - base: The canonical location of the importing file. Relative hrefs
+      are resolved against it.
+    content is None, except for content embedded in a back-matter 
+    resource, which is given a location of [base]#[resource uuid].
+    """
+    href = directive["href"]
+    if not href.startswith("#"):
+        return [(canonical_location(href, base), None)]
+    targets = [(canonical_location(rlink, base), None) for rlink in directive.get("rlinks", [])]
+    if directive.get("base64"):
+        try:
+            targets.append((f"{base}{href}", base64.b64decode(directive["base64"], validate=False)))
+        except (binascii.Error, ValueError) as error:
+            logger.warning(f"Unable to decode back-matter resource {href} in {base}: {str(error)}")
+    return targets
+
+# -----------------------------------------------------------------------------
+def find_cycles(graph):
+    """
+    Finds the import cycles in a graph.
+    - graph (dict): {node: [target nodes]}
+    Returns a set of (node, target) edges that close a cycle. Removing
+    them leaves the graph acyclic.
+    """
+    cycle_edges = set()
+    state = {} # node: 1 while on the current path, 2 once finished
+    for start in graph:
+        if start in state:
+            continue
+        state[start] = 1
+        path = [(start, iter(graph.get(start, [])))]
+        while path:
+            node, targets = path[-1]
+            target = next(targets, None)
+            if target is None:
+                state[node] = 2
+                path.pop()
+            elif state.get(target) == 1:
+                cycle_edges.add((node, target))
+            elif target not in state:
+                state[target] = 1
+                path.append((target, iter(graph.get(target, []))))
+    return cycle_edges
+
+# -----------------------------------------------------------------------------
+def worker_pool():
+    """Returns the worker process pool, starting it on first use."""
+    global _pool
+    if _pool is None:
+        # spawn: a fork of the GUI process (with its threads) is not safe on every platform
+        _pool = concurrent.futures.ProcessPoolExecutor(max_workers=IMPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+# -----------------------------------------------------------------------------
+async def in_worker(function, *args):
+    """
+    Runs function(*args) in a worker process and awaits the result.
+    If worker processes are not available, runs it in a thread instead.
+    """
+    global _pool
+    loop = asyncio.get_running_loop()
+    if _pool is not False:
+        try:
+            return await loop.run_in_executor(worker_pool(), function, *args)
+        except (concurrent.futures.process.BrokenProcessPool, OSError, pickle.PicklingError) as error:
+            logger.warning(f"Worker processes are not available ({type(error).__name__}): {str(error)}. Using threads.")
+            _pool = False
+    return await loop.run_in_executor(None, function, *args)
+
+# -----------------------------------------------------------------------------
+def compile_schema(path, file_format) -> bool:
+    """Compiles a schema into this worker's cache, for prewarm_workers(). Returns True if compiled."""
+    try:
+        return _schema(path, file_format) is not None
+    except Exception as error:
+        logger.error(f"Unable to compile {path} ({type(error).__name__}): {str(error)}")
+        return False
+
+# -----------------------------------------------------------------------------
+async def prewarm_workers(schemas):
+    """
+    Starts the worker processes and has them compile schemas ahead of 
+    the first import. Each schema is sent once per worker; idle workers
+    take one request each, so usually every worker compiles every schema.
+    - schemas (list): (path, file format) tuples, as for parse_and_validate()
+    """
+    for path, file_format in schemas:
+        await asyncio.gather(*[in_worker(compile_schema, path, file_format) for _ in range(IMPORT_WORKERS)])
+
+# -----------------------------------------------------------------------------
+def close_worker_pool():
+    """Stops the worker processes. They are started again if needed."""
+    global _pool
+    if _pool:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+
+# =============================================================================
+#  --- MAIN: Only runs if the module is executed stand-alone. ---
+# =============================================================================
+if __name__ == '__main__':
+    print("OSCAL Import Pipeline Library. Not intended to be run as a stand-alone file.")
@@ -2,8 +2,11 @@ from loguru import logger
 from common import *
 from oscal_support import *
 from oscal_class import *
+from oscal_control_index import CONTROL_INDEX_FILE_TYPE
+import oscal_importer
 import asyncio
 import datetime
+import time
 
 OSCAL_PROJECT_TABLES = {}
 OSCAL_PROJECT_TABLES["project_files"] = {
@@ -55,8 +58,35 @@ OSCAL_PROJECT_TABLES["snapshots"] = {
     "table_label": "Snapshots",
     "table_description": "Snapshots of project content."
 }
+OSCAL_PROJECT_TABLES["import_graph"] = {
+    "table_name": "import_graph",
+    "table_fields": [
+        {"name": "source_uuid"         , "type": "TEXT"   , "attributes": "", "label": "Importing File (import_map UUID)"},
+        {"name": "source_digest"       , "type": "TEXT"   , "attributes": "", "label": "SHA-256 of the Importing File When Resolved"},
+        {"name": "import_type"         , "type": "TEXT"   , "attributes": "", "label": "Import Directive (ie import-profile)"},
+        {"name": "href"                , "type": "TEXT"   , "attributes": "", "label": "Import Reference"},
+        {"name": "target_uuid"         , "type": "TEXT"   , "attributes": "", "label": "Imported File (import_map UUID)"},
+        {"name": "target_location"     , "type": "TEXT"   , "attributes": "", "label": "Imported File Location"},
+        {"name": "status"              , "type": "TEXT"   , "attributes": "", "label": "Status (resolved, unresolved or cycle)"},
+        {"name": "resolved"            , "type": "TEXT"   , "attributes": "", "label": "Resolved"}
+    ],
+    "table_indexes": [
+        {"name": "source_uuid"  , "fields": ["source_uuid"]}
+    ],
+    "table_label": "Import Graph",
+    "table_description": "The files each project file imports, as resolved."
+}
 OSCAL_PROJECT_TABLES["filecache"] = database.OSCAL_COMMON_TABLES["filecache"]
 
+# (table, field) that refer to project filecache entries
+PROJECT_FILE_REFERENCES = [
+    ("import_map", "original"),
+    ("import_map", "xml"),
+    ("import_map", "json"),
+    ("import_map", "yaml"),
+    ("snapshots" , "filecache_uuid")
+]
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # OSCAL PROJECT CLASS
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -80,12 +110,18 @@ class OSCAL_project:
     - load(): Load the project file and its contents.
     - save(): Save the project file and its contents.
     - show_stack(): Show the stack of project files.
+    - oscal_import(sources, support, backend): Import OSCAL files or URLs into the project.
+    - resolve_imports(roots, support, backend, refresh): Import the files that project files import, recursively.
+    - imports_of(file_uuid): The project files a project file imports.
+    - collect_garbage(): Delete unreferenced filecache entries and compact the project file.
 
     """
     def __init__(self, db_conn, db_type="sqlite3"):
         self.project_file = "" # Path and file name of the project file
         self.project_files = {}
+        self.import_graph = {}      # Resolved imports: {import_map UUID: [import_graph rows]}
         self.properties = {}
+        self.__store_lock = asyncio.Lock()
 
         self.ready      = False     # Is the project capability available?
         self.db_conn    = db_conn   # The project database connection string or path and filename 
@@ -167,8 +203,10 @@ class OSCAL_project:
     async def load_project(self):
         """
         Load the OSCAL stack into memory.
+        The import graph is loaded as last resolved. It is only walked 
+        again for files that changed since (see resolve_imports()).
         """
-        status = True
+        status = await self.__load_import_graph()
         return status
     # -------------------------------------------------------------------------
 
@@ -211,11 +249,292 @@ class OSCAL_project:
         pass
 
     # -------------------------------------------------------------------------
-    def oscal_import(self, file):
+    async def oscal_import(self, sources, support=None, backend=None):
         """
-        Import a file into the project.
+        Imports OSCAL files into the project.
+        Each file is read or downloaded, identified, parsed and validated, 
+        then stored in the project filecache and recorded in import_map.
+        Up to IMPORT_CONCURRENCY files are in progress at once. Parsing and
+        validation run in worker processes, so large files are handled in
+        parallel while the GUI stays responsive.
+        - sources (list): File paths or URLs. A single str is accepted.
+        - support (OSCAL_support)[optional]: Provides the schemas. Not validated if absent.
+        - backend [optional]: Progress messages are sent to its status area.
+        Returns a dict of results by location: {"uuid", "model", "version", 
+        "format", "valid", "errors"}. uuid is empty if the file was not imported.
         """
-        pass
+        self.backend = backend or self.backend
+        sources = [sources] if isinstance(sources, str) else list(sources)
+        locations = list(dict.fromkeys(oscal_importer.canonical_location(source) for source in sources))
+        progress = {"done": 0, "total": len(locations)}
+        start = time.perf_counter()
+
+        self.__status_messages(f"Importing {len(locations)} file(s)...")
+        results = await network.gather_bounded([self.__import_one(location, support, progress) for location in locations],
+                                               width=oscal_importer.IMPORT_CONCURRENCY)
+        results = dict(zip(locations, results))
+
+        imported = sum(1 for result in results.values() if result["uuid"])
+        self.__status_messages(f"Imported {imported} of {len(locations)} file(s) in {time.perf_counter() - start:,.1f} seconds "
+                               f"({oscal_importer.IMPORT_WORKERS} worker processes).", "info" if imported == len(locations) else "warning")
+        return results
+    # -------------------------------------------------------------------------
+    async def __import_one(self, location, support, progress, content=None):
+        """
+        Imports one file for oscal_import(): acquire, sniff, parse and
+        validate (in a worker process), then store.
+        - content (bytes)[optional]: The content, if already at hand. Otherwise it is read from location.
+        Returns the result dict for the file, with the import directives 
+        found in it ("imports").
+        """
+        name = os.path.basename(location.rstrip("/")) or location
+        result = {"uuid": "", "model": "", "version": "", "format": "", "valid": None, "errors": [], "imports": []}
+        try:
+            content = content or await oscal_importer.acquire(location)
+            if not content:
+                result["errors"].append("Unable to read the file.")
+                return result
+
+            sniffed = oscal_importer.sniff(content)
+            result["format"], result["model"], result["version"] = sniffed["format"], sniffed["model"], sniffed["version"]
+            if not sniffed["format"]:
+                result["errors"].append("Not XML, JSON or YAML content.")
+                return result
+
+            schema_path = None
+            if support is not None and sniffed["model"] and sniffed["version"]:
+                schema_path = await support.support_file_path(oscal_importer.support_version(sniffed["version"]), sniffed["model"],
+                                                              oscal_importer.SCHEMA_TYPES[sniffed["format"]])
+            parsed = await oscal_importer.in_worker(oscal_importer.parse_and_validate, content, sniffed["format"], schema_path)
+            result["model"] = parsed["model"] or result["model"]
+            result["version"] = parsed["version"] or result["version"]
+            result["valid"] = parsed["valid"]
+            result["errors"] += parsed["errors"]
+            result["imports"] = parsed["imports"]
+            if parsed["well_formed"] and result["model"] not in oscal_importer.OSCAL_MODELS:
+                result["errors"].append(f"Not an OSCAL model: {result['model']}")
+                return result
+
+            result["uuid"] = await self.__store_import(location, name, content, sniffed["format"], parsed, result)
+        except Exception as error:
+            logger.error(f"Unable to import {location} ({type(error).__name__}): {str(error)}")
+            result["errors"].append(str(error))
+        finally:
+            progress["done"] += 1
+            validity = {True: "valid", False: "invalid", None: "not validated"}[result["valid"]]
+            summary = f"{result['model']} {result['version']} ({validity})" if result["uuid"] else f"not imported. {'; '.join(result['errors'][:1])}"
+            if result["uuid"] and result["valid"] is None and result["errors"]:
+                summary += f". {result['errors'][0]}" # Why it was not validated
+            self.__status_messages(f"[{progress['done']}/{progress['total']}] {name}: {summary}",
+                                   "info" if result["uuid"] and result["valid"] is not False else "warning")
+        self.project_files[location] = result
+        return result
+    # -------------------------------------------------------------------------
+    async def __store_import(self, location, name, content, file_format, parsed, result):
+        """
+        Stores imported content in the filecache, keyed by its SHA-256 
+        digest, and adds or updates its import_map row. A file imported 
+        again from the same location keeps its import_map UUID. Content
+        already in the project from another location is not added again;
+        the existing import_map UUID is returned.
+        Returns the import_map UUID, or "" if it could not be stored.
+        """
+        digest = content_digest(content)
+        async with self.__store_lock: # Concurrent imports of the same content must not both add it
+            existing = await self.db.query("SELECT uuid, original_location FROM import_map WHERE original_location = ? OR original = ? "
+                                           "ORDER BY original_location = ? DESC", (location, digest, location))
+            if existing and existing[0]["original_location"] != location:
+                logger.debug(f"{location} is the same content as {existing[0]['original_location']}")
+                return existing[0]["uuid"]
+            return await self.__store_import_row(location, name, content, digest, file_format, parsed, result, existing)
+    # -------------------------------------------------------------------------
+    async def __store_import_row(self, location, name, content, digest, file_format, parsed, result, existing):
+        if await self.db.record_count("filecache", "uuid = ?", (digest,)) == 0:
+            attributes = {
+                "filename": name,
+                "original_location": location,
+                "mime_type": oscal_importer.MIME_TYPES[file_format],
+                "file_type": f"oscal-{file_format}",
+                "acquired": misc.oscal_date_time_with_timezone(),
+                "sha256": digest
+            }
+            if not await self.db.cache_file(content, digest, attributes):
+                logger.error(f"Unable to store {location} in the project filecache.")
+                return ""
+
+        row = {
+            "uuid": existing[0]["uuid"] if existing else str(uuid.uuid4()),
+            "oscal_version": result["version"],
+            "oscal_model": result["model"],
+            "imports": json.dumps(parsed["imports"]),
+            "xml": digest if file_format == "xml" else "",
+            "json": digest if file_format == "json" else "",
+            "yaml": digest if file_format == "yaml" else "",
+            "original": digest,
+            "original_location": location,
+            "original_format": file_format,
+            "original_well_formed": int(parsed["well_formed"])
+        }
+        row["xml_schema_valid" if file_format == "xml" else "json_schema_valid"] = None if parsed["valid"] is None else int(parsed["valid"])
+        if not await self.db.upsert_many("import_map", [row], ["uuid"]):
+            logger.error(f"Unable to record {location} in the project.")
+            return ""
+        return row["uuid"]
+    # -------------------------------------------------------------------------
+    async def resolve_imports(self, roots=None, support=None, backend=None, refresh=False):
+        """
+        Follows the import directives (import, import-profile, import-ssp,
+        etc.) of project files, importing each file they refer to, until 
+        every chain ends (ie assessment results -> assessment plan -> SSP
+        -> profile -> catalog). The result is stored in the import_graph 
+        table and in self.import_graph.
+        Each level of the graph is fetched and parsed concurrently, as by 
+        oscal_import(). Files are identified by their canonical location 
+        and by content, so a file referred to in different ways is 
+        imported once. Imports that lead back to an importing file are 
+        marked as cycles.
+        - roots (list)[optional]: import_map UUIDs to start from. Defaults to all project files.
+        - support (OSCAL_support)[optional]: Provides the schemas, as for oscal_import().
+        - backend [optional]: Progress messages are sent to its status area.
+        - refresh (bool): Walk every file again and download URLs again. 
+          Otherwise, files resolved since they last changed keep their 
+          stored imports, and URLs already in the project are not downloaded.
+        Returns True if every import was resolved. False otherwise.
+        """
+        self.backend = backend or self.backend
+        start = time.perf_counter()
+        files = {entry["uuid"]: entry for entry in await self.db.query("SELECT uuid, imports, original, original_location FROM import_map")}
+        known = {entry["original_location"]: file_uuid for file_uuid, entry in files.items()}
+        pending = list(files) if roots is None else [file_uuid for file_uuid in roots if file_uuid in files]
+        graph = {}      # import_map UUID: [import_graph rows], for the files walked
+        visited = set()
+        progress = {"done": 0, "total": 0}
+        in_flight = {}  # location: task, so each location is imported once
+
+        async def target_uuid(candidates):
+            """Returns the import_map UUID and location of the first candidate that can be imported."""
+            for location, content in candidates:
+                if location in known and not refresh:
+                    return known[location], location
+                if location not in in_flight:
+                    in_flight[location] = asyncio.ensure_future(self.__import_target(location, content, known.get(location), support, progress))
+                file_uuid = await in_flight[location]
+                if file_uuid:
+                    known[location] = file_uuid
+                    if file_uuid not in files:
+                        files.update({entry["uuid"]: entry for entry in await self.db.query(
+                            "SELECT uuid, imports, original, original_location FROM import_map WHERE uuid = ?", (file_uuid,))})
+                    return file_uuid, location
+            return "", (candidates[0][0] if candidates else "")
+
+        async def walk(file_uuid):
+            """Returns the import_graph rows for one file, resolving its imports."""
+            entry = files[file_uuid]
+            stored = self.import_graph.get(file_uuid)
+            # Stored imports are kept unless the file changed or a file they led to is no longer in the project
+            if stored and not refresh and all(row["source_digest"] == entry["original"] and (not row["target_uuid"] or row["target_uuid"] in files)
+                                              for row in stored):
+                return stored
+            try:
+                directives = json.loads(entry["imports"] or "[]")
+            except ValueError:
+                directives = []
+            resolved = misc.oscal_date_time_with_timezone()
+            targets = await asyncio.gather(*[target_uuid(oscal_importer.import_targets(directive, entry["original_location"])) for directive in directives])
+            return [{"source_uuid": file_uuid, "source_digest": entry["original"], "import_type": directive["type"], "href": directive["href"],
+                     "target_uuid": target, "target_location": location, "status": "resolved" if target else "unresolved", "resolved": resolved}
+                    for directive, (target, location) in zip(directives, targets)]
+
+        self.__status_messages("Resolving imports...")
+        while pending:
+            level = [file_uuid for file_uuid in dict.fromkeys(pending) if file_uuid not in visited]
+            visited.update(level)
+            rows = await network.gather_bounded([walk(file_uuid) for file_uuid in level], width=oscal_importer.IMPORT_CONCURRENCY)
+            graph.update(zip(level, rows))
+            for row in (row for level_rows in rows for row in level_rows):
+                if row["target_uuid"] and row["target_uuid"] not in files: # Its import_map row is gone
+                    row["target_uuid"], row["status"] = "", "unresolved"
+            pending = [row["target_uuid"] for level_rows in rows for row in level_rows if row["target_uuid"]]
+
+        # Mark the imports that close a cycle
+        full_graph = {**self.import_graph, **graph}
+        cycles = oscal_importer.find_cycles({source: [row["target_uuid"] for row in rows if row["target_uuid"]] for source, rows in full_graph.items()})
+        for source, rows in graph.items():
+            for row in rows:
+                if row["target_uuid"]:
+                    row["status"] = "cycle" if (source, row["target_uuid"]) in cycles else "resolved"
+                    if row["status"] == "cycle":
+                        self.__status_messages(f"Import cycle: {files[source]['original_location']} imports {row['target_location']}, which leads back to it.", "warning")
+
+        status = await self.__save_import_graph(graph)
+        unresolved = [row for rows in graph.values() for row in rows if row["status"] == "unresolved"]
+        for row in unresolved:
+            self.__status_messages(f"Unable to resolve {row['import_type']} {row['href']} in {files[row['source_uuid']]['original_location']}", "warning")
+        self.__status_messages(f"Resolved the imports of {len(graph)} file(s) in {time.perf_counter() - start:,.1f} seconds "
+                               f"({progress['total']} fetched).", "warning" if unresolved else "info")
+        return status and not unresolved
+    # -------------------------------------------------------------------------
+    def imports_of(self, file_uuid):
+        """
+        Returns the import_map UUIDs of the files a project file imports,
+        as last resolved by resolve_imports(). Imports that could not be 
+        resolved are omitted.
+        """
+        return [row["target_uuid"] for row in self.import_graph.get(file_uuid, []) if row["target_uuid"]]
+    # -------------------------------------------------------------------------
+    async def __import_target(self, location, content, file_uuid, support, progress):
+        """
+        Imports a file for resolve_imports(). If a URL is already in the 
+        project (file_uuid), it is only downloaded again if it changed 
+        since it was stored. If it can not be downloaded, the stored 
+        content is used.
+        Returns the import_map UUID, or "" if it could not be imported.
+        """
+        progress["total"] += 1
+        if content is None and file_uuid and oscal_importer.is_url(location):
+            entry = await self.db.query("SELECT f.uuid, f.acquired FROM import_map m JOIN filecache f ON f.uuid = m.original WHERE m.uuid = ?", (file_uuid,))
+            if entry:
+                http_status, content = await oscal_importer.revalidate(location, entry[0]["acquired"])
+                if http_status != 200:
+                    if http_status != 304:
+                        logger.warning(f"Unable to download {location} (status {http_status}). Using the stored copy.")
+                    content = await self.db.retrieve_file_bytes(entry[0]["uuid"])
+        result = await self.__import_one(location, support, progress, content)
+        return result["uuid"]
+    # -------------------------------------------------------------------------
+    async def __load_import_graph(self):
+        """Loads the import_graph table into self.import_graph."""
+        self.import_graph = {}
+        async for row in self.db.iterate("SELECT * FROM import_graph ORDER BY rowid"):
+            self.import_graph.setdefault(row["source_uuid"], []).append(row)
+        logger.debug(f"Loaded the import graph of {len(self.import_graph)} project file(s).")
+        return True
+    # -------------------------------------------------------------------------
+    async def __save_import_graph(self, graph):
+        """
+        Replaces the import_graph rows of the files in graph, in one 
+        transaction, and updates self.import_graph.
+        Returns True if successful. False otherwise.
+        """
+        fields = [field["name"] for field in OSCAL_PROJECT_TABLES["import_graph"]["table_fields"]]
+        count = await self.db.db_execute_many([
+            ("DELETE FROM import_graph WHERE source_uuid = ?", [(source,) for source in graph]),
+            (f"INSERT INTO import_graph ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})",
+             [tuple(row[field] for field in fields) for rows in graph.values() for row in rows])
+        ])
+        if count < 0:
+            logger.error("Unable to save the import graph to the project database.")
+            return False
+        self.import_graph.update(graph)
+        return True
+    # -------------------------------------------------------------------------
+    async def models_in_use(self):
+        """
+        Returns a list of (oscal_version, oscal_model) tuples for the 
+        OSCAL files in this project.
+        """
+        query = "SELECT DISTINCT oscal_version, oscal_model FROM import_map WHERE oscal_version <> '' AND oscal_model <> ''"
+        return [(entry["oscal_version"], entry["oscal_model"]) async for entry in self.db.iterate(query)]
     # -------------------------------------------------------------------------
     def refresh_oscal_stack(self):
         """
@@ -224,6 +543,24 @@ class OSCAL_project:
         pass
 
     # -------------------------------------------------------------------------
+    async def collect_garbage(self, convert=False, grace_seconds=database.GC_GRACE_SECONDS):
+        """
+        Deletes filecache entries that no project file or snapshot refers 
+        to, such as replaced conversions, then returns the space to the 
+        file system. Cached control indexes are kept.
+        Returns a dict with the number of entries deleted and the pages freed.
+        """
+        result = {"deleted": 0, "freed_pages": 0}
+        result["deleted"] = await self.db.collect_garbage(PROJECT_FILE_REFERENCES, keep_file_types=[CONTROL_INDEX_FILE_TYPE], grace_seconds=grace_seconds)
+        if result["deleted"] >= 0:
+            result["freed_pages"] = await self.db.compact(convert=convert)
+        return result
+    # -------------------------------------------------------------------------
+    def __status_messages(self, status="", level="info"):
+        if self.backend is not None:
+            self.backend.status_update(status, level)
+        logger.info(status)
+    # -------------------------------------------------------------------------
     async def __load_properties(self):
         """
         Loads the project properties from the project_properties table into a JSON structure.
@@ -232,15 +569,13 @@ class OSCAL_project:
         status = False
 
         query = "SELECT * FROM project_properties"
-        results = await self.db.query(query)
-        if results is not None:
-            for entry in results:
-                self.properties[entry["name"]] = {
-                    "uuid"          : entry.get("uuid", ""),
-                    "value"         : entry.get("value", ""),
-                    "remarks"       : entry.get("remarks", "")
-                }
-            status = True
+        async for entry in self.db.iterate(query):
+            self.properties[entry["name"]] = {
+                "uuid"          : entry.get("uuid", ""),
+                "value"         : entry.get("value", ""),
+                "remarks"       : entry.get("remarks", "")
+            }
+        status = True
 
         return status
 
@@ -252,22 +587,18 @@ class OSCAL_project:
         logger.debug("Saving project properties to database.")
         status = True
 
-        sql_commands = []
+        rows = []
         # logger.debug(f"Properties: {json.dumps(self.properties)}")
         # Cycle through the properties and save them to the database
         for key, value in self.properties.items():
             logger.debug(f"Saving property: {key} = {value}")
-            if "uuid" in value:
-                # Update the existing record
-                sql_commands.append( f"UPDATE project_properties SET value='{value['value']}', remarks='{value['remarks']}' WHERE uuid='{value['uuid']}'" )
-            else:
-                # Insert a new record
+            if "uuid" not in value:
                 value["uuid"] = str(uuid.uuid4())
-                sql_commands.append( f"INSERT INTO project_properties (uuid, name, value, remarks) VALUES ('{value['uuid']}', '{key}', '{value['value']}', '{value['remarks']}')")
-        result = await self.db.db_execute(sql_commands)
+            rows.append({"uuid": value["uuid"], "name": key, "value": value.get("value", ""), "remarks": value.get("remarks", "")})
+        result = await self.db.upsert_many("project_properties", rows, ["uuid"])
 
         if not result:
-            logger.error(f"Unable to save \"{key}\" document property to project database. (UUID: ({value['uuid']}))")
+            logger.error("Unable to save document properties to project database.")
             status = status and result
 
         return status
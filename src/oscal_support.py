@@ -2,13 +2,22 @@ import os
 from loguru import logger
 import json
 import uuid
-import pickle
+import hashlib
+import re
+import zipfile
+import tempfile
+from datetime import datetime
 from typing import Any, Optional
 from common import misc
 from common import database
+from common import type_sqlite3
 from common import network
+from common import support_store
+from common import compression
+from common import cache_files
 import asyncio
 import qasync
+import oscal_importer
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -59,18 +68,54 @@ OSCAL_SUPPORT_TABLES["oscal_support"] = {
         {"name": "version"         , "type": "TEXT", "attributes": "KEY", "label" : "OSCAL Version","description": "The OSCAL version."},
         {"name": "model"           , "type": "TEXT", "label" : "OSCAL Model", "description": "The OSCAL model name, exactly as it appears in OSCAL syntax."},
         {"name": "type"            , "type": "TEXT", "label" : "Support File Type", "description": "The type of support file."},
-        {"name": "filecache_uuid"  , "type": "TEXT", "label" : "Cache UUID", "description": "The filecache UUID of the support file for this OSCAL version and model."}
+        {"name": "filecache_uuid"  , "type": "TEXT", "label" : "Cache UUID", "description": "The filecache key of the support file for this OSCAL version and model. The SHA-256 digest of the content, so identical files are stored once."},
+        {"name": "asset_size"      , "type": "NUMERIC", "label" : "Asset Size", "description": "The size of the GitHub release asset in bytes, when it was learned."},
+        {"name": "asset_updated"   , "type": "NUMERIC", "label" : "Asset Updated", "description": "When the GitHub release asset was last updated, when it was learned."},
+        {"name": "asset_digest"    , "type": "TEXT", "label" : "Asset Digest", "description": "The digest GitHub reports for the release asset (ie sha256:...). Empty for older releases."}
+    ],
+    "table_indexes": [
+        {"name": "lookup"        , "fields": ["version", "model", "type"]},
+        {"name": "filecache_uuid", "fields": ["filecache_uuid"]}
+    ]
+}
+OSCAL_SUPPORT_TABLES["support_state"] = {
+    "table_name": "support_state",
+    "table_fields": [
+        {"name": "key"             , "type": "TEXT", "attributes": "PRIMARY KEY", "label" : "Key", "description": "The name of the state value."},
+        {"name": "value"           , "type": "TEXT", "label" : "Value", "description": "The state value."}
     ]
 }
 OSCAL_SUPPORT_TABLES["filecache"] = database.OSCAL_COMMON_TABLES["filecache"]
 
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+PREWARM_FILE_TYPES = ["xml-schema", "json-schema"] # Support file types prepared by prewarm(). Imports validate with these.
+PREWARM_DEFAULT_MODELS = ["catalog", "profile", "system-security-plan"]
+
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$") # Support filecache keys created by content hashing
+SUPPORT_FILE_REFERENCES = [("oscal_support", "filecache_uuid")] # (table, field) that refer to support filecache entries
+
+# One indexed lookup: oscal_support (version, model, type) joined to filecache by primary key
+SUPPORT_LOOKUP_FIELDS = "s.version, s.model, s.type, s.filecache_uuid, f.filename, f.original_location, f.mime_type, f.acquired"
+SUPPORT_LOOKUP_FROM = """FROM oscal_support s JOIN filecache f ON f.uuid = s.filecache_uuid
+    WHERE s.version = ? AND s.model = ? AND s.type = ? LIMIT 1"""
+
+# Update state, kept in the support_state table
+STATE_RELEASES_ETAG          = "releases_etag"          # ETag of the last processed GitHub releases listing
+STATE_RELEASES_LAST_MODIFIED = "releases_last_modified" # Last-Modified of the last processed GitHub releases listing
+
+# Offline support bundles: a zip file with a JSON manifest and one member per support file.
+BUNDLE_FORMAT   = 1                # Bump when the bundle layout changes
+BUNDLE_MANIFEST = "manifest.json"  # Versions, support references and file metadata
+BUNDLE_FILES    = "files/"         # Support file content, named by SHA-256 digest
+FILECACHE_METADATA_FIELDS = ["filename", "original_location", "mime_type", "file_type", "acquired", "datatype"]
+
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 OSCAL_DATA_TYPES = {}
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 class OSCAL_support:
-    def __init__(self, db_conn, db_type="sqlite3"):
+    def __init__(self, db_conn, db_type="sqlite3", mirror=False):
         self.ready      = False     # Is the support capability available?
         self.db_conn    = db_conn   # The support database connection string or path and filename 
         self.db_type    = db_type   # The support database type (sqlite3, mysql, postgresql, mssql, etc.)
@@ -79,8 +124,11 @@ class OSCAL_support:
         self.versions   = {}        # Supported OSCAL versions available within the support database, and support references
         self.extensions = {}        # Supported OSCAL extensions available within the support database, and support references
         self.backend    = None      # If working within an application, this is the backend object
+        self.store      = None      # Extracted, content-addressed copies of support files (sqlite3 only)
 
-        self.db = database.Database(self.db_type, self.db_conn)
+        self.db = database.Database(self.db_type, self.db_conn, mirror=mirror) # mirror: serve support lookups from memory
+        if self.db_type == "sqlite3":
+            self.store = support_store.Support_store(os.path.join(os.path.dirname(os.path.abspath(self.db_conn)), support_store.STORE_FOLDER))
         if self.db is not None:
             asyncio.create_task(self.async_init())
         else:
@@ -91,9 +139,13 @@ class OSCAL_support:
         self.ready = await self.startup()
     # -------------------------------------------------------------------------
     @classmethod
-    async def create(cls, db_conn, db_type="sqlite3"):
-        """Async factory method to create and initialize OSCAL_support"""
-        self = cls(db_conn, db_type)
+    async def create(cls, db_conn, db_type="sqlite3", mirror=False):
+        """
+        Async factory method to create and initialize OSCAL_support
+        mirror: Load the support database into memory after startup and 
+                after each update, so support lookups do not read the file.
+        """
+        self = cls(db_conn, db_type, mirror)
         if self.db is not None:
             self.ready = await self.startup()
         return self
@@ -136,6 +188,7 @@ class OSCAL_support:
 
         if self.db_state == "empty":
             status = await self.__get_oscal_versions()
+            await network.close_session()
 
             if status:
                 self.db_state = "populated"
@@ -143,6 +196,9 @@ class OSCAL_support:
             else:
                 logger.error("Unable to update OSCAL support capability. Exiting.")
                 self.ready = False
+
+        if self.ready:
+            await self.db.refresh_mirror()
        
         return status
     # -------------------------------------------------------------------------
@@ -169,38 +225,58 @@ class OSCAL_support:
 
         logger.debug("Loading OSCAL versions into memory.")
         query = "SELECT * FROM oscal_versions ORDER BY released DESC"
-        results = await self.db.query(query)
-        if results is not None:
-            for entry in results:
-                self.versions[entry["version"]] = {
-                    "title"                 : entry.get("title", ""),
-                    "released"              : entry.get("released", ""),
-                    "github_location"       : entry.get("github_location", ""),
-                    "documentation_location": entry.get("documentation_location", ""),
-                    "acquired"              : entry.get("acquired", ""),
-                    "successful"            : entry.get("successful", None),
-                }
-            status = True
+        async for entry in self.db.iterate(query):
+            self.versions[entry["version"]] = {
+                "title"                 : entry.get("title", ""),
+                "released"              : entry.get("released", ""),
+                "github_location"       : entry.get("github_location", ""),
+                "documentation_location": entry.get("documentation_location", ""),
+                "acquired"              : entry.get("acquired", ""),
+                "successful"            : entry.get("successful", None),
+            }
+        status = True
 
         return status
 
     # -------------------------------------------------------------------------
     async def __get_oscal_versions(self, fetch="latest"):
-        """Pulls OSCAL version information and support files from GitHub and loads it into the database."""
+        """
+        Pulls OSCAL version information and support files from GitHub and loads it into the database.
+        - fetch: "latest" learns new versions (and retries incomplete ones),
+          "all" also checks every learned version for changed support files,
+          and a version (ie "v1.1.2") re-learns that version.
+        Only new or changed support files are downloaded. If every learned 
+        version is complete, the releases listing is requested conditionally,
+        so when nothing has changed on GitHub the update is a single request.
+        """
         status = True
         OSCAL_versions = []
         fetch_all = (fetch == "all")
         fetch_latest = (fetch == "latest")
         fetch_one = (fetch.startswith("v"))
+        all_stored = True
         
         self.__status_messages("Fetching OSCAL release informaiton from GitHub...")
         
         # Add small delay to allow UI updates
         await asyncio.sleep(0)
+
+        headers = {"Accept": "application/vnd.github+json"}
+        if not fetch_one and await self.db.record_count("oscal_versions", "coalesce(successful, 0) = 0") == 0:
+            etag = await self.__get_state(STATE_RELEASES_ETAG)
+            last_modified = await self.__get_state(STATE_RELEASES_LAST_MODIFIED)
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
         
-        repo_releases = await network.async_api_get(GitHub_API_root + "/repos/" + OSCAL_repo + "/releases")
+        http_status, repo_releases, response_headers = await network.async_fetch(GitHub_API_root + "/repos/" + OSCAL_repo + "/releases", headers, "json")
         self.__status_messages("Fetching OSCAL release information from GitHub...done.")
 
+        if http_status == 304:
+            self.__status_messages("OSCAL releases are unchanged since the last update.")
+            return status
+
         if repo_releases is not None:
             total_releases = len(repo_releases)
             
@@ -217,36 +293,46 @@ class OSCAL_support:
                     if (oscal_version not in DEFAULT_EXCLUDE_VERSIONS):
                         self.__status_messages(f"Found non-excluded OSCAL Version {oscal_version}") 
                         
+                        # "latest" learns new versions and retries incomplete ones.
+                        # "all" also checks complete versions for changed support files.
+                        learned = (oscal_version in self.versions) and not fetch_one
+                        complete = learned and bool(self.versions[oscal_version].get("successful"))
                         ok_to_continue = (fetch_all or 
-                                        (fetch_latest and oscal_version not in self.versions) or
+                                        (fetch_latest and not complete) or
                                         (fetch_one and oscal_version == fetch))
 
                         if ok_to_continue:
                             self.__status_messages(f"Processing {oscal_version} release...")
-                            release_date = entry.get("published_at", "0000-00-00T00:00:00Z")
-                            release_name = entry.get("name", "")
-                            github_location = f"{OSCAL_Release_URL}/{oscal_version}" 
-                            documentation_location = f"{OSCAL_documentation}/{oscal_version}" 
-                            await self.__clear_oscal_version(oscal_version)
-                            
-                            # Split up the database operations to allow more UI updates
-                            await asyncio.sleep(0)
-                            
-                            logger.info(f"Learning {oscal_version}, released {release_date} ...")
-                            if await self.db.insert("oscal_versions", {
-                                "version": oscal_version,
-                                "released": release_date,
-                                "title": release_name,
-                                "github_location": github_location,
-                                "documentation_location": documentation_location,
-                                "acquired": misc.oscal_date_time_with_timezone()
-                            }):
+                            version_ready = learned
+                            if not learned:
+                                release_date = entry.get("published_at", "0000-00-00T00:00:00Z")
+                                release_name = entry.get("name", "")
+                                github_location = f"{OSCAL_Release_URL}/{oscal_version}" 
+                                documentation_location = f"{OSCAL_documentation}/{oscal_version}" 
+                                await self.__clear_oscal_version(oscal_version)
+                                
+                                # Split up the database operations to allow more UI updates
+                                await asyncio.sleep(0)
+                                
+                                logger.info(f"Learning {oscal_version}, released {release_date} ...")
+                                version_ready = await self.db.insert("oscal_versions", {
+                                    "version": oscal_version,
+                                    "released": release_date,
+                                    "title": release_name,
+                                    "github_location": github_location,
+                                    "documentation_location": documentation_location,
+                                    "acquired": misc.oscal_date_time_with_timezone(datetime.now())
+                                })
+                                if not version_ready:
+                                    logger.error(f"Unable to insert OSCAL version {oscal_version} into support database.")
+
+                            if version_ready:
                                 OSCAL_versions.append(oscal_version)
-                                if "assets" in entry:
-                                    # Process assets in chunks
-                                    await self.__get_support_files(oscal_version, entry["assets"])
+                                successful = await self.__get_support_files(oscal_version, entry.get("assets", []))
+                                all_stored = all_stored and successful
+                                await self.db.db_execute(f"UPDATE oscal_versions SET successful = {misc.iif(successful, 1, 0)} WHERE version = '{oscal_version}';")
                             else:
-                                logger.error(f"Unable to insert OSCAL version {oscal_version} into support database.")
+                                all_stored = False
                         else:
                             self.__status_messages(f"Skipping {oscal_version} release.")
                     else:
@@ -254,92 +340,165 @@ class OSCAL_support:
                 
                 # Add small delay after processing each version
                 await asyncio.sleep(0)
+
+            # Only remember the listing once everything in it has been learned, 
+            # so an incomplete update is retried in full next time.
+            if all_stored and not fetch_one:
+                await self.__set_state({
+                    STATE_RELEASES_ETAG: response_headers.get("ETag", ""),
+                    STATE_RELEASES_LAST_MODIFIED: response_headers.get("Last-Modified", "")
+                })
         else:
             logger.error("Unable to fetch release information from GitHub.") 
             status = False
 
         if status:
             self.__status_messages("OSCAL version information loaded successfully.")
-            self.__status_messages(f"Learned {len(OSCAL_versions)} OSCAL versions.")
+            self.__status_messages(f"Checked {len(OSCAL_versions)} OSCAL versions.")
             self.__status_messages(f"OSCAL versions: {', '.join(OSCAL_versions)}")
 
         return status
 
     # -------------------------------------------------------------------------
     async def __get_support_files(self, version, assets):
-        """Modified to use async network operations and process in chunks"""
-        status = False
-        chunk_size = 3  # Process assets in chunks of 3
-        
-        # Split assets into chunks
-        for i in range(0, len(assets), chunk_size):
-            chunk = assets[i:i + chunk_size]
-            tasks = []
-            
-            for asset in chunk:
-                asset_name = asset.get("name", "")
-                for pattern in SUPPORT_FILE_PATTERNS:
-                    if pattern in asset_name:
+        """
+        Downloads and stores the new or changed support files among a release's assets.
+        Downloads run concurrently in a sliding window (network.DOWNLOAD_CONCURRENCY),
+        so one slow asset does not hold up the others.
+        Returns True if every support file in the release is stored.
+        """
+        learned = {}
+        async for row in self.db.iterate("SELECT model, type, filecache_uuid, asset_size, asset_updated, asset_digest FROM oscal_support WHERE version = ?", (version,)):
+            learned[(row["model"], row["type"])] = row
+
+        tasks = []
+        unchanged = 0
+        for asset in assets:
+            asset_name = asset.get("name", "")
+            for pattern in SUPPORT_FILE_PATTERNS:
+                if pattern in asset_name:
+                    if asset_unchanged(asset, learned.get(asset_identity(asset_name, pattern))):
+                        unchanged += 1
+                    else:
                         tasks.append(self.__process_single_asset(version, asset, pattern))
-            
-            # Process chunk of assets concurrently
-            if tasks:
-                await asyncio.gather(*tasks)
-                # Allow UI update after each chunk
-                await asyncio.sleep(0)
+
+        if unchanged:
+            self.__status_messages(f"[{version}] {unchanged} support files are unchanged.")
+        results = []
+        if tasks:
+            results = await network.gather_bounded(tasks)
+            if self.store is not None:
+                self.store.save_index()
+            # Allow UI update after the release
+            await asyncio.sleep(0)
         
-        status = True
-        return status
+        return all(results)
 
     # -------------------------------------------------------------------------
     async def __process_single_asset(self, version, asset, pattern):
-        """Helper method to process a single asset"""
+        """
+        Downloads and stores a single support file, and records where it came from.
+        Returns True if successful.
+        """
+        status = False
         asset_name = asset.get("name", "")
-        asset_URL = asset.get("browser_download_url", "")
-        model_name = asset_name.replace("oscal_", "").replace(pattern, "")
-
-        # Special case for SSP and POAM
-        if model_name == "ssp": model_name = "system-security-plan"
-        if model_name == "poam": model_name = "plan-of-action-and-milestones"
-        
-        uuid_value = str(uuid.uuid4())
-        # acquired = misc.oscal_date_time_with_timezone()
-        
-        self.__status_messages(f"Downloading {asset_name}...")
-        
-        # Perform database inserts
-        
-        await self.db.insert("oscal_support", {
-            "version": version,
-            "model": model_name,
-            "type": SUPPORT_FILE_PATTERNS[pattern],
-            "filecache_uuid": uuid_value
-        })
-        
+        asset_digest = asset.get("digest") or ""
+        model_name, file_type = asset_identity(asset_name, pattern)
+        digest = ""
+
+        # Support files are keyed by content. Many files are unchanged
+        # between OSCAL releases, and are only stored once. When GitHub
+        # reports the digest, a file that is already stored is not downloaded.
+        if asset_digest.startswith("sha256:") and await self.db.record_count("filecache", "uuid = ?", (asset_digest[7:],)) > 0:
+            digest = asset_digest[7:]
+            self.__status_messages(f"[{version}] {asset_name} is unchanged from a learned version. Not downloaded.")
+        else:
+            self.__status_messages(f"Downloading {asset_name}...")
+            digest = await self.__download_verified(version, asset, file_type)
+
+        if digest:
+            previous = await self.__support_uuid(version, model_name, file_type)
+            batches = [
+                ("DELETE FROM oscal_support WHERE version = ? AND model = ? AND type = ?", [(version, model_name, file_type)]),
+                ("INSERT INTO oscal_support (version, model, type, filecache_uuid, asset_size, asset_updated, asset_digest) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(version, model_name, file_type, digest, asset.get("size"), asset.get("updated_at"), asset_digest)]),
+                # A replaced support file that no other version uses
+                ("DELETE FROM filecache WHERE uuid = ? AND uuid NOT IN (SELECT filecache_uuid FROM oscal_support)",
+                    [(previous,)] if previous and previous != digest else [])
+            ]
+            status = await self.db.db_execute_many(batches) >= 0
+            if status:
+                cache_files.forget_support_files(version, model_name, file_type)
+                self.__status_messages(f"Downloaded [{version}] {asset_name}")
+        return status
 
-        # Download file content asynchronously
-        content = await network.async_download_file(asset_URL, asset_name)
+    # -------------------------------------------------------------------------
+    async def __download_verified(self, version, asset, file_type):
+        """
+        Streams a release asset to a temporary file, verifies it against the 
+        size and digest GitHub reports, and stores it. The content is hashed
+        and compressed in chunks, so memory use does not depend on asset size.
+        The verified file is kept in the support file store.
+        Returns the SHA-256 digest of the stored content, or an empty string.
+        """
+        asset_name = asset.get("name", "")
+        asset_URL = asset.get("browser_download_url", "")
+        asset_digest = asset.get("digest") or ""
+        if self.store is not None and self.store.ready:
+            download_path = self.store.temp_file()
+        else:
+            handle, download_path = tempfile.mkstemp(suffix=".tmp")
+            os.close(handle)
 
-        # await self.db.insert("filecache", {
-        #     "uuid": uuid_value,
-        #     "filename": asset_name,
-        #     "original_location": asset_URL,
-        #     "acquired": acquired
-        # })
+        digest = ""
+        try:
+            digest = await network.async_download_to_file(asset_URL, download_path)
+            if not digest:
+                self.__status_messages(f"Failed to download {asset_name}", "error")
+            elif asset_digest.startswith("sha256:") and asset_digest[7:] != digest:
+                self.__status_messages(f"[{version}] {asset_name} does not match the digest reported by GitHub. Not stored.", "error")
+                digest = ""
+            elif asset.get("size") is not None and asset.get("size") != os.path.getsize(download_path):
+                self.__status_messages(f"[{version}] {asset_name} is not the size reported by GitHub. Not stored.", "error")
+                digest = ""
+            elif await self.db.record_count("filecache", "uuid = ?", (digest,)) > 0:
+                self.__status_messages(f"[{version}] {asset_name} is unchanged from a learned version.")
+            else:
+                attributes = {
+                    "filename": asset_name,
+                    "original_location": asset_URL,
+                    "mime_type": "application/octet-stream",
+                    "file_type": file_type,
+                    "acquired": misc.oscal_date_time_with_timezone(datetime.now()),
+                    "sha256": digest
+                }
+                if not await self.db.cache_file_from_path(download_path, digest, attributes):
+                    self.__status_messages(f"Unable to store {asset_name}", "error")
+                    digest = ""
+
+            if digest and self.store is not None and self.store.ready:
+                self.store.put_file(download_path, digest)
+                self.store.remember(digest, digest)
+        except OSError as error:
+            self.__status_messages(f"Unable to save {asset_name} to {download_path} ({type(error).__name__}): {str(error)}", "error")
+            digest = ""
+        finally:
+            if os.path.exists(download_path):
+                os.remove(download_path)
+        return digest
 
+    # -------------------------------------------------------------------------
+    async def __get_state(self, key):
+        """Returns a value from the support_state table, or an empty string."""
+        results = await self.db.query("SELECT value FROM support_state WHERE key = ?", (key,))
+        if results and results[0]["value"] is not None:
+            return results[0]["value"]
+        return ""
+    # -------------------------------------------------------------------------
+    async def __set_state(self, values):
+        """Saves a dict of values to the support_state table. Returns True if successful."""
+        return await self.db.db_execute_many([("INSERT OR REPLACE INTO support_state (key, value) VALUES (?, ?)", list(values.items()))]) >= 0
 
-        if content:
-            attributes = {
-                "filename": asset_name,
-                "original_location": asset_URL,
-                "mime_type": "application/octet-stream",
-                "file_type": SUPPORT_FILE_PATTERNS[pattern],
-                "acquired": misc.oscal_date_time_with_timezone()
-            }
-            await self.db.cache_file(content, uuid_value, attributes)
-            self.__status_messages(f"Downloaded [{version}] {asset_name}")
-        else:
-            self.__status_messages(f"Failed to download {asset_name}", "error")
     # -------------------------------------------------------------------------
     async def __clear_oscal_version(self, version):
         """
@@ -349,11 +508,16 @@ class OSCAL_support:
 
         sql_commands = [
             # "BEGIN TRANSACTION;",
+            # Support files shared with other versions are kept
             f""" 
             WITH uuids_to_delete AS (
                 SELECT filecache_uuid
                 FROM oscal_support
                 WHERE version = '{version}'
+                EXCEPT
+                SELECT filecache_uuid
+                FROM oscal_support
+                WHERE version <> '{version}'
             )
             DELETE FROM filecache
             WHERE uuid IN (SELECT filecache_uuid FROM uuids_to_delete);""",
@@ -400,8 +564,8 @@ class OSCAL_support:
         try:
             match fetch:
                 case "all":
-                    self.__status_messages("Starting full refresh of OSCAL support content...")
-                    status = await self.__clear_oscal_versions()
+                    self.__status_messages("Checking all OSCAL versions for new or changed support content...")
+                    status = True
                 case "latest":
                     self.__status_messages("Checking for new OSCAL versions...")
                     status = True
@@ -426,10 +590,329 @@ class OSCAL_support:
             logger.error(f"Error during update: {e}")
             self.__status_messages(f"Error during update: {str(e)}", "error")
             status = False
+        finally:
+            await network.close_session()
+            await self.db.refresh_mirror()
             
         return status
 
 
+    # -------------------------------------------------------------------------
+    async def rehash(self, backend=None):
+        """
+        Converts support files learned before content hashing to 
+        content-addressed filecache entries. Files with identical content
+        are merged into one entry, and the database is compacted to return 
+        the space (see Database.compact()). A database created before 
+        incremental vacuum was enabled is converted. Safe to run more than once.
+        Returns a dict with the number of entries converted and merged,
+        and the database size before and after.
+        """
+        self.backend = backend
+        result = {"converted": 0, "merged": 0, "size_before": 0, "size_after": 0}
+        if self.db_type == "sqlite3" and os.path.isfile(self.db_conn):
+            result["size_before"] = os.path.getsize(self.db_conn)
+
+        entries = await self.db.query("SELECT DISTINCT filecache_uuid FROM oscal_support")
+        for entry in entries:
+            key = entry.get("filecache_uuid") or ""
+            if SHA256_PATTERN.match(key):
+                continue # Already content-addressed
+            content = await self.db.retrieve_file_bytes(key)
+            if content is None:
+                logger.warning(f"Support file {key} is missing from the filecache. Not rehashed.")
+                continue
+
+            digest = content_digest(content)
+            if await self.db.record_count("filecache", "uuid = ?", (digest,)) > 0:
+                batches = [
+                    ("UPDATE oscal_support SET filecache_uuid = ? WHERE filecache_uuid = ?;", [(digest, key)]),
+                    ("DELETE FROM filecache WHERE uuid = ?;", [(key,)])
+                ]
+                counter = "merged"
+            else:
+                batches = [
+                    ("UPDATE filecache SET uuid = ?, sha256 = ? WHERE uuid = ?;", [(digest, digest, key)]),
+                    ("UPDATE oscal_support SET filecache_uuid = ? WHERE filecache_uuid = ?;", [(digest, key)])
+                ]
+                counter = "converted"
+            if await self.db.db_execute_many(batches) >= 0:
+                result[counter] += 1
+            else:
+                self.__status_messages(f"Unable to rehash support file {key}", "error")
+            await asyncio.sleep(0)
+
+        if result["merged"]:
+            await self.db.compact(convert=True)
+        if result["converted"] or result["merged"]:
+            cache_files.forget_support_files()
+        await self.db.refresh_mirror()
+        if self.db_type == "sqlite3" and os.path.isfile(self.db_conn):
+            result["size_after"] = os.path.getsize(self.db_conn)
+        self.__status_messages(f"Rehashed support files: {result['converted']} converted, {result['merged']} duplicates merged. "
+                               f"Database size {result['size_before']:,} -> {result['size_after']:,} bytes.")
+        return result
+
+    # -------------------------------------------------------------------------
+    async def collect_garbage(self, convert=False, grace_seconds=database.GC_GRACE_SECONDS):
+        """
+        Deletes filecache entries that no OSCAL version refers to, such as 
+        files from failed downloads, then returns the space to the file system.
+        - convert (bool)[optional]: Rebuilds a support database created 
+          before incremental vacuum was enabled (see Database.compact()).
+        Returns a dict with the number of entries deleted, the pages freed,
+        and the database size before and after.
+        """
+        result = {"deleted": 0, "freed_pages": 0, "size_before": 0, "size_after": 0}
+        if self.db_type == "sqlite3" and os.path.isfile(self.db_conn):
+            result["size_before"] = os.path.getsize(self.db_conn)
+
+        result["deleted"] = await self.db.collect_garbage(SUPPORT_FILE_REFERENCES, grace_seconds=grace_seconds)
+        if result["deleted"] > 0:
+            cache_files.forget_support_files()
+        if result["deleted"] >= 0:
+            result["freed_pages"] = await self.db.compact(convert=convert)
+        await self.db.refresh_mirror()
+
+        if self.db_type == "sqlite3" and os.path.isfile(self.db_conn):
+            result["size_after"] = os.path.getsize(self.db_conn)
+        self.__status_messages(f"Collected {result['deleted']} unreferenced support files. {result['freed_pages']} pages freed. "
+                               f"Database size {result['size_before']:,} -> {result['size_after']:,} bytes.")
+        return result
+
+    # -------------------------------------------------------------------------
+    async def benchmark_compression(self, version=None):
+        """
+        Measures the stored size and decompression time of each available
+        compression codec and level on the learned support files.
+        - version (str)[optional]: Limits the samples to one OSCAL version.
+          Defaults to the latest learned version.
+        Returns a list of dicts, as for compression.benchmark().
+        """
+        if version is None and self.versions:
+            version = max(self.versions, key=lambda key: self.versions[key].get("released") or "")
+        samples = {}
+        async for entry in self.db.iterate("SELECT model, type, filecache_uuid FROM oscal_support WHERE version = ?", (version,)):
+            content = await self.db.retrieve_file_bytes(entry["filecache_uuid"])
+            if content:
+                samples[f"{entry['model']}/{entry['type']}"] = content
+
+        results = await asyncio.get_running_loop().run_in_executor(None, compression.benchmark, samples)
+        original = sum(len(content) for content in samples.values())
+        self.__status_messages(f"[{version}] {len(samples)} support files, {original:,} bytes uncompressed.")
+        for result in results:
+            self.__status_messages(f"{result['codec']:>5} {result['level']:>2}: {result['size']:>11,} bytes ({result['ratio']:6.1%})  "
+                                   f"compress {result['compress_ms']:8.1f} ms  decompress {result['decompress_ms']:7.1f} ms")
+        return results
+
+    # -------------------------------------------------------------------------
+    async def export_bundle(self, bundle_file, versions=None):
+        """
+        Exports learned OSCAL versions and their support files to a single,
+        compressed bundle file, for use on systems without internet access.
+        - bundle_file (str): The bundle file to create (overwritten if present)
+        - versions (list)[optional]: The versions to export. Default: all learned versions
+        Each support file is stored once, named by its SHA-256 digest.
+        Returns the number of support files exported. -1 if unsuccessful.
+        """
+        count = -1
+        versions = [version for version in (versions or self.versions.keys()) if version in self.versions]
+        if not versions:
+            logger.error("No learned OSCAL versions to export.")
+            return count
+        version_list = ", ".join("?" * len(versions))
+
+        manifest = {
+            "format": BUNDLE_FORMAT,
+            "created": misc.oscal_date_time_with_timezone(datetime.now()),
+            "versions": await self.db.query(f"SELECT * FROM oscal_versions WHERE version IN ({version_list})", tuple(versions)),
+            "support": await self.db.query(f"SELECT version, model, type, filecache_uuid, asset_size, asset_updated, asset_digest FROM oscal_support WHERE version IN ({version_list})", 
+                                           tuple(versions)),
+            "files": {}
+        }
+        keys = tuple({entry["filecache_uuid"] for entry in manifest["support"]})
+        metadata = await self.db.query(f"SELECT uuid, {', '.join(FILECACHE_METADATA_FIELDS)} FROM filecache WHERE uuid IN ({', '.join('?' * len(keys))})", keys)
+
+        try:
+            digests = {}
+            with zipfile.ZipFile(bundle_file, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=9) as bundle:
+                for entry in metadata:
+                    content = await self.db.retrieve_file_bytes(entry["uuid"])
+                    if content is None:
+                        continue
+                    # Databases that were not rehashed still use random keys
+                    digest = entry["uuid"] if SHA256_PATTERN.match(entry["uuid"]) else content_digest(content)
+                    digests[entry["uuid"]] = digest
+                    if digest not in manifest["files"]:
+                        bundle.writestr(f"{BUNDLE_FILES}{digest}", content)
+                        manifest["files"][digest] = {field: entry.get(field) for field in FILECACHE_METADATA_FIELDS}
+                        manifest["files"][digest]["size"] = len(content)
+                    await asyncio.sleep(0)
+
+                manifest["support"] = [dict(entry, filecache_uuid=digests[entry["filecache_uuid"]]) 
+                                       for entry in manifest["support"] if entry["filecache_uuid"] in digests]
+                bundle.writestr(BUNDLE_MANIFEST, json.dumps(manifest, indent=1))
+            count = len(manifest["files"])
+            self.__status_messages(f"Exported {len(versions)} OSCAL versions ({count} support files) to {bundle_file}")
+        except (Exception, BaseException) as error:
+            logger.error(f"Unable to export support bundle {bundle_file} ({type(error).__name__}): {str(error)}")
+            count = -1
+        return count
+
+    # -------------------------------------------------------------------------
+    async def import_bundle(self, bundle_file, backend=None):
+        """
+        Imports OSCAL versions and support files from a bundle created by 
+        export_bundle(). Versions in the bundle replace the same versions 
+        in the support database. Support files already present are not 
+        stored again. Each support file is checked against its SHA-256 
+        digest. The import is a single transaction: either all of the 
+        bundle is imported, or none of it.
+        Returns the number of versions imported. -1 if unsuccessful.
+        """
+        self.backend = backend
+        count = -1
+        try:
+            with zipfile.ZipFile(bundle_file, "r") as bundle:
+                manifest = json.loads(bundle.read(BUNDLE_MANIFEST))
+                if manifest.get("format") != BUNDLE_FORMAT:
+                    logger.error(f"Unrecognized support bundle format: {manifest.get('format')}")
+                    return count
+
+                versions = [(entry["version"],) for entry in manifest.get("versions", [])]
+                version_fields = [field["name"] for field in OSCAL_SUPPORT_TABLES["oscal_versions"]["table_fields"]]
+                filecache_fields = ["uuid", "sha256", "compressed", "codec", "content"] + FILECACHE_METADATA_FIELDS
+
+                digests = tuple(manifest.get("files", {}))
+                present = {entry["uuid"] for entry in await self.db.query(f"SELECT uuid FROM filecache WHERE uuid IN ({', '.join('?' * len(digests))})", digests)}
+
+                def filecache_rows():
+                    """
+                    Reads, verifies and compresses one support file at a time as the rows are inserted.
+                    Support files are reused by digest, so content that does not match its digest fails the import.
+                    """
+                    for digest, metadata in manifest.get("files", {}).items():
+                        if digest in present:
+                            continue
+                        content = bundle.read(f"{BUNDLE_FILES}{digest}")
+                        if content_digest(content) != digest:
+                            raise ValueError(f"Support file {digest} does not match its digest. The bundle is corrupt or was altered.")
+                        content, codec = type_sqlite3.pack_blob(content, database.CONTENT_COMPRESSION, metadata.get("file_type", ""))
+                        yield tuple([digest, digest, int(codec != compression.CODEC_NONE), codec, content] + [metadata.get(field) for field in FILECACHE_METADATA_FIELDS])
+
+                batches = [
+                    ("DELETE FROM oscal_support WHERE version = ?", versions),
+                    ("DELETE FROM oscal_versions WHERE version = ?", versions),
+                    (f"INSERT INTO oscal_versions ({', '.join(version_fields)}) VALUES ({', '.join('?' * len(version_fields))})",
+                        [tuple(entry.get(field) for field in version_fields) for entry in manifest.get("versions", [])]),
+                    ("INSERT INTO oscal_support (version, model, type, filecache_uuid, asset_size, asset_updated, asset_digest) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [(entry["version"], entry["model"], entry["type"], entry["filecache_uuid"],
+                          entry.get("asset_size"), entry.get("asset_updated"), entry.get("asset_digest")) for entry in manifest.get("support", [])]),
+                    (f"INSERT OR IGNORE INTO filecache ({', '.join(filecache_fields)}) VALUES ({', '.join('?' * len(filecache_fields))})",
+                        filecache_rows())
+                ]
+                started = datetime.now()
+                if await self.db.db_execute_many(batches) >= 0:
+                    cache_files.forget_support_files()
+                    count = len(versions)
+                    self.__status_messages(f"Imported {count} OSCAL versions from {bundle_file} in {(datetime.now() - started).total_seconds():.2f}s.")
+                    await self.__load_versions()
+                else:
+                    self.__status_messages(f"Unable to import support bundle {bundle_file}", "error")
+        except (Exception, BaseException) as error:
+            logger.error(f"Unable to import support bundle {bundle_file} ({type(error).__name__}): {str(error)}")
+            count = -1
+        await self.db.refresh_mirror()
+        return count
+
+    # -------------------------------------------------------------------------
+    async def __support_uuid(self, version, model, file_type):
+        """Returns the filecache UUID of a support file, or an empty string if not learned."""
+        support = await self.get_support(version, model, file_type, content=False)
+        if support:
+            return support["filecache_uuid"]
+        logger.debug(f"No {file_type} support file for {model} {version}")
+        return ""
+    # -------------------------------------------------------------------------
+    async def get_support(self, version, model, file_type, content=True):
+        """
+        Looks up a learned support file with one indexed query.
+        - version: The OSCAL version (ie "v1.1.2" or "1.1.2")
+        - model: The OSCAL model name (ie "catalog", "system-security-plan")
+        - file_type: A SUPPORT_FILE_PATTERNS type (ie "xml-schema", "xml-to-json")
+        - content (bool)[optional]: Include the file content (bytes). Default: True
+        Returns a dict of version, model, type, filecache_uuid, filename,
+        original_location, mime_type, acquired and (optionally) content.
+        Returns None if the support file is not learned.
+        """
+        return support_result(await self.db.query(*support_query(version, model, file_type, content)))
+    # -------------------------------------------------------------------------
+    def lookup_support(self, version, model, file_type, content=True):
+        """
+        The same as get_support(), for callers that are not coroutines
+        (ie cache_files.get_support_file). The query blocks, so call this 
+        from worker threads only, never from the event loop thread.
+        """
+        return support_result(self.db.query_sync(*support_query(version, model, file_type, content)))
+    # -------------------------------------------------------------------------
+    async def __support_digest(self, version, model, file_type):
+        """Extracts a support file into the store if needed, and returns its digest."""
+        digest = ""
+        if self.store is not None and self.store.ready:
+            filecache_uuid = await self.__support_uuid(version, model, file_type)
+            if filecache_uuid and await self.store.extract(self.db, filecache_uuid) is not None:
+                digest = self.store.digest_for(filecache_uuid)
+        return digest
+    # -------------------------------------------------------------------------
+    async def support_file_path(self, version, model, file_type):
+        """
+        Returns the path of an extracted copy of a support file, which 
+        xmlschema and Saxon can open directly. The file is extracted from
+        the filecache the first time it is requested.
+        - version: The OSCAL version (ie "v1.1.2")
+        - model: The OSCAL model name (ie "catalog", "system-security-plan")
+        - file_type: A SUPPORT_FILE_PATTERNS type (ie "xml-schema", "xml-to-json")
+        Returns the path, or None if the support file is not available.
+        """
+        return self.store.path(await self.__support_digest(version, model, file_type)) if self.store else None
+    # -------------------------------------------------------------------------
+    async def support_file_view(self, version, model, file_type):
+        """
+        Returns a read-only mmap of a support file, extracting it first if 
+        necessary. The caller should close the map when done.
+        Returns None if the support file is not available.
+        """
+        return self.store.view(await self.__support_digest(version, model, file_type)) if self.store else None
+
+    # -------------------------------------------------------------------------
+    async def prewarm(self, targets, file_types=PREWARM_FILE_TYPES):
+        """
+        Prepares schemas ahead of first use, so the first import validates
+        as fast as later ones. Intended to run as a background task.
+        Each schema is extracted into the support file store, then compiled
+        by the import worker processes, where validation runs (see 
+        oscal_importer.prewarm_workers()). Nothing is compiled on the event loop.
+        - targets: A list of (version, model) tuples
+        - file_types (list)[optional]: The support file types to prepare
+        Returns the number of support files prepared.
+        """
+        schemas = []
+        started = datetime.now()
+        for version, model in targets:
+            version = oscal_importer.support_version(version) # Content declares "1.1.2". Releases are tagged "v1.1.2".
+            if version not in self.versions:
+                logger.debug(f"Skipping prewarm of {model} {version}. Version not learned.")
+                continue
+            for file_type in file_types:
+                path = await self.support_file_path(version, model, file_type)
+                if path is not None:
+                    schemas.append((path, "xml" if file_type == "xml-schema" else "json"))
+        if self.store is not None:
+            self.store.save_index()
+        await oscal_importer.prewarm_workers(schemas)
+        logger.info(f"Prewarmed {len(schemas)} support files in {(datetime.now() - started).total_seconds():.2f}s.")
+        return len(schemas)
+
     # -------------------------------------------------------------------------
     def supported(self, oscal_version, assets):
         """
@@ -442,6 +925,57 @@ class OSCAL_support:
         return status
 
 # -----------------------------------------------------------------------------
+def support_query(version, model, file_type, content=True):
+    """Returns the (SQL, parameters) of the indexed support file lookup."""
+    version = version.lower()
+    if not version.startswith("v"):
+        version = f"v{version}" # Content declares "1.1.2". Releases are tagged "v1.1.2".
+    fields = SUPPORT_LOOKUP_FIELDS + (", f.compressed, f.codec, f.content" if content else "")
+    return f"SELECT {fields} {SUPPORT_LOOKUP_FROM}", (version, model, file_type)
+
+# -----------------------------------------------------------------------------
+def support_result(results):
+    """Returns the first row of a support_query() result with its content decompressed, or None."""
+    if not results:
+        return None
+    support = results[0]
+    if "content" in support:
+        codec = compression.stored_codec(support.pop("codec"), support.pop("compressed"))
+        support["content"] = type_sqlite3.unpack_blob(support["content"], codec)
+    return support
+
+# -----------------------------------------------------------------------------
+def asset_identity(asset_name, pattern):
+    """Returns the (model, support file type) of a release asset matching a SUPPORT_FILE_PATTERNS pattern."""
+    model_name = asset_name.replace("oscal_", "").replace(pattern, "")
+
+    # Special case for SSP and POAM
+    if model_name == "ssp": model_name = "system-security-plan"
+    if model_name == "poam": model_name = "plan-of-action-and-milestones"
+    return model_name, SUPPORT_FILE_PATTERNS[pattern]
+
+# -----------------------------------------------------------------------------
+def asset_unchanged(asset, learned):
+    """
+    Returns True if a GitHub release asset is the one already learned.
+    - asset: The asset from the GitHub releases listing
+    - learned: The oscal_support row for the asset, or None
+    """
+    if not learned:
+        return False
+    asset_digest = asset.get("digest") or ""
+    if asset_digest.startswith("sha256:"):
+        return asset_digest[7:] == learned.get("filecache_uuid")
+    return (bool(learned.get("asset_updated"))
+            and learned.get("asset_updated") == asset.get("updated_at")
+            and learned.get("asset_size") == asset.get("size"))
+
+# -----------------------------------------------------------------------------
+def content_digest(content) -> str:
+    """Returns the SHA-256 hex digest of support file content (bytes, or str as UTF-8)."""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Main
@@ -1,6 +1,7 @@
 from loguru import logger
 from jinja2 import Template, BaseLoader, TemplateNotFound, Environment
 import asyncio
+from PySide6.QtWidgets import QFileDialog
 
 from oscal_project_class import *
 
@@ -44,6 +45,8 @@ async def initialize(backend):
             backend.project = await OSCAL_project.load(backend.project_file)
         if backend.project is not None:
             main_content(backend)
+            app_instance.start_prewarm(await backend.project.models_in_use())
+            app_instance.start_maintenance(backend.project)
             status = True
         else:
             logger.error("Failed to load project file.")
@@ -100,6 +103,11 @@ async def handler(backend, command):
                         case "open":
                             logger.info("Open button clicked")
                             await process_update(backend, "open")
+                        case "import":
+                            logger.info("Import button clicked")
+                            backend.spinner(on=True)
+                            backend.current_task = asyncio.create_task(process_update(backend, "import"))
+                            status = True
 
                         case _:
                             logger.debug(f"Ignoring button {command['id']}")
@@ -124,10 +132,24 @@ async def process_update(backend, command):
             case "command":
                 logger.debug("Get Started command")
                 # backend.render_page("concept_page.html")
+            case "import":
+                files, _ = QFileDialog.getOpenFileNames(
+                    caption="Import OSCAL Files",
+                    dir=backend.app_instance.config["location"]["content"]["data"],
+                    filter="OSCAL Files (*.xml *.json *.yaml *.yml);; All Files (*.*)"
+                )
+                if files and backend.project is not None:
+                    results = await backend.project.oscal_import(files, backend.app_instance.support, backend)
+                    imported = [result["uuid"] for result in results.values() if result["uuid"]]
+                    if imported:
+                        await backend.project.resolve_imports(imported, backend.app_instance.support, backend)
             case _:
                 logger.debug(f"Unknown command: {command}")
 
     except Exception as e:
         logger.error(f"Error during update process: {e}")
         backend.status_update(f"Error during update: {str(e)}", "error")
+    finally:
+        if command == "import":
+            backend.spinner(on=False)
 